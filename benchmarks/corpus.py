@@ -0,0 +1,343 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import sys
+import getopt
+import numpy as np
+import climate
+logging = climate.get_logger('corpus')
+
+
+"""
+Writes synthetic feature corpora with the file layout read by the classes in dataset.py, to load test the file index,
+the sampler and the prefetcher with as many files as needed without computing features from audio.
+Every track has its notes (midi pitch, onset and offset) drawn at random, the magnitude spectrogram of a source is a noise
+floor with the harmonics of its notes, and the mixture is the sum of the sources. For a track named e.g. \"track000001\":
+    layout \"single\" (LargeDataset, LargeDatasetMask1, LargeDatasetPitch1):
+        track000001__m_.data       (1+nsources, nframes, input_size), the mixture followed by the sources
+    layout \"multi\" (LargeDatasetMulti, LargeDatasetMultiMask1), with prefix_in=\"in\" and prefix_out=\"out\":
+        track000001_in_m_.data     (channels, nframes, input_size)
+        track000001_out_m_.data    (channels*nsources, nframes, input_size), the sources of the first channel, then the second,...
+    and for both layouts:
+        track000001__g_.data       the aligned notes, (ninst, nnotes, 3+2*nharmonics) or (channels, ninst, nnotes, 3+2*nharmonics)
+        track000001__b_.data       the notes of the score, with their onsets and offsets shifted at random
+        track000001__e_.data       the notes of the score, extended with \"margin\" seconds at the onset and at the offset
+        track000001__<model>_.data extra features (nframes, feature_size), if \"model\" is given
+Each row of the notes is [onset_frame, offset_frame, midi_pitch, bin_start_1, bin_stop_1, ... bin_start_n, bin_stop_n],
+as computed by util.expandMidi. The tracks can be spread over \"ndirs\" subfolders to pass a list of paths to updatePath.
+"""
+def save_tensor(t, path):
+    """
+    Saves \"t\" as a .data file with its .shape file, as LargeDataset.saveTensor
+    """
+    t.astype(np.float64).tofile(path)
+    with open(path.replace('.data','.shape'), 'w') as fout:
+        fout.write(u'#'+'\t'.join(str(e) for e in t.shape)+'\n')
+
+
+def draw_notes(rng, ninst, nframes, density, framesPerSecond, pitch_range=(40, 80), max_length=1.):
+    """
+    Returns the notes [onset_frame, offset_frame, midi_pitch] of \"ninst\" monophonic instruments, shape (ninst, nnotes, 3),
+        where each instrument has \"density\" notes per second on average; the unused rows are zero
+
+    Parameters
+    ----------
+    rng : numpy.random.RandomState
+        The random generator
+    ninst : int
+        The number of instruments
+    nframes : int
+        The number of frames of the track
+    density : float
+        The average number of notes per second for each instrument
+    framesPerSecond : float
+        The number of frames in a second, sampleRate/hopSize
+    pitch_range : tuple, optional
+        The lowest and the highest midi pitch
+    max_length : float, optional
+        The maximum duration of a note in seconds
+    """
+    nnotes = int(np.maximum(1, np.ceil(density * nframes / framesPerSecond)))
+    notes = np.zeros((ninst, nnotes, 3))
+    for j in range(ninst):
+        #notes are placed one after another, with the pauses drawn such that the mean inter-onset interval is 1/density
+        ioi = rng.exponential(framesPerSecond / float(density), size=nnotes)
+        onsets = np.floor(np.cumsum(ioi) - ioi[0])
+        lengths = np.minimum(np.diff(np.append(onsets, nframes)), max_length * framesPerSecond)
+        lengths = np.floor(lengths * rng.uniform(0.5, 1., size=nnotes))
+        valid = (onsets < nframes) & (lengths > 0)
+        n = int(np.sum(valid))
+        notes[j,:n,0] = onsets[valid]
+        notes[j,:n,1] = np.minimum(onsets[valid] + lengths[valid], nframes)
+        notes[j,:n,2] = rng.randint(pitch_range[0], pitch_range[1], size=n)
+    return notes
+
+
+def expand_notes(notes, nharmonics, input_size, sampleRate, interval=50., shift=0., margin=0., nframes=None):
+    """
+    Returns the notes with the frequency bins of their harmonics, shape (ninst, nnotes, 3+2*nharmonics),
+        the bins of the harmonic h span \"interval\" cents around h*f0, as in util.expandMidi
+
+    Parameters
+    ----------
+    notes : 3D numpy array
+        The notes [onset_frame, offset_frame, midi_pitch], as returned by draw_notes
+    nharmonics : int
+        The number of harmonics
+    input_size : int
+        The number of frequency bins, frameSize/2+1
+    sampleRate : int
+        The sampling rate
+    interval : float, optional
+        The width in cents of the band around each harmonic
+    shift : 3D numpy array or float, optional
+        Frames added to the onsets and the offsets, as a deviation of the score from the performance
+    margin : float, optional
+        Frames removed from the onsets and added to the offsets
+    nframes : int, optional
+        The number of frames of the track, to clip the offsets
+    """
+    expanded = np.zeros(notes.shape[:-1] + (3 + 2*nharmonics,))
+    active = notes[...,2] > 0
+    onsets = notes[...,0] + shift - margin
+    offsets = notes[...,1] + shift + margin
+    if nframes is not None:
+        offsets = np.minimum(offsets, nframes)
+    expanded[...,0] = np.where(active, np.maximum(0, np.round(onsets)), 0)
+    expanded[...,1] = np.where(active, np.maximum(0, np.round(offsets)), 0)
+    expanded[...,2] = notes[...,2]
+    f0 = 440. * np.power(2., (notes[...,2] - 69) / 12.)
+    harmonics = f0[...,None] * np.arange(1, nharmonics + 1)
+    bins = 2. * (input_size - 1) / sampleRate
+    start = np.floor(harmonics * np.power(2., -interval / 2400.) * bins)
+    stop = np.ceil(harmonics * np.power(2., interval / 2400.) * bins) + 1
+    #harmonics above the nyquist frequency are left at zero
+    inside = active[...,None] & (stop < input_size)
+    expanded[...,3::2] = np.where(inside, start, 0)
+    expanded[...,4::2] = np.where(inside, stop, 0)
+    return expanded
+
+
+def render(rng, notes, nframes, input_size, floor=0.01):
+    """
+    Returns the magnitude spectrogram of each instrument, shape (ninst, nframes, input_size),
+        with a noise floor and the harmonics of the notes decaying as 1/h
+    """
+    mag = floor * rng.exponential(size=(notes.shape[0], nframes, input_size)).astype(np.float32)
+    for j in range(notes.shape[0]):
+        for p in range(notes.shape[1]):
+            if notes[j,p,2] > 0:
+                frames = slice(int(notes[j,p,0]), int(notes[j,p,1]))
+                for h,(b0,b1) in enumerate(zip(notes[j,p,3::2], notes[j,p,4::2])):
+                    if b1 > 0:
+                        mag[j,frames,int(b0):int(b1)] += 1. / (h + 1)
+    return mag
+
+
+def corpus_size(nfiles=8, duration=10., channels=1, nsources=4, sampleRate=44100, hopSize=512, frameSize=1024,
+    density=2., nharmonics=20, layout='single', model=None, feature_size=16):
+    """
+    Returns the size in bytes of the corpus written by \"generate\" with the same parameters, without the .shape files
+    """
+    nframes = int(round(duration * sampleRate / float(hopSize)))
+    input_size = int(frameSize / 2) + 1
+    nnotes = int(np.maximum(1, np.ceil(density * duration)))
+    if layout == 'single':
+        nmag = 1 + nsources
+    else:
+        nmag = channels * (1 + nsources)
+    size = nmag * nframes * input_size + 3 * channels * nsources * nnotes * (3 + 2*nharmonics)
+    if model is not None:
+        size = size + nframes * feature_size
+    return 8 * nfiles * size
+
+
+def write_track(args):
+    """
+    Writes the tensors of the track number \"index\" with the settings of \"generate\", the generator is seeded
+        with seed+index such that any track can be written again independently
+    """
+    index, path, settings = args
+    s = settings
+    rng = np.random.RandomState(s['seed'] + index)
+    framesPerSecond = s['sampleRate'] / float(s['hopSize'])
+    nframes = int(round(s['duration'] * framesPerSecond))
+    input_size = int(s['frameSize'] / 2) + 1
+    name = os.path.join(path, 'track%06d' % index)
+
+    notes = np.stack([draw_notes(rng, s['nsources'], nframes, s['density'], framesPerSecond) for c in range(s['channels'])])
+    aligned = expand_notes(notes, s['nharmonics'], input_size, s['sampleRate'], nframes=nframes)
+    #the sources are identical across channels up to a random panning gain
+    sources = np.stack([render(rng, aligned[c], nframes, input_size) for c in range(s['channels'])])
+    sources = sources * rng.uniform(0.3, 1., size=(s['channels'], s['nsources'], 1, 1)).astype(np.float32)
+
+    if s['layout'] == 'single':
+        save_tensor(np.concatenate([np.sum(sources[0], axis=0, keepdims=True), sources[0]]), name+'__m_.data')
+        notes = notes[0]
+        aligned = aligned[0]
+    else:
+        save_tensor(np.sum(sources, axis=1), name+'_'+s['prefix_in']+'_m_.data')
+        save_tensor(np.reshape(sources, (-1, nframes, input_size)), name+'_'+s['prefix_out']+'_m_.data')
+        if s['channels'] == 1:
+            notes = notes[0]
+            aligned = aligned[0]
+
+    shift = rng.normal(0, s['deviation'] * framesPerSecond, size=notes.shape[:-1])
+    save_tensor(aligned, name+'__g_.data')
+    save_tensor(expand_notes(notes, s['nharmonics'], input_size, s['sampleRate'], shift=shift, nframes=nframes), name+'__b_.data')
+    save_tensor(expand_notes(notes, s['nharmonics'], input_size, s['sampleRate'], shift=shift, margin=s['margin'] * framesPerSecond,
+        nframes=nframes), name+'__e_.data')
+    if s['model'] is not None:
+        save_tensor(rng.randn(nframes, s['feature_size']), name+'__'+s['model']+'_.data')
+    return index
+
+
+def generate(path, nfiles=8, duration=10., channels=1, nsources=4, sampleRate=44100, hopSize=512, frameSize=1024, density=2.,
+    nharmonics=20, layout='single', prefix_in='in', prefix_out='out', model=None, feature_size=16, deviation=0.05, margin=0.2,
+    ndirs=1, seed=0, nprocs=1):
+    """
+    Writes a synthetic corpus of \"nfiles\" tracks in \"path\" and returns the list of folders to give to updatePath
+
+    Parameters
+    ----------
+    path : string
+        The output folder, it is created if it does not exist
+    nfiles : int, optional
+        The number of tracks
+    duration : float, optional
+        The duration of each track in seconds
+    channels : int, optional
+        The number of audio channels, only for the \"multi\" layout
+    nsources : int, optional
+        The number of sources, each one has a monophonic instrument with notes
+    sampleRate : int, optional
+        The sampling rate
+    hopSize : int, optional
+        The hop size of the STFT, in samples
+    frameSize : int, optional
+        The frame size of the STFT, in samples; the number of frequency bins is frameSize/2+1
+    density : float, optional
+        The average number of notes per second for each source
+    nharmonics : int, optional
+        The number of harmonics in the notes tensors
+    layout : string, optional
+        \"single\" for LargeDataset or \"multi\" for LargeDatasetMulti
+    prefix_in : string, optional
+        The prefix of the input files for the \"multi\" layout
+    prefix_out : string, optional
+        The prefix of the output files for the \"multi\" layout
+    model : string, optional
+        If not None, the extra features are written as _\"model\"_ files
+    feature_size : int, optional
+        The size of the extra features
+    deviation : float, optional
+        The standard deviation in seconds of the score (_b_ and _e_) onsets and offsets from the aligned notes (_g_)
+    margin : float, optional
+        The seconds added before the onset and after the offset of the notes in the _e_ files
+    ndirs : int, optional
+        The number of subfolders \"dir0\", \"dir1\",... across which the tracks are spread
+    seed : int, optional
+        The seed of the random generator
+    nprocs : int, optional
+        The number of processes writing the tracks
+    """
+    assert layout in ['single', 'multi'], "layout must be single or multi"
+    assert layout == 'multi' or channels == 1, "the single layout has only one channel, use the multi layout"
+    settings = {'duration': duration, 'channels': channels, 'nsources': nsources, 'sampleRate': sampleRate, 'hopSize': hopSize,
+        'frameSize': frameSize, 'density': density, 'nharmonics': nharmonics, 'layout': layout, 'prefix_in': prefix_in,
+        'prefix_out': prefix_out, 'model': model, 'feature_size': feature_size, 'deviation': deviation, 'margin': margin, 'seed': seed}
+    if ndirs > 1:
+        paths = [os.path.join(path, 'dir%d' % d) for d in range(ndirs)]
+    else:
+        paths = [path]
+    for p in paths:
+        if not os.path.exists(p):
+            os.makedirs(p)
+    logging.info('writing %d tracks (%.1f MB) in %s', nfiles, corpus_size(nfiles, duration=duration, channels=channels,
+        nsources=nsources, sampleRate=sampleRate, hopSize=hopSize, frameSize=frameSize, density=density, nharmonics=nharmonics,
+        layout=layout, model=model, feature_size=feature_size) / 1e6, path)
+    tasks = [(i, paths[i % len(paths)], settings) for i in range(nfiles)]
+    if nprocs > 1:
+        import dataset
+        dataset.parmap(write_track, tasks, nprocs=nprocs)
+    else:
+        for task in tasks:
+            write_track(task)
+    return paths
+
+
+def main(argv):
+    usage = 'python -m benchmarks.corpus -o <output_folder> [-n 1000] [-d 10.] [-l single|multi] [-c 1] [-s 4] [--density 2.] '\
+        '[--frame-size 1024] [--hop-size 512] [--model name] [--dirs 1] [--seed 0] [-p 1] [--size]'
+    try:
+        opts, args = getopt.getopt(argv,"ho:n:d:l:c:s:p:",["output=","nfiles=","duration=","layout=","channels=","sources=",
+            "nprocs=","density=","frame-size=","hop-size=","model=","dirs=","seed=","size"])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    path = None
+    kwargs = {}
+    nprocs = 1
+    only_size = False
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-o", "--output"):
+            path = arg
+        elif opt in ("-n", "--nfiles"):
+            kwargs['nfiles'] = int(arg)
+        elif opt in ("-d", "--duration"):
+            kwargs['duration'] = float(arg)
+        elif opt in ("-l", "--layout"):
+            kwargs['layout'] = arg
+        elif opt in ("-c", "--channels"):
+            kwargs['channels'] = int(arg)
+        elif opt in ("-s", "--sources"):
+            kwargs['nsources'] = int(arg)
+        elif opt in ("-p", "--nprocs"):
+            nprocs = int(arg)
+        elif opt == "--density":
+            kwargs['density'] = float(arg)
+        elif opt == "--frame-size":
+            kwargs['frameSize'] = int(arg)
+        elif opt == "--hop-size":
+            kwargs['hopSize'] = int(arg)
+        elif opt == "--model":
+            kwargs['model'] = arg
+        elif opt == "--dirs":
+            kwargs['ndirs'] = int(arg)
+        elif opt == "--seed":
+            kwargs['seed'] = int(arg)
+        elif opt == "--size":
+            only_size = True
+    if only_size:
+        kwargs.pop('ndirs', None)
+        kwargs.pop('seed', None)
+        print('%.1f MB' % (corpus_size(**kwargs) / 1e6))
+        sys.exit()
+    if path is None:
+        print(usage)
+        sys.exit(2)
+    generate(path, nprocs=nprocs, **kwargs)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
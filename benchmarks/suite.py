@@ -0,0 +1,247 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import sys
+import time
+import json
+import getopt
+import shutil
+import platform
+import tempfile
+import multiprocessing
+import numpy as np
+import climate
+logging = climate.get_logger('benchmarks')
+
+
+"""
+Offline benchmarks of the hot paths on synthetic audio and features: the STFT and iSTFT (transform.py), the iteration
+of LargeDataset with and without masks and the scaling of parmap (dataset.py) and the end-to-end separation with the numpy
+runtime (runtime.py, separation.py). Each benchmark returns a dictionary of metrics {name: {value, unit, higher}}, where
+\"higher\" tells if a higher value is better, and the suite is written as json. A previous json can be given as a baseline
+to flag the metrics which got worse by more than a tolerance.
+"""
+def best_time(f, repeat=3):
+    """
+    Returns the smallest time in seconds of \"repeat\" calls of \"f\"
+    """
+    elapsed = []
+    for r in range(repeat):
+        start = time.perf_counter()
+        f()
+        elapsed.append(time.perf_counter() - start)
+    return min(elapsed)
+
+
+def metric(value, unit, higher=True):
+    return {'value': float(value), 'unit': unit, 'higher': higher}
+
+
+def synthetic_audio(seconds, sampleRate=44100, seed=0):
+    """
+    Returns a mono signal of \"seconds\" seconds with a few harmonic tones and some noise
+    """
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(seconds * sampleRate)) / float(sampleRate)
+    audio = 0.01 * rng.randn(len(t))
+    for f0 in rng.uniform(100, 1000, size=4):
+        for h in range(1, 6):
+            audio = audio + 0.1 / h * np.sin(2 * np.pi * f0 * h * t)
+    return audio / np.max(np.abs(audio))
+
+
+def bench_stft(seconds=30, frame_sizes=(1024, 2048, 4096), repeat=3):
+    """
+    Throughput of stft_norm and istft_norm in frames per second and in seconds of audio per second, for each frame size
+    """
+    import transform
+    audio = synthetic_audio(seconds)
+    results = {}
+    for frameSize in frame_sizes:
+        hopSize = frameSize // 4
+        window = np.hanning(frameSize)
+        X = transform.stft_norm(audio, window=window, hopsize=float(hopSize), nfft=float(frameSize))
+        t = best_time(lambda: transform.stft_norm(audio, window=window, hopsize=float(hopSize), nfft=float(frameSize)), repeat)
+        results['stft_%d_frames_per_sec' % frameSize] = metric(X.shape[0] / t, 'frames/s')
+        results['stft_%d_realtime' % frameSize] = metric(seconds / t, 'x')
+        t = best_time(lambda: transform.istft_norm(X, window=window, hopsize=float(hopSize), nfft=float(frameSize)), repeat)
+        results['istft_%d_frames_per_sec' % frameSize] = metric(X.shape[0] / t, 'frames/s')
+        results['istft_%d_realtime' % frameSize] = metric(seconds / t, 'x')
+    return results
+
+
+def bench_dataset(nfiles=8, nframes=2000, batch_size=32, batch_memory=50, time_context=30, overlap=25, nprocs=2):
+    """
+    Segments per second of one epoch of LargeDataset, and of LargeDatasetMask1 which also builds the masks from the notes
+    """
+    import dataset
+    from benchmarks import corpus
+    path = tempfile.mkdtemp(prefix='bench_features_')
+    results = {}
+    try:
+        corpus.generate(path, nfiles=nfiles, duration=nframes*512/44100., nsources=4)
+        for name,cls,kwargs in [('dataset', dataset.LargeDataset, {}), ('dataset_masks', dataset.LargeDatasetMask1, {'save_mask': True})]:
+            start = time.perf_counter()
+            ld = cls(path_transform_in=path, batch_size=batch_size, batch_memory=batch_memory, time_context=time_context,
+                overlap=overlap, nsources=4, nprocs=nprocs, tensortype=np.float32, **kwargs)
+            nbatches = len(ld)
+            for b in range(nbatches):
+                ld()
+            elapsed = time.perf_counter() - start
+            results[name+'_segments_per_sec'] = metric(nbatches * batch_size / elapsed, 'segments/s')
+    finally:
+        shutil.rmtree(path)
+    return results
+
+
+def load_chunk(i):
+    import transform
+    audio = synthetic_audio(2., seed=i)
+    return float(np.sum(np.abs(transform.stft_norm(audio, window=np.hanning(2048), hopsize=512., nfft=2048.))))
+
+
+def bench_parmap(ntasks=16, nprocs=(1, 2, 4)):
+    """
+    Tasks per second of dataset.parmap for each number of processes, each task being the STFT of two seconds of audio
+    """
+    import dataset
+    results = {}
+    for n in nprocs:
+        if n > multiprocessing.cpu_count():
+            continue
+        t = best_time(lambda: dataset.parmap(load_chunk, list(range(ntasks)), nprocs=n))
+        results['parmap_%d_tasks_per_sec' % n] = metric(ntasks / t, 'tasks/s')
+    return results
+
+
+def random_model(input_size=513, time_context=30, filters=50, height=15, hidden=128, nheads=3, nsources=4, seed=0):
+    """
+    Returns a runtime.CAModel of the build_ca architecture (separate_dsd.py) with random weights
+    """
+    import runtime
+    rng = np.random.RandomState(seed)
+    steps = time_context - height + 1
+    params = [rng.randn(filters,1,1,input_size)*.05, rng.randn(filters)*.1, rng.randn(filters)*.1,
+        rng.randn(filters,filters,height,1)*.05, rng.randn(filters)*.1, rng.randn(filters)*.1,
+        rng.randn(filters*steps,hidden)*.05, rng.randn(hidden)*.1]
+    for j in range(nheads):
+        params = params + [rng.randn(hidden,filters*steps)*.05, rng.randn(filters*steps)*.1]
+    params = params + [rng.randn(nsources)*.1]
+    return runtime.CAModel(params, heads=[0,1,2,1])
+
+
+def bench_separation(seconds=20, batch_size=32):
+    """
+    Real-time factor (processing time / duration) of the separation of a track with the numpy runtime, and its parts
+    """
+    import runtime
+    separator = runtime.batch_separator(random_model(), 'dsd', batch_size=batch_size)
+    audio = synthetic_audio(seconds)
+    timings = {}
+    def separate():
+        start = time.perf_counter()
+        mag, phase = separator.spectrogram(audio)
+        timings['analysis'] = time.perf_counter() - start
+        track = {'mag': mag}
+        separator.separation(track)
+        timings['network'] = time.perf_counter() - start - timings['analysis']
+        separator.inverse(track['mag'], phase, len(audio))
+        timings['total'] = time.perf_counter() - start
+    best = {}
+    for r in range(2):
+        separate()
+        best = dict((k, min(v, best.get(k, v))) for k,v in timings.items())
+    return {'separation_rtf': metric(best['total'] / seconds, 'x', higher=False),
+        'separation_network_rtf': metric(best['network'] / seconds, 'x', higher=False),
+        'separation_analysis_rtf': metric(best['analysis'] / seconds, 'x', higher=False)}
+
+
+BENCHMARKS = {'stft': bench_stft, 'dataset': bench_dataset, 'parmap': bench_parmap, 'separation': bench_separation}
+
+
+def run(names=None):
+    """
+    Runs the benchmarks \"names\" (all by default) and returns the results with a description of the machine
+    """
+    names = names if names is not None else sorted(BENCHMARKS)
+    results = {}
+    for name in names:
+        logging.info('running %s', name)
+        results.update(BENCHMARKS[name]())
+    return {'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+        'cpus': multiprocessing.cpu_count(), 'date': time.strftime('%Y-%m-%d %H:%M:%S')}, 'results': results}
+
+
+def compare(results, baseline, tolerance=0.1):
+    """
+    Returns the metrics present in both \"results\" and \"baseline\" which got worse by more than \"tolerance\" (relative),
+        as a list of (name, baseline value, value, relative change)
+    """
+    regressions = []
+    for name,m in sorted(results['results'].items()):
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['value']
+        change = (m['value'] - old) / old if old != 0 else 0.
+        if (m['higher'] and change < -tolerance) or (not m['higher'] and change > tolerance):
+            regressions.append((name, old, m['value'], change))
+    return regressions
+
+
+def main(argv):
+    usage = 'python -m benchmarks.suite [-b stft,dataset,parmap,separation] [-o results.json] [-c baseline.json] [-t 0.1]'
+    try:
+        opts, args = getopt.getopt(argv,"hb:o:c:t:",["benchmarks=","output=","compare=","tolerance="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    names = None
+    output = None
+    baseline = None
+    tolerance = 0.1
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-b", "--benchmarks"):
+            names = arg.split(',')
+        elif opt in ("-o", "--output"):
+            output = arg
+        elif opt in ("-c", "--compare"):
+            baseline = arg
+        elif opt in ("-t", "--tolerance"):
+            tolerance = float(arg)
+    results = run(names)
+    for name,m in sorted(results['results'].items()):
+        print('%-36s %12.3f %s' % (name, m['value'], m['unit']))
+    if output is not None:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if baseline is not None:
+        with open(baseline) as f:
+            regressions = compare(results, json.load(f), tolerance)
+        for name,old,new,change in regressions:
+            print('REGRESSION %s: %.3f -> %.3f (%+.1f%%)' % (name, old, new, 100 * change))
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
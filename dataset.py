@@ -26,7 +26,10 @@ from os.path import isfile, join
 import pickle as pickle
 import random
 import re
+import time
+import contextlib
 import multiprocessing
+import collections
 import util
 import climate
 import itertools as it
@@ -48,7 +51,7 @@ def parmap(f, X, nprocs = multiprocessing.cpu_count()-1):
     """
     Paralellize the function f with the list X, using a number of CPU of nprocs
     """
-    nprocs = np.maximum(multiprocessing.cpu_count()-1,nprocs)
+    nprocs = int(np.maximum(1,nprocs))
     q_in   = multiprocessing.Queue(1)
     q_out  = multiprocessing.Queue()
 
@@ -66,6 +69,112 @@ def parmap(f, X, nprocs = multiprocessing.cpu_count()-1):
     return [x for i,x in sorted(res)]
 
 
+"""
+Cumulative timers and counters for the stages of the input pipeline, to find where the time of an epoch goes
+"""
+class StageStats(object):
+    """
+    Keeps the time in seconds, the number of calls and the bytes of each stage and counts of events, e.g. files or segments.
+    When \"enabled\" is False all the methods return immediately, such that the instrumented code runs at the same speed
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Record the timers and the counters
+    log_every : float, optional
+        If larger than 0, \"log\" writes a line with the stats at most once every \"log_every\" seconds
+    """
+    def __init__(self, enabled=True, log_every=0):
+        self.enabled = enabled
+        self.log_every = log_every
+        self.reset()
+
+    def reset(self):
+        self.seconds = {}
+        self.calls = {}
+        self.nbytes = {}
+        self.counts = {}
+        self.created = time.time()
+        self.last_log = self.created
+
+    @contextlib.contextmanager
+    def _time(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[stage] = self.seconds.get(stage, 0.) + time.perf_counter() - start
+            self.calls[stage] = self.calls.get(stage, 0) + 1
+
+    def time(self, stage):
+        """
+        Context manager adding the time spent in its block to \"stage\"
+        """
+        if not self.enabled:
+            return NULL_CONTEXT
+        return self._time(stage)
+
+    def add_bytes(self, stage, nbytes):
+        if self.enabled:
+            self.nbytes[stage] = self.nbytes.get(stage, 0) + int(nbytes)
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + int(n)
+
+    def merge(self, other):
+        """
+        Adds the stats in the dictionary \"other\", as returned by \"snapshot\", e.g. from a process of parmap
+        """
+        if self.enabled and other is not None:
+            for stage,s in other['stages'].items():
+                self.seconds[stage] = self.seconds.get(stage, 0.) + s['seconds']
+                self.calls[stage] = self.calls.get(stage, 0) + s['calls']
+                if s['bytes'] > 0:
+                    self.nbytes[stage] = self.nbytes.get(stage, 0) + s['bytes']
+            for name,n in other['counts'].items():
+                self.count(name, n)
+
+    def snapshot(self):
+        """
+        Returns a copy of the stats: {'elapsed', 'stages': {stage: {'seconds', 'calls', 'bytes'}}, 'counts': {name: n}}
+        """
+        stages = {}
+        for stage in self.seconds:
+            stages[stage] = {'seconds': self.seconds[stage], 'calls': self.calls[stage], 'bytes': self.nbytes.get(stage, 0)}
+        for stage in self.nbytes:
+            if stage not in stages:
+                stages[stage] = {'seconds': 0., 'calls': 0, 'bytes': self.nbytes[stage]}
+        return {'elapsed': time.time() - self.created, 'stages': stages, 'counts': dict(self.counts)}
+
+    def log(self, force=False):
+        """
+        Logs the seconds per stage, the read throughput and the counts, if \"log_every\" seconds passed since the last line
+        """
+        if not self.enabled or (not force and (self.log_every <= 0 or time.time() - self.last_log < self.log_every)):
+            return
+        self.last_log = time.time()
+        stats = self.snapshot()
+        stages = ' '.join('%s=%.2fs' % (stage, s['seconds']) for stage,s in sorted(stats['stages'].items()))
+        counts = ' '.join('%s=%d' % (name, n) for name,n in sorted(stats['counts'].items()))
+        io_stats = stats['stages'].get('io', {'seconds': 0., 'bytes': 0})
+        logging.info('pipeline %.1fs: %s read=%.1fMB/s %s', stats['elapsed'], stages,
+            io_stats['bytes'] / 1e6 / np.maximum(io_stats['seconds'], 1e-9), counts)
+
+NULL_CONTEXT = contextlib.nullcontext()
+
+
+#the variables giving the position of LargeDataset in the epoch
+POSITION = ['_index','findex','nindex','idxbegin','idxend','foffset','mini_index','scratch_index']
+
+
+def formatPlan(plan):
+    """
+    Formats the dictionary of bytes returned by LargeDataset.memoryPlan in MB
+    """
+    return ', '.join('%s %.1f MB' % (name, nbytes / 1e6) for name,nbytes in plan.items())
+
+
 """
 Classes to load features which have been computed with one of the functions in transform.py,
 and yield batches necessary for training neural networks.
@@ -107,15 +216,34 @@ class LargeDataset(object):
         Multiply the output with factor
     scratch_path : string, optional
         To speed up batch fetching, the resulting batches are written to a scratch path (e.g. SSD disk)
+    stats : bool, optional
+        Keep the time and the bytes of each stage of loading, returned by \"get_stats\"
+    stats_every : float, optional
+        If larger than 0, log a line with the stats at most once every \"stats_every\" seconds
+    memory_budget : float, optional
+        The RAM in MB for loading the batches: \"batch_memory\" is lowered until the buffers and the loading fit (see memoryPlan),
+        and a MemoryError with the breakdown is raised if a single batch does not fit
+    layout : string, optional
+        \"flat\": the examples are (time_context,features) with the sources, pitches and masks concatenated on the last axis.
+        \"nchw\": the examples are (channels,time_context,features), i.e. (1,T,F) inputs, (nsources,T,F) outputs and
+        (ninst,T,F) masks and pitches, ready for the network; they are arranged in the processes loading the files.
+        The Multi classes always return (channels,time_context,features)
+    mask_inputs : bool, optional
+        With the \"nchw\" layout, return the masks multiplied with the inputs
 
     """
     def __init__(self, path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[], nsamples=0,
         batch_size=64, batch_memory=8000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,
-        log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1.,nsources=2,pitched=False,save_mask=False,pitch_norm=127,nprocs=2,jump=0):
+        log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1.,nsources=2,pitched=False,save_mask=False,pitch_norm=127,nprocs=2,jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
 
         self.batch_size = batch_size
         self.nsources = nsources
         self.tensortype = tensortype
+        self.stats = StageStats(enabled=stats, log_every=stats_every)
+        self.memory_budget = memory_budget
+        assert layout in ['flat','nchw'], "layout must be flat or nchw"
+        self.layout = layout
+        self.mask_inputs = mask_inputs
         if path_transform_in is not None:
             if not isinstance(path_transform_in, (list, tuple)):
                 self.path_transform_in = [path_transform_in]
@@ -197,6 +325,7 @@ class LargeDataset(object):
             self.loadBatches()
         #logging.info('loaded batch %s from %s',str(self._index+1),str(self.iteration_size))
         self._index = self._index + 1
+        self.stats.count('batches')
         idx0=self.mini_index*self.batch_size
         idx1=(self.mini_index+1)*self.batch_size
         self.mini_index = self.mini_index + 1
@@ -234,6 +363,12 @@ class LargeDataset(object):
         """
         Loads more batches from the disk, if the batches from the memory are exhausted
         """
+        #the position and the random state before loading, to load the same batches again when resuming (see get_state),
+        #with the ones of the previous batches, which remain in memory after the last batches of the epoch
+        previous = getattr(self, 'block_state', None)
+        if previous is not None:
+            previous = {'position': previous['position'], 'rng': previous['rng']}
+        self.block_state = {'position': self.getPosition(), 'rng': np.random.get_state(), 'previous': previous}
         if hasattr(self, 'scratch_path') and self.scratch_path is not None:
             batch_file = os.path.join(self.scratch_path,'batch'+str(self.scratch_index))
             if os.path.exists(batch_file+'_inputs.data') and os.path.exists(batch_file+'_outputs.data'):
@@ -245,17 +380,21 @@ class LargeDataset(object):
                     self.batch_masks = self.loadTensor(batch_file+'_masks.data')
                 if self.extra_features:
                     self.batch_features = self.loadTensor(batch_file+'_features.data')
-                self.shuffleBatches()
+                with self.stats.time('shuffle'):
+                    self.shuffleBatches()
             else:
                 #generate and save
                 self.genBatches()
-                self.saveBatches(batch_file)
+                with self.stats.time('scratch'):
+                    self.saveBatches(batch_file)
                 self.scratch_index = self.scratch_index + 1
         else:
             self.genBatches()
             self.scratch_index = self.scratch_index + 1
         #logging.info('read %s more batches from hdd',str(self.batch_memory))
         self.mini_index = 0
+        self.stats.count('reloads')
+        self.stats.log()
 
     def genBatches(self):
         """
@@ -267,6 +406,7 @@ class LargeDataset(object):
         #no multiprocessing
         if self.nindex==self.findex:
             x = self.loadFile(self.findex, idxbegin=self.idxbegin, idxend=self.idxend)
+            self.stats.merge(x['stats'])
             self.batch_inputs[0:self.idxend-self.idxbegin] = x['inputs']
             self.batch_outputs[0:self.idxend-self.idxbegin] = x['outputs']
             if self.pitched:
@@ -278,6 +418,7 @@ class LargeDataset(object):
             x=None
         else:
             x = self.loadFile(self.findex, idxbegin=self.idxbegin)
+            self.stats.merge(x['stats'])
             self.batch_inputs[0:self.num_points[self.findex+1]-self.num_points[self.findex]-self.idxbegin] = x['inputs']
             self.batch_outputs[0:self.num_points[self.findex+1]-self.num_points[self.findex]-self.idxbegin] = x['outputs']
             if self.pitched:
@@ -288,13 +429,16 @@ class LargeDataset(object):
                 self.batch_features[0:self.num_points[self.findex+1]-self.num_points[self.findex]-self.idxbegin] = x['features']
             x=None
 
-        #this is where multiprocessing happens
-        if (self.nindex-self.findex) > 2:
+        #this is where multiprocessing happens, for the files between the first and the last one
+        if (self.nindex-self.findex) > 1:
             i = self.findex + 1
-            xall = parmap(self.loadFile, list(range(self.findex+1,self.nindex)),nprocs=self.nprocs)
+            with self.stats.time('parmap'):
+                xall = parmap(self.loadFile, list(range(self.findex+1,self.nindex)),nprocs=self.nprocs)
             for i in range(self.findex+1,self.nindex):
                 #x = self.loadFile(i)
                 x=xall[i-self.findex-1]
+                #the stages of the files loaded in the other processes
+                self.stats.merge(x['stats'])
                 idx0=self.num_points[i]-self.foffset
                 idx1=self.num_points[i+1]-self.foffset
                 self.batch_inputs[idx0:idx1] = x['inputs']
@@ -317,6 +461,7 @@ class LargeDataset(object):
                 idx1=len(self.batch_inputs)
 
             x = self.loadFile(self.nindex,idxend=self.idxend)
+            self.stats.merge(x['stats'])
 
             self.batch_inputs[idx0:idx1] = x['inputs']
             self.batch_outputs[idx0:idx1] = x['outputs']
@@ -329,7 +474,8 @@ class LargeDataset(object):
             x=None
 
         #shuffle batches
-        self.shuffleBatches()
+        with self.stats.time('shuffle'):
+            self.shuffleBatches()
 
         if self.idxend == (self.num_points[self.nindex+1]-self.num_points[self.nindex]):
             self.findex = self.nindex + 1
@@ -380,7 +526,7 @@ class LargeDataset(object):
         allmixinput = np.expand_dims(allmixinput[0], axis=0)
         return allmixinput,allmixoutput
 
-    def loadFile(self,id,idxbegin=None,idxend=None):
+    def readFile(self,id,idxbegin=None,idxend=None):
         """
         reads a .data file and splits into batches
         """
@@ -414,14 +560,15 @@ class LargeDataset(object):
                 allfeatures = self.load_extra_features(id)
 
             #apply a scaled log10(1+value) function to make sure larger values are eliminated
-            if self.log_in==True:
-                allmixinput = self.mult_factor_in*np.log10(1.0+allmixinput)
-            else:
-                allmixinput = self.mult_factor_in*allmixinput
-            if self.log_out==True:
-                allmixoutput = self.mult_factor_out*np.log10(1.0+allmixoutput)
-            else:
-                allmixoutput = self.mult_factor_out*allmixoutput
+            with self.stats.time('scale'):
+                if self.log_in==True:
+                    allmixinput = self.mult_factor_in*np.log10(1.0+allmixinput)
+                else:
+                    allmixinput = self.mult_factor_in*allmixinput
+                if self.log_out==True:
+                    allmixoutput = self.mult_factor_out*np.log10(1.0+allmixoutput)
+                else:
+                    allmixoutput = self.mult_factor_out*allmixoutput
 
             i = 0
             start = 0
@@ -436,9 +583,11 @@ class LargeDataset(object):
                     outputs[0, :allmixoutput.shape[1], j*allmixoutput.shape[-1]:(j+1)*allmixoutput.shape[-1]] = allmixoutput[j]
 
                 if self.pitched:
-                    pitches[0, :allmixinput.shape[1],:] = self.buildPitch(allmixinput[0],allpitch,start,start+self.time_context)
+                    with self.stats.time('pitches'):
+                        pitches[0, :allmixinput.shape[1],:] = self.buildPitch(allmixinput[0],allpitch,start,start+self.time_context)
                 if self.save_mask:
-                    masks[0, :allmixinput.shape[1],:] = self.filterSpec(allmixinput[0],allpitch,start,start+self.time_context)
+                    with self.stats.time('masks'):
+                        masks[0, :allmixinput.shape[1],:] = self.filterSpec(allmixinput[0],allpitch,start,start+self.time_context)
             else:
                 while (start + self.time_context) < allmixinput.shape[1]:
                     if i>=idxbegin and i<idxend:
@@ -458,9 +607,11 @@ class LargeDataset(object):
                             outputs[i-idxbegin,:, j*allmoutput.shape[-1]:(j+1)*allmoutput.shape[-1]] = allmoutput[j,:,:]
 
                         if self.pitched:
-                            pitches[i-idxbegin, :allmixinput.shape[1], :] = self.buildPitch(allminput[0],allpitch,start,start+self.time_context)
+                            with self.stats.time('pitches'):
+                                pitches[i-idxbegin, :allmixinput.shape[1], :] = self.buildPitch(allminput[0],allpitch,start,start+self.time_context)
                         if self.save_mask:
-                            masks[i-idxbegin, :allmixinput.shape[1], :] = self.filterSpec(allminput[0],allpitch,start,start+self.time_context)
+                            with self.stats.time('masks'):
+                                masks[i-idxbegin, :allmixinput.shape[1], :] = self.filterSpec(allminput[0],allpitch,start,start+self.time_context)
 
                     i = i + 1
                     start = start - self.overlap + self.time_context
@@ -479,6 +630,12 @@ class LargeDataset(object):
             if self.extra_features:
                 allfeatures = None
 
+            if self.layout == 'nchw':
+                with self.stats.time('layout'):
+                    inputs,outputs,pitches,masks = self.toLayout(inputs,outputs,pitches,masks)
+
+            self.stats.count('files')
+            self.stats.count('segments', idxend - idxbegin)
             result = {'inputs':inputs, 'outputs':outputs, 'pitches':pitches, 'masks':masks, 'features':features}
             inputs = None
             outputs = None
@@ -488,6 +645,40 @@ class LargeDataset(object):
             return result
 
 
+    def toLayout(self,inputs,outputs,pitches,masks):
+        """
+        Arranges the examples of a file from the flat layout to the \"nchw\" layout, see \"exampleShapes\"
+        """
+        n = len(inputs)
+        inputs = inputs[:,None]
+        outputs = np.ascontiguousarray(outputs.reshape(n,self.time_context,self.nsources,-1).transpose(0,2,1,3))
+        if self.pitched:
+            pitches = np.ascontiguousarray(pitches.reshape(n,self.time_context,self.ninst,self.npitches).transpose(0,2,1,3))
+        if self.save_mask:
+            masks = masks.reshape(n,self.time_context,self.ninst,self.input_size).transpose(0,2,1,3)
+            if self.mask_inputs:
+                masks = masks * inputs
+            masks = np.ascontiguousarray(masks, dtype=self.tensortype)
+        return inputs,outputs,pitches,masks
+
+    def loadFile(self,id,idxbegin=None,idxend=None):
+        """
+        Calls \"readFile\", if the stats are enabled the stats of reading the file are returned in result['stats'],
+            such that they can be gathered from the processes of parmap
+        """
+        if not self.stats.enabled:
+            result = self.readFile(id, idxbegin=idxbegin, idxend=idxend)
+            result['stats'] = None
+            return result
+        stats = self.stats
+        self.stats = StageStats()
+        try:
+            result = self.readFile(id, idxbegin=idxbegin, idxend=idxend)
+            result['stats'] = self.stats.snapshot()
+        finally:
+            self.stats = stats
+        return result
+
     def shuffleBatches(self):
         """
         Shuffle batches
@@ -614,13 +805,15 @@ class LargeDataset(object):
 
 
         #we read the file_list from the path_transform_in directory
-        self.file_list = [f for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
-            if f.endswith('_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f)) and\
-            f.split('_',1)[0] not in self.exclude_list]
+        with self.stats.time('listdir'):
+            self.file_list = [f for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
+                if f.endswith('_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f)) and\
+                f.split('_',1)[0] not in self.exclude_list]
 
-        self.dirid = [k for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
-            if f.endswith('_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f)) and\
-            f.split('_',1)[0] not in self.exclude_list]
+            self.dirid = [k for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
+                if f.endswith('_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f)) and\
+                f.split('_',1)[0] not in self.exclude_list]
+        self.stats.count('files_indexed', len(self.file_list))
 
         if self.nsamples>2 and self.nsamples < len(self.file_list):
             ids = np.squeeze(np.random.choice(len(self.file_list), size=self.nsamples, replace=False))
@@ -633,7 +826,8 @@ class LargeDataset(object):
         if self.total_files<1:
             raise Exception('Could not find any file in the input directory! Files must end with _m_.data')
         logging.info("found %s files",str(self.total_files))
-        self.num_points = np.cumsum(np.array([0]+[self.getNum(i) for i in range(self.total_files)], dtype=int))
+        with self.stats.time('shapes'):
+            self.num_points = np.cumsum(np.array([0]+[self.getNum(i) for i in range(self.total_files)], dtype=int))
         self.total_points = self.num_points[-1]
         #print self.num_points
         self.input_size,self.output_size = self.getFeatureSize()
@@ -654,6 +848,8 @@ class LargeDataset(object):
         self.batch_size = np.minimum(self.batch_size,self.num_points[-1])
         self.iteration_size = int(self.total_points / self.batch_size)
         self.batch_memory = np.minimum(self.batch_memory,self.iteration_size)
+        if self.memory_budget is not None:
+            self.batch_memory = self.planBatchMemory(self.memory_budget)
         logging.info("iteration size %s",str(self.iteration_size))
         self._index = 0
         self.findex = 0
@@ -663,29 +859,131 @@ class LargeDataset(object):
         self.foffset = 0
         self.mini_index = 0
         self.scratch_index = 0
-        self.batch_inputs = np.zeros((self.batch_memory*self.batch_size,self.time_context,self.input_size), dtype=self.tensortype)
-        self.batch_outputs = np.zeros((self.batch_memory*self.batch_size,self.time_context,self.output_size), dtype=self.tensortype)
+        shapes = self.exampleShapes()
+        self.batch_inputs = np.zeros((self.batch_memory*self.batch_size,)+shapes['inputs'], dtype=self.tensortype)
+        self.batch_outputs = np.zeros((self.batch_memory*self.batch_size,)+shapes['outputs'], dtype=self.tensortype)
         if self.pitched:
-            self.batch_pitches = np.zeros((self.batch_memory*self.batch_size,self.time_context,self.npitches*self.ninst), dtype=self.tensortype)
+            self.batch_pitches = np.zeros((self.batch_memory*self.batch_size,)+shapes['pitches'], dtype=self.tensortype)
 
         if self.save_mask:
-            self.batch_masks = np.zeros((self.batch_memory*self.batch_size,self.time_context,self.input_size*self.ninst), dtype=self.tensortype)
+            self.batch_masks = np.zeros((self.batch_memory*self.batch_size,)+shapes['masks'], dtype=self.tensortype)
 
         if self.extra_features == True:
-            self.batch_features = np.zeros((self.batch_memory*self.batch_size,self.context,self.extra_feat_size), dtype=self.tensortype)
+            self.batch_features = np.zeros((self.batch_memory*self.batch_size,)+shapes['features'], dtype=self.tensortype)
 
         self.loadBatches()
 
 
+    def exampleShapes(self):
+        """
+        Returns the shape of one example in each of the buffers allocated by \"initBatches\"
+        """
+        if self.layout == 'nchw':
+            shapes = {'inputs': (1,self.time_context,self.input_size), 'outputs': (self.nsources,self.time_context,int(self.output_size/self.nsources))}
+            if self.pitched:
+                shapes['pitches'] = (self.ninst,self.time_context,self.npitches)
+            if self.save_mask:
+                shapes['masks'] = (self.ninst,self.time_context,self.input_size)
+            if self.extra_features:
+                shapes['features'] = (self.context,self.extra_feat_size)
+            return shapes
+        shapes = {'inputs': (self.time_context,self.input_size), 'outputs': (self.time_context,self.output_size)}
+        if self.pitched:
+            shapes['pitches'] = (self.time_context,self.npitches*self.ninst)
+        if self.save_mask:
+            shapes['masks'] = (self.time_context,self.input_size*self.ninst)
+        if self.extra_features:
+            shapes['features'] = (self.context,self.extra_feat_size)
+        return shapes
+
+    def rawFiles(self,id):
+        """
+        Returns the paths of the .data files read by \"loadFile\" for the file \"id\"
+        """
+        files = [os.path.join(self.path_transform_in[self.dirid[id]],self.file_list[id])]
+        if self.path_transform_in!=self.path_transform_out:
+            files.append(os.path.join(self.path_transform_out[self.dirid[id]],self.file_list[id]))
+        if self.pitched or self.save_mask:
+            files.append(files[0].replace('_m_','_'+self.pitch_code+'_'))
+        if self.extra_features:
+            files.append(files[0].replace('_m_','_'+self.model+'_'))
+        return files
+
+    def memoryPlan(self, batch_memory=None, nbuffers=1):
+        """
+        Returns the bytes used to load batches with \"batch_memory\" batches in memory, as a dictionary with:
+            one entry per buffer allocated by \"initBatches\" (inputs, outputs, pitches, masks, features), exact
+            \"results\": the examples returned by the processes of parmap, held at once before being copied to the buffers
+            \"workers\": the largest file read as float64 and scaled, with its examples, in each of the \"nprocs\" processes
+            \"shuffle\": the copy of the largest buffer made by \"shuffleBatches\"
+            \"peak\": the buffers plus the largest of loading (results and workers) and shuffling
+
+        Parameters
+        ----------
+        batch_memory : int, optional
+            The number of batches in memory, by default the current one
+        nbuffers : int, optional
+            The number of copies of the buffers, e.g. 2 if the batches are prefetched while the previous ones are used
+        """
+        if batch_memory is None:
+            batch_memory = self.batch_memory
+        itemsize = np.dtype(self.tensortype).itemsize
+        nexamples = int(batch_memory*self.batch_size)
+        shapes = self.exampleShapes()
+        example = itemsize * int(np.sum([np.prod(shape) for shape in shapes.values()]))
+        plan = collections.OrderedDict()
+        for name in ['inputs','outputs','pitches','masks','features']:
+            if name in shapes:
+                plan[name] = nbuffers * nexamples * itemsize * int(np.prod(shapes[name]))
+        buffers = int(np.sum(list(plan.values())))
+        #the file with the most examples is the largest one
+        sizes = np.diff(self.num_points)
+        largest = int(np.argmax(sizes))
+        raw = int(np.sum([8 * np.prod(self.get_shape(f.replace('.data','.shape'))) for f in self.rawFiles(largest)]))
+        plan['results'] = int(np.minimum(nexamples,self.total_points)) * example
+        #the examples of the file are copied once more to the nchw layout
+        copies = 2 if self.layout == 'nchw' else 1
+        plan['workers'] = int(np.maximum(1,self.nprocs)) * (2 * raw + copies * int(sizes[largest]) * example)
+        plan['shuffle'] = int(np.max([plan[name] for name in shapes])) // nbuffers
+        plan['peak'] = buffers + int(np.maximum(plan['results'] + plan['workers'], plan['shuffle']))
+        return plan
+
+    def planBatchMemory(self, budget, nbuffers=1):
+        """
+        Returns the largest \"batch_memory\", up to the current one, for which the peak of \"memoryPlan\" fits in \"budget\" MB,
+            raises a MemoryError with the breakdown if one batch does not fit
+        """
+        budget = budget * 1e6
+        plan = self.memoryPlan(1, nbuffers=nbuffers)
+        if plan['peak'] > budget:
+            raise MemoryError('a single batch needs %.1f MB, more than the budget of %.1f MB: %s'
+                % (plan['peak'] / 1e6, budget / 1e6, formatPlan(plan)))
+        #the peak grows with batch_memory
+        low = 1
+        high = int(self.batch_memory)
+        while low < high:
+            mid = int((low + high + 1) / 2)
+            if self.memoryPlan(mid, nbuffers=nbuffers)['peak'] <= budget:
+                low = mid
+            else:
+                high = mid - 1
+        plan = self.memoryPlan(low, nbuffers=nbuffers)
+        if low < self.batch_memory:
+            logging.info('batch_memory lowered from %d to %d to fit %.1f MB', self.batch_memory, low, budget / 1e6)
+        logging.info('memory plan: %s', formatPlan(plan))
+        return low
+
     def loadTensor(self, path, name=''):
         """
         Loads a binary .data file
         """
         if os.path.isfile(path):
-            f_in = np.fromfile(path)
-            shape = self.get_shape(path.replace('.data','.shape'))
-            # import pdb;pdb.set_trace()
-            f_in = f_in.reshape(shape)
+            with self.stats.time('io'):
+                f_in = np.fromfile(path)
+                shape = self.get_shape(path.replace('.data','.shape'))
+                # import pdb;pdb.set_trace()
+                f_in = f_in.reshape(shape)
+            self.stats.add_bytes('io', f_in.nbytes)
 
             return f_in
         else:
@@ -720,6 +1018,119 @@ class LargeDataset(object):
         with open(shape_file, 'w') as fout:
             fout.write(u'#'+'\t'.join(str(e) for e in shape)+'\n')
 
+    def getPosition(self):
+        return dict((name, int(getattr(self, name))) for name in POSITION)
+
+    def get_state(self):
+        """
+        Returns the state of the iterator as a dictionary which can be pickled, to resume the epoch with \"set_state\":
+        the list of files, the position in the epoch, the position and the numpy random state at the start of the batches in memory
+        (and of the batches loaded before them, left in memory after the last batches of the epoch)
+        and the current numpy random state, used by \"shuffleBatches\"
+        """
+        return {'file_list': list(self.file_list), 'dirid': [int(d) for d in self.dirid], 'num_points': [int(n) for n in self.num_points],
+            'batch_size': int(self.batch_size), 'batch_memory': int(self.batch_memory), 'time_context': self.time_context,
+            'overlap': self.overlap, 'position': self.getPosition(), 'block': self.block_state, 'rng': np.random.get_state()}
+
+    def set_state(self, state, skip_partial=False):
+        """
+        Resumes the iterator from a state returned by \"get_state\", the next call returns the batch following the last one returned.
+        The batches in memory when the state was saved are loaded and shuffled again, the batches before them are not loaded.
+
+        Parameters
+        ----------
+        state : dictionary
+            The state returned by \"get_state\"
+        skip_partial : bool, optional
+            Do not load again the batches in memory when the state was saved, continue with the next ones;
+            the batches of the epoch which were not returned yet from these are skipped. At the end of an epoch,
+            the next epoch starts with the first batches instead of the ones in memory
+        """
+        for name in ['batch_size','batch_memory','time_context','overlap']:
+            assert state[name] == getattr(self, name), "the state was saved with a different "+name
+        self.file_list = list(state['file_list'])
+        self.dirid = list(state['dirid'])
+        self.num_points = np.array(state['num_points'], dtype=int)
+        self.total_files = len(self.file_list)
+        self.total_points = self.num_points[-1]
+        self.iteration_size = int(self.total_points / self.batch_size)
+        position = state['position']
+        block = state['block']
+        size = self.batch_memory * self.batch_size
+        #at the end of the epoch, the next call starts a new one with the batches in memory, without loading
+        wraps = position['_index'] >= self.iteration_size or position['findex'] >= self.total_points
+        if self.batch_memory < self.iteration_size and skip_partial and wraps:
+            #a new epoch, the next call loads the first batches
+            for name in POSITION:
+                setattr(self, name, 0)
+            self.nindex = 1
+            self.mini_index = self.batch_memory
+            self.block_state = block
+        else:
+            #with all the batches in memory or at the end of the epoch, the batches in memory are always loaded again
+            skip = self.batch_memory < self.iteration_size and not wraps and (skip_partial or position['mini_index'] >= self.batch_memory)
+            #the last batches of the epoch fill the memory partially, the rest is left from the batches loaded before them:
+            #the batches in memory are loaded again on top of the previous ones if they are the last,
+            #and before the next ones if those are the last
+            partial = self.blockRows(block['position']['scratch_index']) < size
+            next_partial = self.blockRows(position['scratch_index']) < size
+            if not skip and partial and block.get('previous') is not None:
+                self.replayBlock(block['previous'])
+            if not skip or next_partial:
+                self.replayBlock(block)
+            else:
+                self.block_state = block
+            for name in POSITION:
+                setattr(self, name, position[name])
+            if skip:
+                #the next call loads the next batches
+                self._index = self._index + self.batch_memory - self.mini_index
+                self.mini_index = self.batch_memory
+        np.random.set_state(state['rng'])
+
+    def blockRows(self, scratch_index):
+        """
+        Returns the number of examples loaded in memory by \"loadBatches\" when \"scratch_index\" is the number of batches
+            loaded before in the epoch (see getNextIndex), fewer than the memory only for the last batches of the epoch
+        """
+        size = self.batch_memory * self.batch_size
+        return int(np.minimum(size, self.total_points - scratch_index * size))
+
+    def replayBlock(self, block):
+        """
+        Loads again the batches loaded from the position and with the random state in \"block\", see \"loadBatches\"
+        """
+        for name,value in block['position'].items():
+            setattr(self, name, value)
+        np.random.set_state(block['rng'])
+        self.loadBatches()
+
+    def save_state(self, path):
+        """
+        Saves the state returned by \"get_state\" in \"path\", e.g. next to the model
+        """
+        util.saveObj(self.get_state(), path)
+
+    def load_state(self, path, skip_partial=False):
+        """
+        Resumes the iterator from the state saved in \"path\" by \"save_state\"
+        """
+        self.set_state(util.loadObj(path), skip_partial=skip_partial)
+
+    def get_stats(self):
+        """
+        Returns a snapshot of the stats of loading, if the dataset was created with \"stats\" set to True.
+        The stages are \"listdir\" (listing and checking the files in updatePath), \"shapes\" (reading the .shape files),
+        \"io\" (loadTensor, with the bytes read), \"scale\" (log10 and scaling), \"masks\" (filterSpec), \"pitches\" (buildPitch),
+        \"layout\" (toLayout), \"parmap\" (the wall time of loading files in parallel, with the pickling), \"shuffle\" and \"scratch\" (saving batches).
+        The stages timed inside the processes of parmap are summed over the processes and can exceed the wall time.
+        The counts are the \"files\" and the \"segments\" loaded, the \"reloads\" of the batches in memory and the \"batches\" returned
+        """
+        return self.stats.snapshot()
+
+    def reset_stats(self):
+        self.stats.reset()
+
     def __len__(self):
         return self.iteration_size
 
@@ -740,7 +1151,7 @@ class LargeDatasetMask1(LargeDataset):
     def __init__(self, path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[],nsamples=0, timbre_model_path=None,
         batch_size=64, batch_memory=1000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,
         log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1., pitched=False,save_mask=True,pitch_norm=127.,nsources=2,
-        nharmonics=20, nprocs=2,pitch_code='g',jump=0):
+        nharmonics=20, nprocs=2,pitch_code='g',jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
 
         self.nharmonics = nharmonics
         self.timbre_model_path=timbre_model_path
@@ -754,7 +1165,7 @@ class LargeDatasetMask1(LargeDataset):
             self.harmonics = util.loadObj(self.timbre_model_path)
         super(LargeDatasetMask1, self).__init__(path_transform_in=path_transform_in, path_transform_out=path_transform_out, sampleRate=sampleRate, exclude_list=exclude_list, nsamples=nsamples, extra_features=extra_features, model=model, context=context,
             batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, tensortype=tensortype, scratch_path=scratch_path, nsources=nsources,jump=jump,
-            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs)
+            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs,stats=stats,stats_every=stats_every,memory_budget=memory_budget,layout=layout,mask_inputs=mask_inputs)
 
     def filterSpec(self,mag,notes,start,stop):
         if not hasattr(self, 'ninst'):
@@ -820,7 +1231,7 @@ class LargeDatasetMask2(LargeDataset):
     def __init__(self, path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[],nsamples=0, timbre_model_path=None,
         batch_size=64, batch_memory=1000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,
         log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1., pitched=False,save_mask=True,pitch_norm=127.,nsources=2,
-        nharmonics=20, nprocs=2,pitch_code='g',jump=0):
+        nharmonics=20, nprocs=2,pitch_code='g',jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
 
         self.nharmonics = nharmonics
         self.timbre_model_path=timbre_model_path
@@ -834,7 +1245,7 @@ class LargeDatasetMask2(LargeDataset):
             self.harmonics = util.loadObj(self.timbre_model_path)
         super(LargeDatasetMask2, self).__init__(path_transform_in=path_transform_in, path_transform_out=path_transform_out, sampleRate=sampleRate, exclude_list=exclude_list, nsamples=nsamples, extra_features=extra_features, model=model, context=context,
             batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, tensortype=tensortype, scratch_path=scratch_path, nsources=nsources,jump=jump,
-            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs)
+            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs,stats=stats,stats_every=stats_every,memory_budget=memory_budget,layout=layout,mask_inputs=mask_inputs)
 
     def filterSpec(self,mag,notes,start,stop):
         if not hasattr(self, 'ninst'):
@@ -903,12 +1314,12 @@ class LargeDatasetMask2(LargeDataset):
 class LargeDatasetMulti(LargeDataset):
     def __init__(self, prefix_in="in",prefix_out="out", path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[],nsamples=0, timbre_model_path=None,
         batch_size=64, batch_memory=1000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,pitched=False,save_mask=False,
-        log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1.,nsources=2, pitch_norm=127,nprocs=2,jump=0):
+        log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1.,nsources=2, pitch_norm=127,nprocs=2,jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
         self.prefix_in = prefix_in
         self.prefix_out = prefix_out
         super(LargeDatasetMulti, self).__init__(path_transform_in=path_transform_in, path_transform_out=path_transform_out, sampleRate=sampleRate, exclude_list=exclude_list, nsamples=nsamples, extra_features=extra_features, model=model, context=context,
             batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, tensortype=tensortype, scratch_path=scratch_path, nsources=nsources,jump=jump,
-            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs)
+            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs,stats=stats,stats_every=stats_every,memory_budget=memory_budget,layout=layout,mask_inputs=mask_inputs)
 
     def loadPitch(self,id):
         if self.pitch_code is None:
@@ -928,7 +1339,7 @@ class LargeDatasetMulti(LargeDataset):
         #allmixinput = np.expand_dims(allmixinput[0], axis=0)
         return allmixinput,allmixoutput
 
-    def loadFile(self,id,idxbegin=None,idxend=None):
+    def readFile(self,id,idxbegin=None,idxend=None):
         """
         reads a .data file and splits into batches
         """
@@ -962,14 +1373,15 @@ class LargeDatasetMulti(LargeDataset):
                 allfeatures = self.load_extra_features(id)
 
             #apply a scaled log10(1+value) function to make sure larger values are eliminated
-            if self.log_in==True:
-                allmixinput = self.mult_factor_in*np.log10(1.0+allmixinput)
-            else:
-                allmixinput = self.mult_factor_in*allmixinput
-            if self.log_out==True:
-                allmixoutput = self.mult_factor_out*np.log10(1.0+allmixoutput)
-            else:
-                allmixoutput = self.mult_factor_out*allmixoutput
+            with self.stats.time('scale'):
+                if self.log_in==True:
+                    allmixinput = self.mult_factor_in*np.log10(1.0+allmixinput)
+                else:
+                    allmixinput = self.mult_factor_in*allmixinput
+                if self.log_out==True:
+                    allmixoutput = self.mult_factor_out*np.log10(1.0+allmixoutput)
+                else:
+                    allmixoutput = self.mult_factor_out*allmixoutput
 
             i = 0
             start = 0
@@ -980,9 +1392,11 @@ class LargeDatasetMulti(LargeDataset):
                 if self.extra_features:
                     features[0,-1, :] = allfeatures
                 if self.pitched:
-                    pitches[0, :, :allmixinput.shape[1],:] = self.buildPitch(allmixinput[0],allpitch,start,start+self.time_context)
+                    with self.stats.time('pitches'):
+                        pitches[0, :, :allmixinput.shape[1],:] = self.buildPitch(allmixinput[0],allpitch,start,start+self.time_context)
                 if self.save_mask:
-                    masks[0, :, :allmixinput.shape[1],:] = self.filterSpec(allmixinput[0],allpitch,start,start+self.time_context)
+                    with self.stats.time('masks'):
+                        masks[0, :, :allmixinput.shape[1],:] = self.filterSpec(allmixinput[0],allpitch,start,start+self.time_context)
             else:
                 while (start + self.time_context) < allmixinput.shape[1]:
                     if i>=idxbegin and i<idxend:
@@ -999,9 +1413,11 @@ class LargeDatasetMulti(LargeDataset):
                                 j=j+1
 
                         if self.pitched:
-                            pitches[i-idxbegin, :, :allmixinput.shape[1], :] = self.buildPitch(allminput,allpitch,start,start+self.time_context)
+                            with self.stats.time('pitches'):
+                                pitches[i-idxbegin, :, :allmixinput.shape[1], :] = self.buildPitch(allminput,allpitch,start,start+self.time_context)
                         if self.save_mask:
-                            masks[i-idxbegin, :, :allmixinput.shape[1], :] = self.filterSpec(allminput,allpitch,start,start+self.time_context)
+                            with self.stats.time('masks'):
+                                masks[i-idxbegin, :, :allmixinput.shape[1], :] = self.filterSpec(allminput,allpitch,start,start+self.time_context)
 
                     i = i + 1
                     start = start - self.overlap + self.time_context
@@ -1020,6 +1436,8 @@ class LargeDatasetMulti(LargeDataset):
             if self.extra_features:
                 allfeatures = None
 
+            self.stats.count('files')
+            self.stats.count('segments', idxend - idxbegin)
             result = {'inputs':inputs, 'outputs':outputs, 'pitches':pitches, 'masks':masks, 'features':features}
             inputs = None
             outputs = None
@@ -1084,6 +1502,31 @@ class LargeDatasetMulti(LargeDataset):
 
 
 
+    def exampleShapes(self):
+        """
+        Returns the shape of one example in each of the buffers allocated by \"initBatches\"
+        """
+        shapes = {'inputs': (self.channels_in,self.time_context,self.input_size), 'outputs': (self.channels_out,self.time_context,self.output_size)}
+        if self.pitched:
+            shapes['pitches'] = (self.channels_out,self.time_context,self.npitches)
+        if self.save_mask:
+            shapes['masks'] = (self.channels_out,self.time_context,self.input_size)
+        if self.extra_features:
+            shapes['features'] = (self.context,self.extra_feat_size)
+        return shapes
+
+    def rawFiles(self,id):
+        """
+        Returns the paths of the .data files read by \"loadFile\" for the file \"id\"
+        """
+        files = [os.path.join(self.path_transform_in[self.dirid[id]],self.file_list[id]),
+            os.path.join(self.path_transform_out[self.dirid[id]],self.file_list[id].replace(self.prefix_in+'_m_',self.prefix_out+'_m_'))]
+        if self.pitched or self.save_mask:
+            files.append(files[0].replace(self.prefix_in+'_m_','_'+self.pitch_code+'_'))
+        if self.extra_features:
+            files.append(files[0].replace(self.prefix_in+'_m_','_'+self.model+'_'))
+        return files
+
     def updatePath(self, path_in, path_out=None):
         """
         Read the list of .data files in path, compute how many examples we can create from each file, and initialize the output variables
@@ -1095,13 +1538,15 @@ class LargeDatasetMulti(LargeDataset):
             self.path_transform_out = path_out
 
         #we read the file_list from the path_transform_in directory
-        self.file_list = [f for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
-            if f.endswith(self.prefix_in+'_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f.replace(self.prefix_in+'_m_',self.prefix_out+'_m_'))) and\
-            f.split('_',1)[0] not in self.exclude_list]
+        with self.stats.time('listdir'):
+            self.file_list = [f for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
+                if f.endswith(self.prefix_in+'_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f.replace(self.prefix_in+'_m_',self.prefix_out+'_m_'))) and\
+                f.split('_',1)[0] not in self.exclude_list]
 
-        self.dirid = [k for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
-            if f.endswith(self.prefix_in+'_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f.replace(self.prefix_in+'_m_',self.prefix_out+'_m_'))) and\
-            f.split('_',1)[0] not in self.exclude_list]
+            self.dirid = [k for k in range(len(self.path_transform_in)) for f in os.listdir(self.path_transform_in[k]) \
+                if f.endswith(self.prefix_in+'_m_.data') and os.path.isfile(os.path.join(self.path_transform_out[k],f.replace(self.prefix_in+'_m_',self.prefix_out+'_m_'))) and\
+                f.split('_',1)[0] not in self.exclude_list]
+        self.stats.count('files_indexed', len(self.file_list))
 
         if self.nsamples>2 and self.nsamples < len(self.file_list):
             ids = np.squeeze(np.random.choice(len(self.file_list), size=self.nsamples, replace=False))
@@ -1113,7 +1558,8 @@ class LargeDatasetMulti(LargeDataset):
         if self.total_files<1:
             raise Exception('Could not find any file in the input directory! Files must end with _m_.data')
         logging.info("found %s files",str(self.total_files))
-        self.num_points = np.cumsum(np.array([0]+[self.getNum(i) for i in range(self.total_files)], dtype=int))
+        with self.stats.time('shapes'):
+            self.num_points = np.cumsum(np.array([0]+[self.getNum(i) for i in range(self.total_files)], dtype=int))
         self.total_points = self.num_points[-1]
         self.getFeatureSize()
         self.initBatches()
@@ -1126,6 +1572,8 @@ class LargeDatasetMulti(LargeDataset):
         self.batch_size = np.minimum(self.batch_size,self.num_points[-1])
         self.iteration_size = int(self.total_points / self.batch_size)
         self.batch_memory = np.minimum(self.batch_memory,self.iteration_size)
+        if self.memory_budget is not None:
+            self.batch_memory = self.planBatchMemory(self.memory_budget)
         logging.info("iteration size %s",str(self.iteration_size))
         self._index = 0
         self.findex = 0
@@ -1135,16 +1583,17 @@ class LargeDatasetMulti(LargeDataset):
         self.foffset = 0
         self.mini_index = 0
         self.scratch_index = 0
-        self.batch_inputs = np.zeros((self.batch_memory*self.batch_size,self.channels_in,self.time_context,self.input_size), dtype=self.tensortype)
-        self.batch_outputs = np.zeros((self.batch_memory*self.batch_size,self.channels_out,self.time_context,self.output_size), dtype=self.tensortype)
+        shapes = self.exampleShapes()
+        self.batch_inputs = np.zeros((self.batch_memory*self.batch_size,)+shapes['inputs'], dtype=self.tensortype)
+        self.batch_outputs = np.zeros((self.batch_memory*self.batch_size,)+shapes['outputs'], dtype=self.tensortype)
         if self.pitched:
-            self.batch_pitches = np.zeros((self.batch_memory*self.batch_size,self.channels_out,self.time_context,self.npitches), dtype=self.tensortype)
+            self.batch_pitches = np.zeros((self.batch_memory*self.batch_size,)+shapes['pitches'], dtype=self.tensortype)
 
         if self.save_mask:
-            self.batch_masks = np.zeros((self.batch_memory*self.batch_size,self.channels_out,self.time_context,self.input_size), dtype=self.tensortype)
+            self.batch_masks = np.zeros((self.batch_memory*self.batch_size,)+shapes['masks'], dtype=self.tensortype)
 
         if self.extra_features == True:
-            self.batch_features = np.zeros((self.batch_memory*self.batch_size,self.context,self.extra_feat_size), dtype=self.tensortype)
+            self.batch_features = np.zeros((self.batch_memory*self.batch_size,)+shapes['features'], dtype=self.tensortype)
 
         self.loadBatches()
 
@@ -1153,7 +1602,7 @@ class LargeDatasetMultiMask1(LargeDatasetMulti):
     def __init__(self, prefix_in="in", prefix_out="out",path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[],nsamples=0, timbre_model_path=None,
         batch_size=64, batch_memory=1000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,
         log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1., pitched=False,save_mask=True,pitch_norm=127.,nsources=2,
-        nharmonics=20, nprocs=2,pitch_code='g',jump=0):
+        nharmonics=20, nprocs=2,pitch_code='g',jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
 
         self.nharmonics = nharmonics
         self.timbre_model_path=timbre_model_path
@@ -1167,7 +1616,7 @@ class LargeDatasetMultiMask1(LargeDatasetMulti):
             self.harmonics = util.loadObj(self.timbre_model_path)
         super(LargeDatasetMultiMask1, self).__init__(path_transform_in=path_transform_in, path_transform_out=path_transform_out, sampleRate=sampleRate, exclude_list=exclude_list, nsamples=nsamples, extra_features=extra_features, model=model, context=context,
             batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, tensortype=tensortype, scratch_path=scratch_path, nsources=nsources,jump=jump,prefix_in=prefix_in, prefix_out=prefix_out,
-            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs)
+            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs,stats=stats,stats_every=stats_every,memory_budget=memory_budget,layout=layout,mask_inputs=mask_inputs)
 
     def filterSpec(self,mag,notes,start,stop):
         if not hasattr(self, 'ninst'):
@@ -1281,7 +1730,7 @@ class LargeDatasetMultiMask2(LargeDatasetMulti):
     def __init__(self, prefix_in="in", prefix_out="out", path_transform_in=None, path_transform_out=None, sampleRate=44100, exclude_list=[],nsamples=0, timbre_model_path=None,
         batch_size=64, batch_memory=1000, time_context=-1, overlap=5, tensortype=float, scratch_path=None, extra_features=False, model="", context=5,
         log_in=False, log_out=False, mult_factor_in=1., mult_factor_out=1., pitched=False,save_mask=True,pitch_norm=127.,nsources=2,
-        nharmonics=20, nprocs=2,pitch_code='g',jump=0):
+        nharmonics=20, nprocs=2,pitch_code='g',jump=0,stats=False,stats_every=0,memory_budget=None,layout='flat',mask_inputs=False):
 
         self.nharmonics = nharmonics
         self.timbre_model_path=timbre_model_path
@@ -1295,7 +1744,7 @@ class LargeDatasetMultiMask2(LargeDatasetMulti):
             self.harmonics = util.loadObj(self.timbre_model_path)
         super(LargeDatasetMultiMask2, self).__init__(path_transform_in=path_transform_in, path_transform_out=path_transform_out, sampleRate=sampleRate, exclude_list=exclude_list, nsamples=nsamples, extra_features=extra_features, model=model, context=context,
             batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, tensortype=tensortype, scratch_path=scratch_path, nsources=nsources,jump=jump,prefix_in=prefix_in, prefix_out=prefix_out,
-            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs)
+            log_in=log_in, log_out=log_out, mult_factor_in=mult_factor_in, mult_factor_out=mult_factor_out,pitched=pitched,save_mask=save_mask,pitch_norm=pitch_norm,nprocs=nprocs,stats=stats,stats_every=stats_every,memory_budget=memory_budget,layout=layout,mask_inputs=mask_inputs)
 
     def filterSpec(self,mag,notes,start,stop):
         if not hasattr(self, 'ninst'):
@@ -0,0 +1,449 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import sys
+import getopt
+import functools
+import itertools
+import collections
+import numpy as np
+import scipy.fft
+import scipy.linalg
+import util
+import dataset
+import climate
+logging = climate.get_logger('bss_eval')
+
+
+"""
+BSS Eval 3.0 (see the MATLAB toolbox in evaluation/bss_eval) in numpy.
+The estimates are decomposed with least-squares projections on the references delayed by up to \"flen\"-1 samples:
+the cross-correlations are computed with FFTs, the projection of all the estimates on all the references is one
+linear system and the projections on each reference are solved as one batch of systems.
+Everything which depends only on the references (their spectra, the Gram matrices and their Cholesky factorizations)
+is kept in a Projection, which can be shared by all the methods evaluated against the same references (see ReferenceCache).
+Signals are arrays of shape (nsrc,nsampl,nchan) as in bss_eval_images.m.
+"""
+def lags(x, flen):
+    """
+    Returns the lags -(flen-1)...(flen-1) of the circular cross-correlations \"x\" (last axis)
+    """
+    return np.concatenate([x[...,x.shape[-1]-flen+1:], x[...,:flen]], axis=-1)
+
+
+def factorize(G):
+    """
+    Returns the Cholesky factorization of the Gram matrix \"G\", or G itself if it is singular (e.g. silent references)
+    """
+    try:
+        return scipy.linalg.cho_factor(G)
+    except np.linalg.LinAlgError:
+        return G
+
+
+def solve(factor, D):
+    """
+    Solves G C = D given the factorization of G, with a least-squares solution if G is singular
+    """
+    if isinstance(factor, tuple):
+        return scipy.linalg.cho_solve(factor, D)
+    return np.linalg.lstsq(factor, D, rcond=None)[0]
+
+
+class Projection(object):
+    """
+    Least-squares projections of estimates on the subspace of the delayed references
+
+    Parameters
+    ----------
+    references : 3D numpy array
+        The reference sources, shape (nsrc,nsampl,nchan)
+    flen : int, optional
+        The length of the distortion filters
+    """
+    def __init__(self, references, flen=512):
+        self.nsrc, self.nsampl, self.nchan = references.shape
+        self.flen = flen
+        self.length = self.nsampl + flen - 1
+        self.fftlen = scipy.fft.next_fast_len(self.length, real=True)
+        nref = self.nsrc * self.nchan
+        #one row per (source,channel)
+        self.s = np.transpose(references, (0,2,1)).reshape(nref, self.nsampl)
+        self.sf = np.fft.rfft(self.s, n=self.fftlen, axis=1)
+        #Gram matrix G[k1,a,k2,b] = sum_t s_k1[t-a] s_k2[t-b] from the cross-correlations of all the pairs of references
+        lag = np.arange(flen)[None,:] - np.arange(flen)[:,None] + flen - 1
+        G = np.zeros((nref,flen,nref,flen))
+        for k1 in range(nref):
+            ss = lags(np.fft.irfft(self.sf[k1] * np.conj(self.sf[:k1+1]), n=self.fftlen, axis=1), flen)[:,lag]
+            G[k1,:,:k1+1,:] = np.transpose(ss, (1,0,2))
+            G[:k1+1,:,k1,:] = np.transpose(ss, (0,2,1))
+        #the Gram matrices of each reference alone are the diagonal blocks
+        block = self.nchan * flen
+        self.factors = [factorize(G[j*self.nchan:(j+1)*self.nchan,:,j*self.nchan:(j+1)*self.nchan,:].reshape(block, block))
+            for j in range(self.nsrc)]
+        self.factor = factorize(G.reshape(nref*flen, nref*flen))
+        self.nbytes = self.sf.nbytes + sum([f[0].nbytes if isinstance(f, tuple) else f.nbytes for f in [self.factor] + self.factors])
+
+    def correlate(self, estimates):
+        """
+        Returns D[k,l,m] = sum_t s_k[t-l] se_m[t] for the channels m of the \"estimates\", shape (nest,nsampl,nchan)
+        """
+        se = np.transpose(estimates, (0,2,1)).reshape(-1, self.nsampl)
+        sef = np.conj(np.fft.rfft(se, n=self.fftlen, axis=1))
+        D = np.zeros((len(self.s), self.flen, len(se)))
+        delay = (-np.arange(self.flen)) % self.fftlen
+        for k in range(len(self.s)):
+            D[k] = np.fft.irfft(self.sf[k] * sef, n=self.fftlen, axis=1)[:,delay].T
+        return D
+
+    def filter(self, C, rows):
+        """
+        Returns the sum of the references \"rows\" filtered with the coefficients \"C\", shape (len(rows),flen,m),
+            shape (m,nsampl+flen-1)
+        """
+        out = 0
+        for c,k in zip(C, rows):
+            out = out + np.fft.rfft(c, n=self.fftlen, axis=0).T * self.sf[k]
+        return np.fft.irfft(out, n=self.fftlen, axis=1)[:,:self.length]
+
+    def project(self, estimates, diagonal=False):
+        """
+        Projects the \"estimates\", shape (nest,nsampl,nchan), on all the references and on each reference
+
+        Parameters
+        ----------
+        estimates : 3D numpy array
+            The estimated sources, shape (nest,nsampl,nchan)
+        diagonal : boolean, optional
+            If True only the estimate j is projected on the reference j
+
+        Yields
+        ------
+        pfull : 3D numpy array
+            The projections on all the references, shape (nest,nchan,nsampl+flen-1)
+        pspat : generator
+            Gives for each reference j the projections on it, shape (nest,nchan,nsampl+flen-1)
+            or (1,nchan,nsampl+flen-1) if \"diagonal\"
+        """
+        nest = len(estimates)
+        D = self.correlate(estimates)
+        nref = len(self.s)
+        C = solve(self.factor, D.reshape(nref*self.flen, -1)).reshape(nref, self.flen, -1)
+        pfull = self.filter(C, range(nref)).reshape(nest, self.nchan, self.length)
+        Dj = D.reshape(self.nsrc, self.nchan*self.flen, nest, self.nchan)
+        if diagonal:
+            Dj = Dj[np.arange(self.nsrc),:,np.arange(self.nsrc),:]
+        else:
+            Dj = Dj.reshape(self.nsrc, self.nchan*self.flen, nest*self.nchan)
+        def pspat():
+            for j in range(self.nsrc):
+                rows = range(j*self.nchan, (j+1)*self.nchan)
+                Cj = solve(self.factors[j], Dj[j]).reshape(self.nchan, self.flen, -1)
+                yield self.filter(Cj, rows).reshape(-1, self.nchan, self.length)
+        return pfull, pspat()
+
+
+class ReferenceCache(object):
+    """
+    Keeps the projections of the references of the last evaluated tracks, such that evaluating another method
+        against the same references only computes the cross-correlations with its estimates
+
+    Parameters
+    ----------
+    maxbytes : float, optional
+        The memory used by the cached projections, the least recently used ones are dropped above it
+    """
+    def __init__(self, maxbytes=2e9):
+        self.maxbytes = maxbytes
+        self.projections = collections.OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, references, flen=512):
+        """
+        Returns the projection of the \"references\" stored under \"key\", e.g. the reference files and the window,
+            and computes it if it is not in the cache
+        """
+        key = (key, references.shape, flen)
+        if key in self.projections:
+            self.hits = self.hits + 1
+            self.projections.move_to_end(key)
+            return self.projections[key]
+        self.misses = self.misses + 1
+        projection = Projection(references, flen)
+        self.projections[key] = projection
+        self.nbytes = self.nbytes + projection.nbytes
+        while self.nbytes > self.maxbytes and len(self.projections) > 1:
+            self.nbytes = self.nbytes - self.projections.popitem(last=False)[1].nbytes
+        return projection
+
+
+def energy(x):
+    return np.sum(np.power(x,2), axis=(-2,-1))
+
+
+def ratio(num, den):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return 10 * np.log10(num / den)
+
+
+def decompose(estimates, references, flen=512, diagonal=False, projection=None):
+    """
+    Computes the energies of the components of the decomposition of the estimates in bss_decomp_mtifilt.m,
+        s_true, s_true+e_spat, s_true+e_spat+e_interf and the errors, for each pair (estimate,reference)
+        or for the pairs (j,j) if \"diagonal\", shape (nest,nsrc) or (nsrc,).
+        The \"projection\" of the references is computed if it is not given.
+    """
+    nsrc, nsampl, nchan = references.shape
+    assert estimates.shape[1:] == references.shape[1:], "The estimates and the references must have the same duration and channels"
+    proj = projection if projection is not None else Projection(references, flen)
+    pfull, pspat = proj.project(estimates, diagonal=diagonal)
+    se = np.zeros(pfull.shape)
+    se[:,:,:nsampl] = np.transpose(estimates, (0,2,1))
+    s_true = np.zeros((nsrc, nchan, proj.length))
+    s_true[:,:,:nsampl] = np.transpose(references, (0,2,1))
+    shape = (nsrc,) if diagonal else (len(estimates), nsrc)
+    e = dict((name, np.zeros(shape)) for name in ['true', 'spat', 'filt', 'interf', 'full', 'artif', 'distortion', 'noise'])
+    for j,p in enumerate(pspat):
+        ests = [j] if diagonal else range(len(estimates))
+        index = slice(j, j+1) if diagonal else (slice(None), j)
+        #s_true, e_spat = pspat-s_true, e_interf = pfull-pspat, e_artif = se-pfull
+        e['true'][index] = energy(s_true[j])
+        e['spat'][index] = energy(p - s_true[j])
+        e['filt'][index] = energy(p)
+        e['interf'][index] = energy(pfull[ests] - p)
+        e['full'][index] = energy(pfull[ests])
+        e['artif'][index] = energy(se[ests] - pfull[ests])
+        #e_spat+e_interf+e_artif and e_interf+e_artif
+        e['distortion'][index] = energy(se[ests] - s_true[j])
+        e['noise'][index] = energy(se[ests] - p)
+    return e
+
+
+def permutation(SIR):
+    """
+    Returns the assignment of the estimates to the references which maximizes the mean SIR, SIR[jest,jtrue]:
+        as \"perm\" in bss_eval_images.m, the estimate perm[j] is assigned to the reference j
+    """
+    nsrc = SIR.shape[0]
+    perms = list(itertools.permutations(range(nsrc)))
+    meanSIR = [np.mean(SIR[list(p),np.arange(nsrc)]) for p in perms]
+    return np.array(perms[int(np.nanargmax(meanSIR))])
+
+
+def bss_eval_images(estimates, references, flen=512, compute_permutation=True, projection=None):
+    """
+    Computes SDR, ISR, SIR and SAR of the estimated source images as bss_eval_images.m
+
+    Parameters
+    ----------
+    estimates : 3D numpy array
+        The estimated source images, shape (nsrc,nsampl,nchan)
+    references : 3D numpy array
+        The reference source images, shape (nsrc,nsampl,nchan)
+    flen : int, optional
+        The length of the distortion filters
+    compute_permutation : boolean, optional
+        If False the estimate j is compared to the reference j (bss_eval_images_nosort.m)
+    projection : Projection, optional
+        The projection of the \"references\", computed if it is not given
+
+    Yields
+    ------
+    SDR, ISR, SIR, SAR : 1D numpy array
+        The criteria in dB for each reference, shape (nsrc,), of the estimate assigned to it
+    perm : 1D numpy array
+        The estimate assigned to each reference: the criteria j are the ones of the estimate perm[j] and the reference j
+    """
+    e = decompose(estimates, references, flen, diagonal=not compute_permutation, projection=projection)
+    SDR = ratio(e['true'], e['distortion'])
+    ISR = ratio(e['true'], e['spat'])
+    SIR = ratio(e['filt'], e['interf'])
+    SAR = ratio(e['full'], e['artif'])
+    perm = np.arange(len(estimates))
+    if compute_permutation:
+        perm = permutation(SIR)
+        SDR, ISR, SIR, SAR = [c[perm,np.arange(len(perm))] for c in [SDR, ISR, SIR, SAR]]
+    return SDR, ISR, SIR, SAR, perm
+
+
+def bss_eval_sources(estimates, references, flen=512, compute_permutation=True, projection=None):
+    """
+    Computes SDR, SIR and SAR of the estimated mono sources as bss_eval_sources.m,
+        \"estimates\" and \"references\" have the shape (nsrc,nsampl)
+    """
+    e = decompose(estimates[:,:,np.newaxis], references[:,:,np.newaxis], flen, diagonal=not compute_permutation,
+        projection=projection)
+    SDR = ratio(e['filt'], e['noise'])
+    SIR = ratio(e['filt'], e['interf'])
+    SAR = ratio(e['full'], e['artif'])
+    perm = np.arange(len(estimates))
+    if compute_permutation:
+        perm = permutation(SIR)
+        SDR, SIR, SAR = [c[perm,np.arange(len(perm))] for c in [SDR, SIR, SAR]]
+    return SDR, SIR, SAR, perm
+
+
+def segments(nsampl, win, hop):
+    """
+    Returns the windows of \"win\" samples every \"hop\" samples of the function bss_eval in DSD100_eval_only.m
+    """
+    nwin = int(np.floor((nsampl - win + 1 + hop) / float(hop)))
+    return [slice(k*hop, k*hop + win) for k in range(np.maximum(nwin,0))]
+
+
+def bss_eval_framewise(estimates, references, win, hop, flen=512, cache=None, key=None):
+    """
+    Computes SDR, ISR, SIR and SAR of the estimate j with respect to the reference j in windows of \"win\" samples
+        every \"hop\" samples as the function bss_eval in DSD100_eval_only.m, each criterion has the shape (nsrc,nwin).
+        The projections of the references are taken from the ReferenceCache \"cache\" under \"key\" if given.
+    """
+    windows = segments(references.shape[1], win, hop)
+    criteria = np.zeros((4, len(estimates), len(windows)))
+    for k,window in enumerate(windows):
+        projection = cache.get((key, window.start, window.stop), references[:,window], flen) if cache is not None else None
+        criteria[:,:,k] = bss_eval_images(estimates[:,window], references[:,window], flen, compute_permutation=False,
+            projection=projection)[:4]
+    return criteria[0], criteria[1], criteria[2], criteria[3]
+
+
+def read_sources(filenames, nchan=None):
+    """
+    Reads the wav files \"filenames\" into an array of shape (nsrc,nsampl,nchan), mono files are repeated on \"nchan\" channels.
+        A file given as a tuple (filename,channel) gives only that channel, e.g. the voice of iKala.
+    """
+    sources = []
+    for filename in filenames:
+        channel = None
+        if isinstance(filename, (tuple, list)):
+            filename, channel = filename
+        audio, sampleRate, bitrate = util.readAudioScipy(filename)
+        if audio.ndim == 1:
+            audio = audio[:,np.newaxis]
+        if channel is not None:
+            audio = audio[:,channel:channel+1]
+        sources.append(audio)
+    nchan = nchan if nchan is not None else max([s.shape[1] for s in sources])
+    sources = [np.tile(s, (1, nchan // s.shape[1])) if s.shape[1] < nchan else s for s in sources]
+    nsampl = min([len(s) for s in sources])
+    return np.array([s[:nsampl,:nchan] for s in sources])
+
+
+def evaluate_track(track, win=None, hop=None, flen=512, compute_permutation=False, criteria='images', cache=None):
+    """
+    Evaluates a track given as a dictionary with the lists of wav files \"estimates\" and \"references\" in the same order
+
+    Parameters
+    ----------
+    track : dictionary
+        The \"name\", the \"references\" and the \"estimates\", which can also be a dictionary of methods,
+        each with its list of wav files. If \"mixture\" is True, the mixture of the references is evaluated as well
+        and the normalized criteria (e.g. NSDR = SDR - SDR of the mixture) are added as in evaluate_SS_iKala.m.
+    win : int, optional
+        The criteria are computed in windows of \"win\" samples every \"hop\" samples if given
+    hop : int, optional
+        The hop size of the windows in samples, by default \"win\"
+    flen : int, optional
+        The length of the distortion filters
+    compute_permutation : boolean, optional
+        If the estimates are matched to the references with the permutation of the best SIR (not in windows)
+    criteria : string, optional
+        'images' (SDR, ISR, SIR, SAR with bss_eval_images) or 'sources' (SDR, SIR, SAR of mono sources with bss_eval_sources)
+    cache : ReferenceCache, optional
+        Keeps the projections of the references between calls
+
+    Yields
+    ------
+    results : dictionary
+        The name and the criteria of the track, each of shape (nsrc,) or (nsrc,nwin); a dictionary of those for each method
+        if the estimates are given as a dictionary. The projections of the references are computed once for all the methods.
+    """
+    references = read_sources(track['references'])
+    methods = track['estimates'] if isinstance(track['estimates'], dict) else {None: track['estimates']}
+    estimates = dict((m, read_sources(files, nchan=references.shape[2])) for m,files in methods.items())
+    if track.get('mixture', False):
+        estimates['__mixture__'] = np.tile(np.sum(references, axis=0, keepdims=True), (len(references),1,1))
+    nsampl = min([references.shape[1]] + [e.shape[1] for e in estimates.values()])
+    windows = segments(nsampl, win, hop if hop is not None else win) if win is not None else [slice(0, nsampl)]
+    values = dict((m, np.zeros((4, len(references), len(windows)))) for m in estimates)
+    for k,window in enumerate(windows):
+        if cache is not None:
+            projection = cache.get((tuple(track['references']), window.start, window.stop), references[:,window], flen)
+        else:
+            projection = Projection(references[:,window], flen)
+        for m in estimates:
+            if criteria == 'sources':
+                assert references.shape[2] == 1, "bss_eval_sources needs mono sources"
+                SDR, SIR, SAR = bss_eval_sources(estimates[m][:,window,0], references[:,window,0], flen,
+                    compute_permutation=compute_permutation and win is None, projection=projection)[:3]
+                values[m][:,:,k] = [SDR, np.full(len(SDR), np.nan), SIR, SAR]
+            else:
+                values[m][:,:,k] = bss_eval_images(estimates[m][:,window], references[:,window], flen,
+                    compute_permutation=compute_permutation and win is None, projection=projection)[:4]
+    results = {}
+    for m in methods:
+        c = values[m] if win is not None else values[m][:,:,0]
+        results[m] = {'name': track.get('name'), 'sdr': c[0], 'isr': c[1], 'sir': c[2], 'sar': c[3]}
+        if '__mixture__' in values:
+            n = c - (values['__mixture__'] if win is not None else values['__mixture__'][:,:,0])
+            results[m].update({'nsdr': n[0], 'nsir': n[2], 'nsar': n[3]})
+    return results if isinstance(track['estimates'], dict) else results[None]
+
+
+def evaluate_tracks(tracks, nprocs=4, **kwargs):
+    """
+    Evaluates the list of \"tracks\" (see evaluate_track) in parallel with \"nprocs\" processes,
+        \"kwargs\" are passed to evaluate_track
+    """
+    return dataset.parmap(functools.partial(evaluate_track, **kwargs), tracks, nprocs=nprocs)
+
+
+def main(argv):
+    usage = 'python -m evaluation.bss_eval -e <est1.wav,est2.wav,...> -r <ref1.wav,ref2.wav,...> [-w <window_seconds>] [-s <hop_seconds>]'
+    try:
+        opts, args = getopt.getopt(argv,"he:r:w:s:",["estimates=","references=","window=","hop="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    window = None
+    hop = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-e", "--estimates"):
+            estimates = arg.split(',')
+        elif opt in ("-r", "--references"):
+            references = arg.split(',')
+        elif opt in ("-w", "--window"):
+            window = float(arg)
+        elif opt in ("-s", "--hop"):
+            hop = float(arg)
+    sampleRate = util.readAudioScipy(references[0])[1]
+    win = int(window * sampleRate) if window is not None else None
+    hop = int(hop * sampleRate) if hop is not None else win
+    result = evaluate_track({'estimates': estimates, 'references': references}, win=win, hop=hop)
+    for j in range(len(references)):
+        print('%s SDR %.2f ISR %.2f SIR %.2f SAR %.2f' % (references[j], np.nanmedian(result['sdr'][j]),
+            np.nanmedian(result['isr'][j]), np.nanmedian(result['sir'][j]), np.nanmedian(result['sar'][j])))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,183 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import sys
+import getopt
+import functools
+import multiprocessing
+import numpy as np
+import dataset
+from evaluation import bss_eval
+from evaluation.results import ResultsStore
+import climate
+logging = climate.get_logger('evaluate')
+
+
+"""
+Local evaluation of the separated outputs of several methods, replacing the cluster scripts in evaluation/script_cluster.
+The outputs are discovered with the layouts of the MATLAB evaluation scripts, the (method,track) pairs which are not yet
+in the results store (see results.py) are evaluated on a process pool, one task per track with all its missing methods,
+and the results of each task are appended atomically to the store, such that an interrupted or repeated run only evaluates
+the new outputs.
+"""
+DATASETS = {
+    #DSD100_eval_only.m: <db>/Sources/<subset>/<song>/<source>.wav, <outputs>/<method>/<subset>/<song>/mixture_<source>.wav
+    'dsd100': {'sources': ['bass','drums','other','vocals'], 'estimates': [['mixture_bass','bass'], ['mixture_drums','drums'],
+        ['mixture_others','mixture_other','other'], ['mixture_vocals','vocals']], 'subsets': ['Dev','Test'],
+        'criteria': 'images', 'window': 30, 'hop': 15, 'compute_permutation': False},
+    #Bach10_eval_only.m: <db>/Sources/<song>/<song>-<source>.wav, <outputs>/<method>/<song>-<source>.wav
+    'bach10': {'sources': ['bassoon','clarinet','saxphone','violin'], 'criteria': 'sources', 'window': None, 'hop': None,
+        'compute_permutation': True},
+    #evaluate_SS_iKala.m: <db>/Wavfile/<song>.wav with music and voice on the channels, <outputs>/<method>/<song>-<source>.wav
+    'ikala': {'sources': ['voice','music'], 'channels': [1,0], 'criteria': 'sources', 'window': None, 'hop': None,
+        'compute_permutation': True, 'mixture': True}
+    }
+
+
+def first_file(folder, names):
+    """
+    Returns the first of the wav files \"names\" found in \"folder\", None if there is none
+    """
+    for name in names:
+        if os.path.isfile(os.path.join(folder, name + '.wav')):
+            return os.path.join(folder, name + '.wav')
+    return None
+
+
+def discover(name, db, outputs):
+    """
+    Returns the tracks of the dataset \"name\" in \"db\" with the estimates of each method (subfolder of \"outputs\"),
+        see bss_eval.evaluate_track. A method is left out of a track if any of its estimates is missing.
+    """
+    settings = DATASETS[name]
+    methods = sorted([d for d in os.listdir(outputs) if os.path.isdir(os.path.join(outputs, d))])
+    tracks = []
+    if name == 'dsd100':
+        for subset in settings['subsets']:
+            folder = os.path.join(db, 'Sources', subset)
+            for song in sorted(os.listdir(folder)):
+                references = [os.path.join(folder, song, s + '.wav') for s in settings['sources']]
+                estimates = [(m, [first_file(os.path.join(outputs, m, subset, song), names) for names in settings['estimates']])
+                    for m in methods]
+                tracks.append({'name': os.path.join(subset, song), 'references': references, 'estimates': estimates})
+    elif name == 'bach10':
+        folder = os.path.join(db, 'Sources')
+        for song in sorted([d for d in os.listdir(folder) if os.path.isdir(os.path.join(folder, d))]):
+            references = [os.path.join(folder, song, song + '-' + s + '.wav') for s in settings['sources']]
+            estimates = [(m, [first_file(os.path.join(outputs, m), [song + '-' + s]) for s in settings['sources']]) for m in methods]
+            tracks.append({'name': song, 'references': references, 'estimates': estimates})
+    elif name == 'ikala':
+        folder = os.path.join(db, 'Wavfile')
+        for f in sorted([f for f in os.listdir(folder) if f.endswith('.wav')]):
+            song = os.path.splitext(f)[0]
+            references = [(os.path.join(folder, f), c) for c in settings['channels']]
+            estimates = [(m, [first_file(os.path.join(outputs, m), [song + '-' + s]) for s in settings['sources']]) for m in methods]
+            tracks.append({'name': song, 'references': references, 'estimates': estimates, 'mixture': True})
+    for track in tracks:
+        track['estimates'] = dict((m, files) for m,files in track['estimates'] if None not in files)
+    return [track for track in tracks if len(track['estimates']) > 0]
+
+
+def pending(tracks, store):
+    """
+    Keeps in each track only the methods without results in the ResultsStore \"store\",
+        and drops the tracks with nothing left to evaluate
+    """
+    done = store.pairs()
+    tasks = []
+    for track in tracks:
+        missing = dict((m, files) for m,files in track['estimates'].items() if (m, track['name']) not in done)
+        if len(missing) > 0:
+            task = dict(track)
+            task['estimates'] = missing
+            tasks.append(task)
+    return tasks
+
+
+def evaluate_task(task, results, settings, sampleRate=44100):
+    """
+    Evaluates all the methods of a track and appends their results to the store in the folder \"results\",
+        returns the name of the track, the methods and the error if the evaluation failed
+    """
+    try:
+        win = int(settings['window'] * sampleRate) if settings['window'] is not None else None
+        hop = int(settings['hop'] * sampleRate) if settings['hop'] is not None else None
+        output = bss_eval.evaluate_track(task, win=win, hop=hop, compute_permutation=settings['compute_permutation'],
+            criteria=settings['criteria'])
+        for method,result in output.items():
+            result['method'] = method
+        ResultsStore(results).append(list(output.values()), settings['sources'])
+        logging.info('evaluated %s: %s', task['name'], ', '.join(sorted(output)))
+        return task['name'], sorted(task['estimates']), None
+    except Exception as e:
+        logging.error('evaluating %s failed: %s', task['name'], e)
+        return task['name'], sorted(task['estimates']), str(e)
+
+
+def run(name, db, outputs, results, nprocs=None, sampleRate=44100):
+    """
+    Evaluates the outputs of all the methods in \"outputs\" for the dataset \"name\" in \"db\" which do not have results
+        in the store \"results\", with \"nprocs\" processes (all the cores by default),
+        and returns the list of failed (track,methods,error)
+    """
+    tracks = discover(name, db, outputs)
+    store = ResultsStore(results)
+    tasks = pending(tracks, store)
+    npairs = sum([len(t['estimates']) for t in tracks])
+    logging.info('%d (method,track) pairs, %d to evaluate', npairs, sum([len(t['estimates']) for t in tasks]))
+    if len(tasks) == 0:
+        return []
+    nprocs = nprocs if nprocs is not None else multiprocessing.cpu_count()
+    done = dataset.parmap(functools.partial(evaluate_task, results=results, settings=DATASETS[name], sampleRate=sampleRate),
+        tasks, nprocs=np.minimum(nprocs, len(tasks)))
+    store.compact()
+    return [d for d in done if d[2] is not None]
+
+
+def main(argv):
+    usage = 'python -m evaluation.evaluate -d dsd100|bach10|ikala --db <dataset_path> -o <outputs_path> -r <results_path> [-n <nprocs>]'
+    try:
+        opts, args = getopt.getopt(argv,"hd:o:r:n:",["dataset=","db=","outputs=","results=","nprocs="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    nprocs = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-d", "--dataset"):
+            name = arg
+        elif opt == "--db":
+            db = arg
+        elif opt in ("-o", "--outputs"):
+            outputs = arg
+        elif opt in ("-r", "--results"):
+            results = arg
+        elif opt in ("-n", "--nprocs"):
+            nprocs = int(arg)
+    assert name in DATASETS, "Unknown dataset "+name
+    failed = run(name, db, outputs, results, nprocs)
+    for track,methods,error in failed:
+        print('failed %s (%s): %s' % (track, ', '.join(methods), error))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,304 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import sys
+import time
+import itertools
+import fcntl
+import numpy as np
+from scipy import io
+import climate
+logging = climate.get_logger('results')
+
+
+"""
+A store for the evaluation results: a columnar table with one row per (method,track,source,metric,window),
+kept in a folder of npz shards. Every append writes a new shard atomically, so several processes can append at once,
+and the table is read back with a few numpy reads, the text columns being encoded as integer codes into sorted values.
+A shard merged by compact lists the shards it replaces, which are ignored until they are removed.
+"""
+class ResultsStore(object):
+    """
+    Appendable table of evaluation results
+
+    Parameters
+    ----------
+    path : string
+        The folder of the shards, created if it does not exist
+    """
+    CATEGORIES = ['method','track','source','metric']
+    counter = itertools.count()
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path, exist_ok=True)
+        self.cache = None
+        #the shards replaced by each shard, the shards are never modified
+        self.merged = {}
+
+    def files(self):
+        return sorted([f for f in os.listdir(self.path) if f.startswith('shard_') and f.endswith('.npz')])
+
+    def replaced(self, names):
+        """
+        Returns the set of the shards replaced by the shards \"names\", the ones of the shards removed meanwhile are left out
+        """
+        replaced = set()
+        for name in names:
+            if name not in self.merged:
+                try:
+                    with np.load(os.path.join(self.path, name)) as f:
+                        self.merged[name] = f['replaces'].tolist() if 'replaces' in f.files else []
+                except FileNotFoundError:
+                    continue
+            replaced.update(self.merged[name])
+        return replaced
+
+    def shards(self):
+        """
+        Returns the shards of the table, without the ones replaced by a merged shard
+        """
+        files = self.files()
+        replaced = self.replaced(files)
+        return [f for f in files if f not in replaced]
+
+    def write(self, columns, replaces=None):
+        """
+        Writes the \"columns\" (the categories, \"window\" and \"value\") as a new shard and returns its name.
+            The names of the shards whose rows it holds are written with it in \"replaces\".
+        """
+        arrays = {'window': np.asarray(columns['window'], dtype=np.int32), 'value': np.asarray(columns['value'], dtype=np.float64)}
+        if replaces is not None:
+            arrays['replaces'] = np.asarray(sorted(replaces), dtype=str)
+        for c in self.CATEGORIES:
+            arrays[c+'_values'], arrays[c] = np.unique(np.asarray(columns[c], dtype=str), return_inverse=True)
+            arrays[c] = arrays[c].astype(np.int32)
+        name = 'shard_%d_%d_%d.npz' % (time.time() * 1e6, os.getpid(), next(self.counter))
+        temp = os.path.join(self.path, 'tmp_' + name)
+        with open(temp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp, os.path.join(self.path, name))
+        return name
+
+    def append(self, results, sources):
+        """
+        Appends the evaluation \"results\" (see bss_eval.evaluate_track), a list of dictionaries with the \"method\",
+            the \"name\" of the track and the criteria of shape (nsrc,) or (nsrc,nwin), for the sources named \"sources\".
+            The values which are not a number (e.g. silent windows) are left out.
+        """
+        columns = dict((c, []) for c in self.CATEGORIES + ['window','value'])
+        for result in results:
+            for metric,values in result.items():
+                if metric in ['method','name']:
+                    continue
+                values = np.asarray(values, dtype=np.float64).reshape(len(sources), -1)
+                source, window = np.nonzero(~np.isnan(values))
+                columns['method'].append(np.repeat(str(result['method']), len(source)))
+                columns['track'].append(np.repeat(str(result['name']), len(source)))
+                columns['source'].append(np.asarray(sources, dtype=str)[source])
+                columns['metric'].append(np.repeat(metric, len(source)))
+                columns['window'].append(window)
+                columns['value'].append(values[source,window])
+        if len(columns['value']) == 0:
+            return None
+        return self.write(dict((c, np.concatenate(v)) for c,v in columns.items()))
+
+    def table(self):
+        """
+        Returns the whole table as a dictionary of columns, the categories as integer codes into the sorted \"<category>_values\".
+            The table is read again only if the shards changed.
+        """
+        shards = self.shards()
+        if self.cache is not None and self.cache[0] == shards:
+            return self.cache[1]
+        data = []
+        try:
+            for shard in shards:
+                with np.load(os.path.join(self.path, shard)) as f:
+                    data.append(dict((k, f[k]) for k in f.files if k != 'replaces'))
+        except FileNotFoundError:
+            #replaced by a shard merged in another process, which was written before
+            return self.table()
+        table = {}
+        for c in self.CATEGORIES:
+            values = np.unique(np.concatenate([d[c+'_values'] for d in data] + [np.array([], dtype=str)]))
+            table[c+'_values'] = values
+            table[c] = np.concatenate([np.searchsorted(values, d[c+'_values']).astype(np.int32)[d[c]] for d in data]
+                + [np.array([], dtype=np.int32)])
+        for c in ['window','value']:
+            table[c] = np.concatenate([d[c] for d in data] + [np.array([])])
+        self.cache = (shards, table)
+        return table
+
+    def select(self, **where):
+        """
+        Returns the mask of the rows matching \"where\", e.g. method='a', metric=['sdr','sir'], window=0
+        """
+        table = self.table()
+        mask = np.ones(len(table['value']), dtype=bool)
+        for c,wanted in where.items():
+            wanted = np.atleast_1d(wanted)
+            if c in self.CATEGORIES:
+                codes = np.flatnonzero(np.isin(table[c+'_values'], wanted.astype(str)))
+                mask = mask & np.isin(table[c], codes)
+            else:
+                mask = mask & np.isin(table[c], wanted)
+        return mask
+
+    def keys(self, by, mask):
+        """
+        Returns the groups of the columns \"by\" for the rows in \"mask\" as one integer per row, and the size of each column
+        """
+        table = self.table()
+        key = np.zeros(np.count_nonzero(mask), dtype=np.int64)
+        sizes = []
+        for c in by:
+            codes = table[c][mask].astype(np.int64)
+            size = len(table[c+'_values']) if c in self.CATEGORIES else int(codes.max()) + 1 if len(codes) > 0 else 1
+            key = key * size + codes
+            sizes.append(size)
+        return key, sizes
+
+    def decode(self, by, key, sizes):
+        """
+        Returns the value of each column \"by\" for the integer groups \"key\"
+        """
+        table = self.table()
+        columns = {}
+        for c,size in reversed(list(zip(by, sizes))):
+            codes = key % size
+            key = key // size
+            columns[c] = table[c+'_values'][codes] if c in self.CATEGORIES else codes
+        return columns
+
+    def pairs(self):
+        """
+        Returns the set of (method,track) which have results
+        """
+        key, sizes = self.keys(['method','track'], np.ones(len(self.table()['value']), dtype=bool))
+        columns = self.decode(['method','track'], np.unique(key), sizes)
+        return set(zip(columns['method'].tolist(), columns['track'].tolist()))
+
+    def groupby(self, by, reduce='median', **where):
+        """
+        Reduces the values of the rows matching \"where\" for each group of the columns \"by\"
+
+        Parameters
+        ----------
+        by : list
+            The columns of the groups, e.g. ['method','metric']
+        reduce : string, optional
+            'median', 'mean', 'std' or 'count'
+
+        Yields
+        ------
+        groups : dictionary
+            The value of each column in \"by\" for each group, the reduced \"value\" and the \"count\" of rows
+        """
+        table = self.table()
+        mask = self.select(**where)
+        values = table['value'][mask]
+        key, sizes = self.keys(by, mask)
+        unique, group = np.unique(key, return_inverse=True)
+        count = np.bincount(group, minlength=len(unique))
+        if reduce == 'median':
+            values = values[np.lexsort((values, group))]
+            start = np.cumsum(count) - count
+            value = 0.5 * (values[start + (count-1)//2] + values[start + count//2])
+        elif reduce in ['mean','std']:
+            value = np.bincount(group, weights=values, minlength=len(unique)) / count
+            if reduce == 'std':
+                value = np.sqrt(np.bincount(group, weights=np.power(values - value[group], 2), minlength=len(unique)) / count)
+        else:
+            value = count
+        groups = self.decode(by, unique, sizes)
+        groups.update({'value': value, 'count': count})
+        return groups
+
+    def dataframe(self, **where):
+        """
+        Returns the rows matching \"where\" as a pandas DataFrame with categorical columns
+        """
+        import pandas as pd
+        table = self.table()
+        mask = self.select(**where)
+        columns = dict((c, pd.Categorical.from_codes(table[c][mask], table[c+'_values'])) for c in self.CATEGORIES)
+        columns.update({'window': table['window'][mask], 'value': table['value'][mask]})
+        return pd.DataFrame(columns)
+
+    def compact(self):
+        """
+        Merges all the shards into one, which lists the shards it replaces, and removes them.
+            The shards appended meanwhile are kept and a compaction interrupted before the removal only leaves
+            the replaced shards, ignored by table and removed by the next compaction.
+            One process compacts at a time, a compaction started meanwhile in another process returns without compacting.
+        """
+        with open(os.path.join(self.path, 'compact.lock'), 'w') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                logging.info('The results in '+self.path+' are compacted by another process')
+                return
+            try:
+                table = self.table()
+                shards = self.cache[0]
+                #the replaced shards left by an interrupted compaction
+                files = self.files()
+                replaced = self.replaced(files)
+                stale = [f for f in files if f in replaced]
+                if len(shards) > 1:
+                    columns = dict((c, table[c+'_values'][table[c]]) for c in self.CATEGORIES)
+                    columns.update({'window': table['window'], 'value': table['value']})
+                    #the stale shards are listed too, so the rows are counted once whatever the order of the removal
+                    self.write(columns, replaces=shards + stale)
+                    stale = shards + stale
+                for shard in stale:
+                    try:
+                        os.remove(os.path.join(self.path, shard))
+                    except FileNotFoundError:
+                        pass
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def import_mat(store, folder, method):
+    """
+    Appends to \"store\" the <song>_results.mat files written by the MATLAB evaluation scripts in \"folder\" for \"method\",
+        each with a \"results\" structure holding the name and the criteria of each source
+    """
+    results = []
+    sources = None
+    for f in sorted(os.listdir(folder)):
+        if not f.endswith('.mat'):
+            continue
+        mat = io.loadmat(os.path.join(folder, f), squeeze_me=True, struct_as_record=False)['results']
+        names = [s for s in mat._fieldnames if s != 'name']
+        assert sources is None or sources == names, "All the result files need the same sources"
+        sources = names
+        metrics = getattr(mat, names[0])._fieldnames
+        result = {'method': method, 'name': str(mat.name) if hasattr(mat, 'name') else f[:-len('_results.mat')]}
+        for metric in metrics:
+            result[metric] = np.array([np.atleast_1d(getattr(getattr(mat, s), metric)) for s in sources], dtype=np.float64)
+        results.append(result)
+    if len(results) > 0:
+        store.append(results, sources)
+    return len(results)
@@ -1,13 +1,13 @@
 import sys,os, getopt
 import numpy as np
 import scipy
-from scipy.signal import blackmanharris as blackmanharris
+try:
+    from scipy.signal.windows import blackmanharris
+except ImportError:
+    from scipy.signal import blackmanharris
 from scipy import io
 from scipy.io import wavfile
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import pickle
 import theano
 import theano.tensor as T
 import theano.sandbox.rng_mrg
@@ -15,8 +15,13 @@ import lasagne
 
 
 def load_model(filename):
-    f=file(filename,'rb')
-    params=pickle.load(f)
+    f=open(filename,'rb')
+    try:
+        params=pickle.load(f)
+    except UnicodeDecodeError:
+        #the models were pickled with python 2
+        f.seek(0)
+        params=pickle.load(f, encoding='latin1')
     f.close()
     return params
 
@@ -229,7 +234,7 @@ def build_ca(input_var=None, batch_size=32,time_context=30,feat_size=513):
     return l_out
 
 
-def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap = 20,batch_size=32,input_size=2049, frameSize=4096, hopSize=512):
+def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap = 20,batch_size=32,input_size=2049, frameSize=4096, hopSize=512,stream=False,framewise=False):
     input_var2 = T.tensor4('inputs')
     target_var2 = T.tensor4('targets')
     rand_num = T.tensor4('rand_num')
@@ -242,7 +247,16 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
     params=load_model(model)
     lasagne.layers.set_all_param_values(network2,params)
 
-    prediction2 = lasagne.layers.get_output(network2, deterministic=True)
+    frame_layer = None
+    if framewise:
+        #the first layer is computed once per frame, only the time-mixing layers run on each segment
+        import network
+        l_frame, l_bias = network.find_frame_layer(network2)
+        frame_layer = network.FrameLayer(l_frame, l_bias)
+        frame_var = T.tensor4('frames')
+        prediction2 = network.get_framewise_output(network2, l_bias if l_bias is not None else l_frame, frame_var)
+    else:
+        prediction2 = lasagne.layers.get_output(network2, deterministic=True)
     rand_num = np.random.uniform(size=(batch_size,1,time_context,input_size))
     network2=None
     params=None
@@ -263,7 +277,17 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
     source3=mask3*input_var2[:,0:1,:,:]
     source4=mask4*input_var2[:,0:1,:,:]
 
-    predict_function2=theano.function([input_var2],[source1,source2,source3,source4],allow_input_downcast=True)
+    inputs = [frame_var,input_var2] if framewise else [input_var2]
+    predict_function2=theano.function(inputs,[source1,source2,source3,source4],allow_input_downcast=True)
+
+    if stream or framewise:
+        #separate block by block, the memory does not grow with the length of the file
+        import separation
+        path, filename = os.path.split(filein)
+        separator = separation.StreamingSeparator(predict_function2, len(source), time_context=time_context, overlap=overlap,
+            batch_size=batch_size, input_size=input_size, scale_factor=scale_factor, frame_layer=frame_layer, frameSize=frameSize, hopSize=hopSize, window=blackmanharris)
+        separator.separate(filein, [os.path.join(outdir,filename.replace(".wav","_"+source[i]+".wav")) for i in range(len(source))])
+        return
 
     sampleRate, audioObj = scipy.io.wavfile.read(filein)
 
@@ -303,18 +327,18 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
             audio_out=None
         audioObj = None
     else:
-        print "Sample rate is not 44100"
-
-
+        print("Sample rate is not 44100")
 def main(argv):
     try:
-       opts, args = getopt.getopt(argv,"hi:o:m:",["ifile=","odir=","--mfile"])
+       opts, args = getopt.getopt(argv,"hi:o:m:sf",["ifile=","odir=","--mfile","stream","framewise"])
     except getopt.GetoptError:
-       print 'python separate_bach10.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl>'
+       print('python separate_bach10.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl> [-s] [-f]')
        sys.exit(2)
+    stream = False
+    framewise = False
     for opt, arg in opts:
         if opt == '-h':
-          print 'python separate_bach10.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl>'
+          print('python separate_bach10.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl> [-s] [-f]')
           sys.exit()
         elif opt in ("-i", "--ifile"):
           inputfile = arg
@@ -322,7 +346,11 @@ def main(argv):
           outdir = arg
         elif opt in ("-m", "--mfile"):
           model = arg
-    train_auto(inputfile,outdir,model,0.3,30,25,32,2049,4096,512)
+        elif opt in ("-s", "--stream"):
+          stream = True
+        elif opt in ("-f", "--framewise"):
+          framewise = True
+    train_auto(inputfile,outdir,model,0.3,30,25,32,2049,4096,512,stream=stream,framewise=framewise)
 
 if __name__ == "__main__":
     main(sys.argv[1:])
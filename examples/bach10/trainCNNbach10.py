@@ -22,6 +22,7 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDataset
+import network
 import util
 
 import numpy as np
@@ -211,9 +212,7 @@ def train_auto(train,fun,transform,testdir,outdir,testfile_list,testdir1,outdir1
 
     updates = lasagne.updates.adadelta(loss, params1)
 
-    train_fn = theano.function([input_var2,target_var2], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var2,target_var2], [error1,error2,error3,error4], allow_input_downcast=True)
+    train_step = network.TrainStep([input_var2,target_var2], loss, [error1,error2,error3,error4], updates)
 
     predict_function2=theano.function([input_var2],[source1,source2,source3,source4],allow_input_downcast=True)
 
@@ -252,8 +251,8 @@ def train_auto(train,fun,transform,testdir,outdir,testfile_list,testdir1,outdir1
                 #gc.collect()
 
                 # Perform learning step and track loss
-                train_err+=train_fn(inputs,targets) # total loss
-                [e1,e2,e3,e4]=train_fn1(inputs,targets) # source losses
+                err,[e1,e2,e3,e4]=train_step(inputs,targets) # total loss and source losses
+                train_err+=err
                 err1 += e1
                 err2 += e2
                 err3 += e3
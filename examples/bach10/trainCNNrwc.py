@@ -22,6 +22,7 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDataset
+import network
 import util
 
 import numpy as np
@@ -201,9 +202,7 @@ def train_auto(train,fun,transform,testdir,outdir,testfile_list,testdir1,outdir1
 
     updates = lasagne.updates.adadelta(loss, params1)
 
-    train_fn = theano.function([input_var2,target_var2], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var2,target_var2], [error1,error2,error3,error4], allow_input_downcast=True)
+    train_step = network.TrainStep([input_var2,target_var2], loss, [error1,error2,error3,error4], updates)
 
     predict_function2=theano.function([input_var2],[source1,source2,source3,source4],allow_input_downcast=True)
 
@@ -235,8 +234,8 @@ def train_auto(train,fun,transform,testdir,outdir,testfile_list,testdir1,outdir1
                 target=None
                 #gc.collect()
 
-                train_err+=train_fn(inputs,targets)
-                [e1,e2,e3,e4]=train_fn1(inputs,targets)
+                err,[e1,e2,e3,e4]=train_step(inputs,targets)
+                train_err+=err
                 err1 += e1
                 err2 += e2
                 err3 += e3
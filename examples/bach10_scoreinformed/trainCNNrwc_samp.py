@@ -22,6 +22,7 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDatasetMask1,LargeDatasetMask2
+import network
 import util
 
 import numpy as np
@@ -320,9 +321,7 @@ def train_auto(fun,transform,testdir,outdir,testfile_list,testdir1,outdir1,testf
 
     updates = lasagne.updates.adadelta(loss, params1)
 
-    train_fn = theano.function([input_var2,target_var2], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var2,target_var2], [error1,error2,error3,error4], allow_input_downcast=True)
+    train_step = network.TrainStep([input_var2,target_var2], loss, [error1,error2,error3,error4], updates)
 
     predict_function2=theano.function([input_var2],[source1,source2,source3,source4],allow_input_downcast=True)
 
@@ -336,7 +335,7 @@ def train_auto(fun,transform,testdir,outdir,testfile_list,testdir1,outdir1,testf
         logging.info("Training...")
         for epoch in range(num_epochs):
             train = LargeDatasetMask2(path_transform_in=path_in, nsources=4, nsamples=nsamples, batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap, nprocs=nprocs,mult_factor_in=scale_factor,mult_factor_out=scale_factor,\
-                sampleRate=transform.sampleRate,pitch_code='e', nharmonics=20, pitch_norm=127.,tensortype=theano.config.floatX,timbre_model_path=timbre_model_path)
+                sampleRate=transform.sampleRate,pitch_code='e', nharmonics=20, pitch_norm=127.,tensortype=theano.config.floatX,timbre_model_path=timbre_model_path,layout='nchw',mask_inputs=True)
             train_err = 0
             train_batches = 0
             err1=0
@@ -346,27 +345,12 @@ def train_auto(fun,transform,testdir,outdir,testfile_list,testdir1,outdir1,testf
             start_time = time.time()
             for batch in range(train.iteration_size):
 
-                inputs, target, masks = train()
-                jump = inputs.shape[2]
-
-                mask=np.empty(shape=(inputs.shape[0],4,inputs.shape[1],inputs.shape[2]),dtype=theano.config.floatX)
-                mask[:,0,:,:]=masks[:,:,:jump] * inputs
-                mask[:,1,:,:]=masks[:,:,jump:jump*2] * inputs
-                mask[:,2,:,:]=masks[:,:,jump*2:jump*3] * inputs
-                mask[:,3,:,:]=masks[:,:,jump*3:jump*4] * inputs
-                masks=None
-
-                targets=np.empty(shape=(inputs.shape[0],4,inputs.shape[1],inputs.shape[2]),dtype=theano.config.floatX)
-                targets[:,0,:,:]=target[:,:,:jump]
-                targets[:,1,:,:]=target[:,:,jump:jump*2]
-                targets[:,2,:,:]=target[:,:,jump*2:jump*3]
-                targets[:,3,:,:]=target[:,:,jump*3:jump*4]
-                target=None
-
+                #the dataset returns the targets and the masked inputs as (batch,source,time,frequency)
+                inputs, targets, mask = train()
                 inputs=None
 
-                train_err+=train_fn(mask,targets)
-                [e1,e2,e3,e4]=train_fn1(mask,targets)
+                err,[e1,e2,e3,e4]=train_step(mask,targets)
+                train_err+=err
                 err1 += e1
                 err2 += e2
                 err3 += e3
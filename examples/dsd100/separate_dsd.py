@@ -1,13 +1,13 @@
 import sys,os, getopt
 import numpy as np
 import scipy
-from scipy.signal import blackmanharris as blackmanharris
+try:
+    from scipy.signal.windows import blackmanharris
+except ImportError:
+    from scipy.signal import blackmanharris
 from scipy import io
 from scipy.io import wavfile
-try:
-    import cPickle as pickle
-except:
-    import pickle
+import pickle
 import theano
 import theano.tensor as T
 import theano.sandbox.rng_mrg
@@ -15,8 +15,13 @@ import lasagne
 
 
 def load_model(filename):
-    f=file(filename,'rb')
-    params=pickle.load(f)
+    f=open(filename,'rb')
+    try:
+        params=pickle.load(f)
+    except UnicodeDecodeError:
+        #the models were pickled with python 2
+        f.seek(0)
+        params=pickle.load(f, encoding='latin1')
     f.close()
     return params
 
@@ -236,7 +241,7 @@ def build_ca(input_var=None, batch_size=32,time_context=30,feat_size=513):
     return l_out
 
 
-def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap = 20,batch_size=32,input_size=513):
+def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap = 20,batch_size=32,input_size=513,stream=False,realtime=False,framewise=False):
     input_var2 = T.tensor4('inputs')
     target_var2 = T.tensor4('targets')
     rand_num = T.tensor4('rand_num')
@@ -249,7 +254,16 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
     params=load_model(model)
     lasagne.layers.set_all_param_values(network2,params)
 
-    prediction2 = lasagne.layers.get_output(network2, deterministic=True)
+    frame_layer = None
+    if framewise:
+        #the first layer is computed once per frame, only the time-mixing layers run on each segment
+        import network
+        l_frame, l_bias = network.find_frame_layer(network2)
+        frame_layer = network.FrameLayer(l_frame, l_bias)
+        frame_var = T.tensor4('frames')
+        prediction2 = network.get_framewise_output(network2, l_bias if l_bias is not None else l_frame, frame_var)
+    else:
+        prediction2 = lasagne.layers.get_output(network2, deterministic=True)
     rand_num = np.random.uniform(size=(batch_size,1,time_context,input_size))
     network2=None
     params=None
@@ -270,7 +284,24 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
     drums=mask3*input_var2
     others=mask4*input_var2  
 
-    predict_function2=theano.function([input_var2],[vocals,bass,drums,others],allow_input_downcast=True) 
+    inputs = [frame_var,input_var2] if framewise else [input_var2]
+    predict_function2=theano.function(inputs,[vocals,bass,drums,others],allow_input_downcast=True) 
+
+    if stream or (framewise and not realtime):
+        #separate block by block, the memory does not grow with the length of the file
+        import separation
+        separator = separation.StreamingSeparator(predict_function2, len(source), time_context=time_context, overlap=overlap,
+            batch_size=batch_size, input_size=input_size, scale_factor=scale_factor, frame_layer=frame_layer)
+        separator.separate(filein, [os.path.join(outdir,source[i]+".wav") for i in range(len(source))])
+        return
+ 
+    if realtime:
+        #simulate a live input, the network is called every time_context-overlap new frames on the last time_context frames
+        import separation
+        separator = separation.RealtimeSeparator(predict_function2, len(source), time_context=time_context, hop_frames=time_context-overlap,
+            batch_size=batch_size, input_size=input_size, scale_factor=scale_factor, frame_layer=frame_layer)
+        separator.separate(filein, [os.path.join(outdir,source[i]+".wav") for i in range(len(source))])
+        return
  
     sampleRate, audioObj = scipy.io.wavfile.read(filein)  
     
@@ -310,18 +341,20 @@ def train_auto(filein,outdir,model,scale_factor=0.3,time_context = 30,overlap =
             audio_out=None 
         audioObj = None
     else:
-        print "Sample rate is not 44100"
-
-
+        print("Sample rate is not 44100")
 def main(argv):  
     try:
-       opts, args = getopt.getopt(argv,"hi:o:m:",["ifile=","odir=","--mfile"])
+       opts, args = getopt.getopt(argv,"hi:o:m:srf",["ifile=","odir=","--mfile","stream","realtime","framewise"])
     except getopt.GetoptError:
-       print 'python separate_dsd.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl>'
+       print('python separate_dsd.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl> [-s] [-r] [-f]')
        sys.exit(2)
+    stream = False
+    framewise = False
+    realtime = False
+    batch_size = 32
     for opt, arg in opts:
         if opt == '-h':
-          print 'python separate_dsd.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl>'
+          print('python separate_dsd.py -i <inputfile> -o <outputdir> -m <path_to_model.pkl> [-s] [-r] [-f]')
           sys.exit()
         elif opt in ("-i", "--ifile"):
           inputfile = arg
@@ -329,7 +362,15 @@ def main(argv):
           outdir = arg
         elif opt in ("-m", "--mfile"):
           model = arg
-    train_auto(inputfile,outdir,model,0.3,30,25,32,513)   
+        elif opt in ("-s", "--stream"):
+          stream = True
+        elif opt in ("-f", "--framewise"):
+          framewise = True
+        elif opt in ("-r", "--realtime"):
+          #one segment at a time
+          realtime = True
+          batch_size = 1
+    train_auto(inputfile,outdir,model,0.3,30,25,batch_size,513,stream=stream,realtime=realtime,framewise=framewise)   
 
 if __name__ == "__main__":
     main(sys.argv[1:])
\ No newline at end of file
@@ -22,6 +22,7 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDatasetMulti
+import network
 import util
 
 import os,sys
@@ -115,7 +116,7 @@ def build_ca(input_var=None, batch_size=32,time_context=15,feat_size=513,nchanne
 
 
 def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",scale_factor=0.3,load=False,skip_train=False,skip_sep=False, chunk_size=60,chunk_overlap=2,
-    nsamples=40,batch_size=32, batch_memory=50, time_context=30, overlap=25, nprocs=4,mult_factor_in=0.3,mult_factor_out=0.3):
+    nsamples=40,batch_size=32, batch_memory=50, time_context=30, overlap=25, nprocs=4,mult_factor_in=0.3,mult_factor_out=0.3,mwf_iter=0):
     """
     Trains a network built with \"fun\" with the data generated with \"train\"
     and then separates the files in \"testdir\",writing the result in \"outdir\"
@@ -136,6 +137,8 @@ def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
         The path where to save the trained model (theano tensor containing the network)
     scale_factor : float, optional
         Scale the magnitude of the files to be separated with this factor
+    mwf_iter : int, optional
+        If positive, the stereo sources are post-processed with a multichannel Wiener filter with this number of EM iterations (see util.mwf)
     Yields
     ------
     losser : list
@@ -201,9 +204,7 @@ def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
 
     updates = lasagne.updates.adadelta(loss, params1)
 
-    train_fn_mse = theano.function([input_var,target_var], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var,target_var], errors_insts, allow_input_downcast=True)
+    train_step_mse = network.TrainStep([input_var,target_var], loss, errors_insts, updates)
 
     #----------NEW ILD LOSS CONDITION----------
 
@@ -243,8 +244,9 @@ def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
             start_time = time.time()
             for batch in range(train.iteration_size):
                 inputs, target = train()
-                train_err+=train_fn_mse(inputs, target)
-                errs+=np.array(train_fn1(inputs, target))
+                err,errs_step=train_step_mse(inputs, target)
+                train_err+=err
+                errs+=np.array(errs_step)
                 train_batches += 1
 
             logging.info("Epoch {} of {} took {:.3f}s".format(
@@ -301,6 +303,8 @@ def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
                 sep_audio = np.zeros((nsamples,len(sources),audio.shape[1]))
 
                 mag,ph=transform.compute_transform(audio,phase=True)
+                if mwf_iter>0:
+                    mixture=mag*np.exp(1j*ph)
                 mag=scale_factor*mag.astype(np.float32)
                 #print 'mag.shape: ', mag.shape, 'batch_size: ', train.batch_size
                 nframes = mag.shape[-2]
@@ -313,10 +317,24 @@ def train_auto(fun,train,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
                     output.append(predict_function(batches_mag[b]))
                 output=np.array(output)
 
+                est=np.zeros((audio.shape[1],len(sources),ph.shape[1],ph.shape[2]))
                 for j in range(audio.shape[1]):
                     mm=util.overlapadd_multi(np.swapaxes(output[:,j:j+1,:,:,:,:],1,3),batches_mag,nchunks,overlap=train.overlap)
+                    est[j]=mm[:,:ph.shape[1],:]/scale_factor
+                mm=None
+                if mwf_iter>0:
+                    #refine the magnitudes and the phases of the stereo images with the multichannel Wiener filter
+                    spec=util.mwf(est,mixture,niter=mwf_iter)
+                    est=np.abs(spec)
+                    ph_est=np.angle(spec)
+                    spec=None
+                    mixture=None
+                else:
+                    ph_est=np.tile(ph[:,np.newaxis],(1,len(sources),1,1))
+
+                for j in range(audio.shape[1]):
                     for i in range(len(sources)):
-                        audio_out=transform.compute_inverse(mm[i,:ph.shape[1],:]/scale_factor,ph[j])
+                        audio_out=transform.compute_inverse(est[j,i],ph_est[j,i])
                         # if len(sep_audio[:i,j])<len(audio_out):
                         #     print len(sep_audio), len(audio_out), len(audio_out)-len(sep_audio[:i,j])
                         #     sep_audio = np.concatenate(sep_audio,np.zeros(len(audio_out)-len(sep_audio[:i,j])))
@@ -401,6 +419,7 @@ if __name__ == "__main__":
         climate.add_arg('--function', help="build function for the neural network; default build_ca")
         climate.add_arg('--chunk_size', help="split large files at separation stage")
         climate.add_arg('--chunk_overlap', help="overlap for splitting large files at separation stage")
+        climate.add_arg('--mwf', help="number of EM iterations of the multichannel Wiener filter post-processing; default 0, no post-processing")
         db=None
         kwargs = climate.parse_args()
         if kwargs.__getattribute__('db'):
@@ -423,6 +442,10 @@ if __name__ == "__main__":
             chunk_overlap = int(kwargs.__getattribute__('chunk_overlap'))
         else:
             chunk_overlap = 2
+        if kwargs.__getattribute__('mwf'):
+            mwf_iter = int(kwargs.__getattribute__('mwf'))
+        else:
+            mwf_iter = 0
         assert os.path.isdir(db), "Please input the directory for the DSD100 dataset with --db path_to_DSD100"
         assert os.path.isdir(feature_path), "Please input the directory where you stored the training features --feature_path path_to_features"
         assert os.path.isdir(output), "Please input the output directory --output path_to_output"
@@ -508,7 +531,7 @@ if __name__ == "__main__":
         testdir=db,chunk_size=chunk_size,chunk_overlap=chunk_overlap,
         model=os.path.join(output,"models","model_"+model+".pkl"),num_epochs=nepochs,scale_factor=scale_factor_test,load=False,skip_train=False,
         nsamples=nsamples,batch_size=batch_size, batch_memory=batch_memory, time_context=time_context, overlap=overlap,
-        nprocs=nprocs,mult_factor_in=scale_factor,mult_factor_out=scale_factor,skip_sep=False)
+        nprocs=nprocs,mult_factor_in=scale_factor,mult_factor_out=scale_factor,skip_sep=False,mwf_iter=mwf_iter)
     f = file(os.path.join(output,"models","loss_"+model+".data"), 'wb')
     cPickle.dump(train_errs,f,protocol=cPickle.HIGHEST_PROTOCOL)
     f.close()
@@ -18,6 +18,7 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDataset
+import network
 import util
 
 import numpy as np
@@ -219,9 +220,7 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
 
     # val_updates=lasagne.updates.nesterov_momentum(loss1, params1, learning_rate=0.00001, momentum=0.7)
 
-    train_fn = theano.function([input_var2,target_var2], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var2,target_var2], [vocals_error,bass_error,drums_error,negative_error,alpha_component,negative_error_voc], allow_input_downcast=True)
+    train_step = network.TrainStep([input_var2,target_var2], loss, [vocals_error,bass_error,drums_error,negative_error,alpha_component,negative_error_voc], updates)
 
     predict_function2=theano.function([input_var2],[vocals,bass,drums,others],allow_input_downcast=True)
 
@@ -254,8 +253,8 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
                 targets[:,3,:,:]=target[:,:,jump*3:jump*4]
                 target = None
 
-                train_err+=train_fn(inputs,targets)
-                [vocals_erre,bass_erre,drums_erre,negative_erre,alpha,betae_voc]=train_fn1(inputs,targets)
+                err,[vocals_erre,bass_erre,drums_erre,negative_erre,alpha,betae_voc]=train_step(inputs,targets)
+                train_err+=err
                 vocals_err +=vocals_erre
                 bass_err +=bass_erre
                 drums_err +=drums_erre
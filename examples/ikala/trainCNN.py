@@ -22,6 +22,8 @@ import transform
 from transform import transformFFT
 import dataset
 from dataset import LargeDataset
+import network
+import training
 import util
 
 import numpy as np
@@ -118,7 +120,7 @@ def build_ca(input_var=None, batch_size=32,time_context=30,feat_size=513):
     return l_out
 
 
-def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",scale_factor=0.3,load=False,skip_train=False,skip_sep=False):
+def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",scale_factor=0.3,load=False,skip_train=False,skip_sep=False,telemetry=None):
     """
     Trains a network built with \"fun\" with the data generated with \"train\"
     and then separates the files in \"testdir\",writing the result in \"outdir\"
@@ -138,9 +140,13 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
     num_epochs : int, optional
         The number the epochs to train for (one epoch is when all examples in the dataset are seen by the network)
     model : string, optional
-        The path where to save the trained model (theano tensor containing the network) 
+        The path where to save the trained model (theano tensor containing the network), written in the background
+        after each epoch with the previous versions kept as \"model\".1, \"model\".2 (see training.CheckpointWriter).
+        With \"load\", the training resumes after the epoch of the checkpoint, with the dataset where it was
     scale_factor : float, optional
         Scale the magnitude of the files to be separated with this factor
+    telemetry : string, optional
+        The .jsonl file where the data waiting and the compute time of each training step are written (see training.py)
     Yields
     ------
     losser : list
@@ -159,9 +165,16 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
 
     network2 = fun(input_var=input_var2,batch_size=train.batch_size,time_context=train.time_context,feat_size=train.input_size)
     
+    first_epoch = 0
     if load:
         params=load_model(model)
         lasagne.layers.set_all_param_values(network2,params)
+        #resume after the epoch of the checkpoint, with the dataset where it was
+        state = training.find_state(model,params)
+        if state is not None:
+            first_epoch = state['epoch'] + 1
+            if state['dataset'] is not None:
+                train.set_state(state['dataset'])
 
     prediction2 = lasagne.layers.get_output(network2, deterministic=True)
 
@@ -192,9 +205,7 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
 
     updates = lasagne.updates.adadelta(loss, params1)
 
-    train_fn = theano.function([input_var2,target_var2], loss, updates=updates,allow_input_downcast=True)
-
-    train_fn1 = theano.function([input_var2,target_var2], [vocals_error,acc_error,negative_error_voc,negative_error_acc], allow_input_downcast=True)
+    train_step = network.TrainStep([input_var2,target_var2], loss, [vocals_error,acc_error,negative_error_voc,negative_error_acc], updates)
 
     predict_function2=theano.function([input_var2],[vocals,acc],allow_input_downcast=True)
     predict_function3=theano.function([input_var2],[prediction2[:,0:1,:,:],prediction2[:,1:2,:,:]],allow_input_downcast=True)
@@ -205,7 +216,9 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
     if not skip_train:
 
         logging.info("Training...")
-        for epoch in range(num_epochs):
+        recorder = training.Telemetry(telemetry)
+        checkpoint = training.CheckpointWriter(model)
+        for epoch in range(first_epoch,num_epochs):
 
             train_err = 0
             train_batches = 0
@@ -214,8 +227,11 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
             beta_voc=0
             beta_acc=0
             start_time = time.time()
+            recorder.start_epoch(epoch)
             for batch in range(train.iteration_size): 
+                recorder.begin()
                 inputs, target = train()
+                recorder.data_ready()
                 
                 jump = inputs.shape[2]
                 targets=np.ndarray(shape=(inputs.shape[0],2,inputs.shape[1],inputs.shape[2]))
@@ -225,13 +241,14 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
                 targets[:,1,:,:]=target[:,:,jump:jump*2]         
                 target=None
         
-                train_err+=train_fn(inputs,targets)
-                [vocals_erre,acc_erre,betae_voc,betae_acc]=train_fn1(inputs,targets)
+                err,[vocals_erre,acc_erre,betae_voc,betae_acc]=train_step(inputs,targets)
+                train_err+=err
                 vocals_err += vocals_erre
                 acc_err += acc_erre           
                 beta_voc+= betae_voc
                 beta_acc+= betae_acc
                 train_batches += 1
+                recorder.end(err,len(inputs))
             
             logging.info("Epoch {} of {} took {:.3f}s".format(
                 epoch + 1, num_epochs, time.time() - start_time))
@@ -241,7 +258,11 @@ def train_auto(train,fun,transform,testdir,outdir,num_epochs=30,model="1.pkl",sc
             logging.info("  Beta component for voice:\t\t{:.6f}".format(beta_voc/train_batches))
             logging.info("  Beta component for acc:\t\t{:.6f}".format(beta_acc/train_batches))
             losser.append(train_err / train_batches)
-            save_model(model,network2)
+            recorder.end_epoch(train)
+            state = {'epoch': epoch, 'dataset': train.get_state() if hasattr(train,'get_state') else None}
+            checkpoint.save(lasagne.layers.get_all_params(network2),state=state)
+        checkpoint.close()
+        recorder.close()
 
     if not skip_sep:
 
@@ -392,7 +413,7 @@ if __name__ == "__main__":
     if not os.path.exists(os.path.join(db,'models')):
         os.makedirs(os.path.join(db,'models'))
 
-    train_errs=train_auto(train=ld1,fun=build_ca,transform=tt,outdir=os.path.join(db,'output',model),testdir=os.path.join(db,'Wavfile'),model=os.path.join(db,'models',"model_"+model+".pkl"),num_epochs=nepochs,scale_factor=scale_factor)      
+    train_errs=train_auto(train=ld1,fun=build_ca,transform=tt,outdir=os.path.join(db,'output',model),testdir=os.path.join(db,'Wavfile'),model=os.path.join(db,'models',"model_"+model+".pkl"),num_epochs=nepochs,scale_factor=scale_factor,telemetry=os.path.join(db,'models',"telemetry_"+model+".jsonl"))      
     f = file(db+"models/"+"loss_"+model+".data", 'wb')
     cPickle.dump(train_errs,f,protocol=cPickle.HIGHEST_PROTOCOL)
     f.close()
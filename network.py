@@ -0,0 +1,146 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import numpy as np
+import theano
+import lasagne
+
+
+"""
+Helpers for the networks built with lasagne in the examples (build_ca), and TrainStep to compile their training step.
+The first layer of these networks is a convolution with filters one frame high, so its output for a frame
+does not depend on the segment the frame is in. It can be computed once per frame with FrameLayer and given
+to the rest of the network with get_framewise_output, instead of being computed again for each overlapping segment.
+"""
+def find_frame_layer(network):
+    """
+    Returns the first convolution of the network and the bias layer following it (None if there is not one)
+    """
+    layers = lasagne.layers.get_all_layers(network)
+    convs = [l for l in layers if isinstance(l, lasagne.layers.Conv2DLayer)]
+    assert len(convs) > 0, "The network has no convolution"
+    l_conv = convs[0]
+    biases = [l for l in layers if isinstance(l, lasagne.layers.BiasLayer) and l.input_layer is l_conv]
+    if len(biases) > 0:
+        return l_conv, biases[0]
+    else:
+        return l_conv, None
+
+
+def get_framewise_output(network, l_frame, frame_var, deterministic=True):
+    """
+    Returns the output expression of the network where the output of the layer \"l_frame\" is replaced by \"frame_var\".
+        The input variable of the network is still needed by the layers using its values (e.g. the masks).
+    """
+    return lasagne.layers.get_output(network, inputs={l_frame: frame_var}, deterministic=deterministic)
+
+
+class FrameLayer(object):
+    """
+    Computes with numpy the output of a convolution with filters one frame high, frame by frame
+
+    Parameters
+    ----------
+    l_conv : lasagne.layers.Conv2DLayer
+        The convolution, with filters of shape (1,width), a stride of 1 in time, no padding and no nonlinearity
+    l_bias : lasagne.layers.BiasLayer, optional
+        A bias layer following the convolution
+
+    Examples
+    --------
+    l_conv, l_bias = find_frame_layer(network)
+    frame_layer = FrameLayer(l_conv, l_bias)
+    features = frame_layer(mag)
+    """
+    def __init__(self, l_conv, l_bias=None):
+        assert l_conv.filter_size[0] == 1 and l_conv.stride[0] == 1, "The filters must be one frame high"
+        assert tuple(l_conv.pad) == (0,0), "The convolution must not be padded"
+        assert l_conv.nonlinearity is lasagne.nonlinearities.identity, "The convolution must not have a nonlinearity"
+        W = l_conv.W.get_value()[:,0,0,:]
+        if l_conv.flip_filters:
+            W = W[:,::-1]
+        self.W = np.ascontiguousarray(W, dtype=np.float32)
+        self.b = np.zeros(self.W.shape[0], dtype=np.float32)
+        if l_conv.b is not None:
+            self.b = self.b + l_conv.b.get_value()
+        if l_bias is not None:
+            self.b = self.b + l_bias.b.get_value()
+        self.stride = l_conv.stride[1]
+        self.shape = (l_conv.output_shape[1], l_conv.output_shape[3])
+        self.size = self.shape[0] * self.shape[1]
+
+    def __call__(self, frames):
+        """
+        Returns the output for the frames, shape (frames,input_size), flattened to shape (frames,filters*positions)
+        """
+        segments = np.lib.stride_tricks.sliding_window_view(frames.astype(np.float32), self.W.shape[1], axis=1)[:,::self.stride]
+        output = np.einsum('njw,kw->nkj', segments, self.W) + self.b[None,:,None]
+        return output.reshape(len(frames), self.size)
+
+    def batch(self, windows):
+        """
+        Reshapes segments of flattened outputs, shape (segments,time_context,size),
+            to the shape of the layer output (segments,filters,time_context,positions)
+        """
+        return windows.reshape(windows.shape[:2] + self.shape).transpose(0,2,1,3)
+
+
+class TrainStep(object):
+    """
+    One compiled function which applies the updates and returns the loss with the diagnostics (e.g. the error of each source)
+    computed in the same evaluation of the graph, instead of a second function computing the forward pass again for the diagnostics
+
+    Parameters
+    ----------
+    inputs : list of Theano tensors
+        The inputs of the function, e.g. [input_var, target_var]
+    loss : Theano tensor
+        The loss minimized by the updates
+    diagnostics : list of Theano tensors
+        The expressions returned along with the loss, they should be part of the graph of the loss
+    updates : dictionary
+        The updates of the parameters, e.g. returned by lasagne.updates.adadelta
+    every : int, optional
+        Compute the diagnostics every \"every\" steps. The other steps run a function computing only the loss with the same
+        updates, return zeros for the diagnostics and set \"sampled\" to False
+
+    Examples
+    --------
+    train_step = TrainStep([input_var, target_var], loss, [vocals_error, bass_error], updates)
+    err, [vocals_err, bass_err] = train_step(inputs, targets)
+    """
+    def __init__(self, inputs, loss, diagnostics, updates, every=1):
+        self.every = int(max(1, every))
+        self.step = 0
+        self.sampled = False
+        self.zeros = [np.float32(0.)] * len(diagnostics)
+        self.fn = theano.function(inputs, [loss] + list(diagnostics), updates=updates, allow_input_downcast=True)
+        if self.every > 1:
+            self.fn_loss = theano.function(inputs, loss, updates=updates, allow_input_downcast=True)
+
+    def __call__(self, *args):
+        """
+        Runs one training step and returns the loss and the list of diagnostics, zeros if they are not computed at this step
+        """
+        self.sampled = self.step % self.every == 0
+        self.step = self.step + 1
+        if not self.sampled:
+            return self.fn_loss(*args), list(self.zeros)
+        outputs = self.fn(*args)
+        return outputs[0], outputs[1:]
@@ -0,0 +1,484 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import os
+import sys
+import time
+import getopt
+import numpy as np
+import util
+try:
+    from scipy.signal.windows import blackmanharris
+except ImportError:
+    from scipy.signal import blackmanharris
+
+
+"""
+Inference with numpy only for the networks of the build_ca family (examples/dsd100, examples/hiphopss, examples/bach10):
+    conv (1,input_size) -> bias -> conv (h,1) -> bias -> dense -> one dense per source -> reshape
+    -> inverse conv (h,1) -> inverse conv (1,input_size) -> concat -> bias -> relu
+The parameters are the lists pickled by save_model in the trainCNN.py scripts, in the order of lasagne.layers.get_all_params.
+The networks with pooling (examples/ikala) are not supported.
+"""
+#the types of the quantized weights
+QUANTIZED = [np.dtype(np.float16), np.dtype(np.int8)]
+
+#the settings of the separate_*.py scripts for each model family
+PRESETS = {
+    'dsd': {'sources': ['vocals','bass','drums','other'], 'heads': [0,1,2,1], 'overlap': 25, 'frameSize': 1024,
+        'hopSize': 512, 'window': np.hanning, 'mask': 'sources', 'mix': 'mean', 'names': '{source}.wav'},
+    'hhds': {'sources': ['vocals','bass','drums','other'], 'heads': [0,1,2,1], 'overlap': 25, 'frameSize': 1024,
+        'hopSize': 512, 'window': np.hanning, 'mask': 'sources', 'mix': 'mean', 'names': '{source}.wav'},
+    'bach10': {'sources': ['bassoon','clarinet','saxphone','violin'], 'heads': None, 'overlap': 25, 'frameSize': 4096,
+        'hopSize': 512, 'window': blackmanharris, 'mask': 'sum', 'mix': 'mean', 'names': '{name}_{source}.wav'},
+}
+
+
+def load_params(filename):
+    """
+    Loads a list of parameters pickled by save_model, also the ones pickled with python 2,
+        or saved with util.saveModel (memory-mapped)
+    """
+    return util.loadModel(filename)[0]
+
+
+def mapped(a):
+    """
+    Returns True if the array \"a\" is a view of a memory-mapped file, whose pages are not owned by the process
+    """
+    while a is not None:
+        if isinstance(a, np.memmap):
+            return True
+        a = getattr(a, 'base', None)
+    return False
+
+
+class CAModel(object):
+    """
+    The build_ca network computed with numpy, the shapes are read from the parameters
+
+    Parameters
+    ----------
+    params : list of numpy arrays
+        The parameters of the network, as returned by lasagne.layers.get_all_param_values
+    heads : list of int, optional
+        The dense layer used by each source. By default each source has its own; the DSD100 and hiphopss
+        networks reuse the second one for the fourth source, [0,1,2,1]
+    mask : string, optional
+        Where the small random term of the soft masks is added: 'sources' to each source estimate
+        (separate_dsd.py, separate_ikala.py) or 'sum' to the denominator (separate_bach10.py)
+    eps : float, optional
+        The magnitude of the random term of the soft masks
+    dtype : numpy dtype, optional
+        The precision of the computation
+    scales : dictionary, optional
+        The per-channel scales of the dense weights quantized to int8, by index in \"params\", see quantize.
+        The dense weights in float16 or int8 are converted to \"dtype\" once, when the model is built. The quantized
+        arrays are kept in \"params\" only when they are memory-mapped, the other ones are dropped and quantized
+        again from the converted weights by stored, so the model in memory is as large as the full model.
+
+    Examples
+    --------
+    model = CAModel(load_params('model_dsd.pkl'), heads=[0,1,2,1])
+    vocals, bass, drums, others = model(batch)
+    """
+    def __init__(self, params, heads=None, mask='sources', eps=1e-18, dtype=np.float32, scales=None):
+        params = [np.asarray(p) if np.asarray(p).dtype in QUANTIZED else np.asarray(p, dtype=dtype) for p in params]
+        self.params = params
+        if scales is None:
+            scales = {}
+        self.scales = scales
+        assert len(params) >= 11 and len(params) % 2 == 1, "The parameters are not the ones of build_ca"
+        assert params[0].ndim == 4 and params[0].shape[1] == 1 and params[0].shape[2] == 1, \
+            "The first layer must be a convolution with filters of one frame"
+        assert params[3].ndim == 4 and params[3].shape[3] == 1, "The second layer must be a convolution over time"
+        self.dtype = dtype
+        #lasagne flips the filters, true convolution
+        self.W1 = np.ascontiguousarray(params[0][:,0,0,::-1])
+        self.b1 = params[1] + params[2]
+        W2 = params[3][:,:,::-1,0]
+        self.filters, self.channels, self.height = W2.shape
+        self.W2 = np.ascontiguousarray(W2.reshape(self.filters, self.channels*self.height))
+        self.b2 = params[4] + params[5]
+        self.Wfc, self.bfc = self.dequantize(params[6], scales.get(6)), params[7]
+        self.Wheads = [self.dequantize(params[i], scales.get(i)) for i in range(8, len(params)-1, 2)]
+        #the dtype of the quantized weights, which are not kept in memory next to their conversion
+        self.quantized = {}
+        for i in [6] + list(range(8, len(params)-1, 2)):
+            if params[i].dtype in QUANTIZED and not mapped(params[i]):
+                self.quantized[i] = params[i].dtype
+                params[i] = None
+        self.bheads = params[9:-1:2]
+        self.bout = params[-1]
+        self.input_size = self.W1.shape[1]
+        self.nsources = len(self.bout)
+        self.steps = int(self.Wfc.shape[0] / self.filters)
+        self.time_context = self.steps + self.height - 1
+        if heads is None:
+            assert len(self.Wheads) == self.nsources, "Give the dense layer of each source with \"heads\""
+            heads = range(self.nsources)
+        self.heads = list(heads)
+        assert len(self.heads) == self.nsources and max(self.heads) < len(self.Wheads), "Wrong \"heads\" for these parameters"
+        assert mask in ('sources','sum'), "mask must be 'sources' or 'sum'"
+        self.mask = mask
+        self.eps = eps
+        self.rand = None
+        #set by load for the models saved with util.saveModel
+        self.hyperparameters = {}
+        self.hash = None
+
+    def dequantize(self, W, scale=None):
+        """
+        Returns the dense weights \"W\" in \"dtype\", multiplied by the per-channel \"scale\" of the int8 weights
+        """
+        if W.dtype == self.dtype:
+            return W
+        W = W.astype(self.dtype)
+        if scale is not None:
+            W *= np.asarray(scale, dtype=self.dtype)
+        return W
+
+    def dense(self, i):
+        """
+        Returns the dense weights of index \"i\" in \"params\" as used by the computation, in \"dtype\"
+        """
+        if i == 6:
+            return self.Wfc
+        return self.Wheads[(i - 8) // 2]
+
+    def stored(self):
+        """
+        Returns the parameters as they are saved, with the dropped quantized weights quantized again from
+            the converted ones, which give back the arrays given to the model
+        """
+        params = list(self.params)
+        for i,dtype in self.quantized.items():
+            W = self.dense(i)
+            if i in self.scales:
+                W = np.round(W / np.asarray(self.scales[i], dtype=self.dtype))
+            params[i] = W.astype(dtype)
+        return params
+
+    def nbytes(self):
+        """
+        Returns the bytes of the parameters as they are saved and the bytes resident in memory: the arrays used
+            by the computation and the parameters which are neither shared with them nor memory-mapped
+        """
+        stored = sum([p.nbytes for p in self.params if p is not None]) + sum([s.nbytes for s in self.scales.values()])
+        stored = stored + sum([self.dense(i).size * dtype.itemsize for i,dtype in self.quantized.items()])
+        arrays = [self.W1, self.b1, self.W2, self.b2, self.Wfc, self.bfc, self.bout] + list(self.Wheads) + list(self.bheads)
+        resident = sum([a.nbytes for a in arrays if not mapped(a)])
+        for p in self.params:
+            if p is not None and not mapped(p) and not any([np.may_share_memory(p, a) for a in arrays]):
+                resident = resident + p.nbytes
+        return stored, resident
+
+    def forward(self, batch):
+        """
+        Returns the output of the network for a batch, shape (batch_size,1,time_context,input_size),
+            with the shape (batch_size,nsources,time_context,input_size)
+        """
+        x = np.asarray(batch, dtype=self.dtype)[:,0]
+        nbatch = len(x)
+        assert x.shape[1:] == (self.time_context, self.input_size), "The segments must have the shape "+str((self.time_context, self.input_size))
+        #vertical convolution, shape (batch,time,channels)
+        h = np.dot(x, self.W1.T) + self.b1
+        #horizontal convolution, shape (batch,steps,filters)
+        windows = np.lib.stride_tricks.sliding_window_view(h, self.height, axis=1)
+        h = np.dot(windows.reshape(nbatch*self.steps, self.channels*self.height), self.W2.T).reshape(nbatch, self.steps, self.filters) + self.b2
+        #dense layers flatten in the lasagne order (filters,steps)
+        h = np.maximum(np.dot(h.transpose(0,2,1).reshape(nbatch, -1), self.Wfc) + self.bfc, 0)
+        output = np.empty((nbatch, self.nsources, self.time_context, self.input_size), dtype=self.dtype)
+        decoded = {}
+        for s,head in enumerate(self.heads):
+            if head not in decoded:
+                d = np.maximum(np.dot(h, self.Wheads[head]) + self.bheads[head], 0)
+                d = d.reshape(nbatch, self.filters, self.steps).transpose(0,2,1)
+                #inverse of the horizontal convolution (transposed convolution)
+                g = np.dot(d.reshape(nbatch*self.steps, self.filters), self.W2).reshape(nbatch, self.steps, self.channels, self.height)
+                inv = np.zeros((nbatch, self.time_context, self.channels), dtype=self.dtype)
+                for i in range(self.height):
+                    inv[:,i:i+self.steps] += g[:,:,:,i]
+                #inverse of the vertical convolution
+                decoded[head] = np.dot(inv, self.W1)
+            output[:,s] = decoded[head]
+        output += self.bout[None,:,None,None]
+        return np.maximum(output, 0, out=output)
+
+    def __call__(self, batch):
+        """
+        Returns the list of the masked sources, each with the shape of the batch, like the predict_function2 of the examples
+        """
+        batch = np.asarray(batch, dtype=self.dtype)
+        output = self.forward(batch)
+        if self.rand is None or self.rand.shape != batch.shape:
+            self.rand = np.random.uniform(size=batch.shape).astype(self.dtype)
+        noise = self.eps * self.rand
+        if self.mask == 'sources':
+            output += noise
+            total = np.sum(output, axis=1, keepdims=True)
+        else:
+            total = np.sum(output, axis=1, keepdims=True) + noise
+        output *= batch[:,0:1] / total
+        return [output[:,s:s+1] for s in range(self.nsources)]
+
+
+def quantize(model, mode='int8'):
+    """
+    Returns a copy of the CAModel \"model\" with its dense weights, the largest parameters, quantized:
+        'float16' or 'int8' with a symmetric scale for each output unit.
+        The benefit is storage-only: the saved model is smaller, but the weights are converted back to the
+        precision of the computation when the model is built, so the memory and the time of the separation do not change.
+
+    Examples
+    --------
+    small = quantize(load('model_dsd.pkl'), 'int8')
+    save('model_dsd_int8.npz', small)
+    """
+    assert mode in ('float16','int8'), "mode must be 'float16' or 'int8'"
+    params = list(model.params)
+    scales = {}
+    for i in [6] + list(range(8, len(params)-1, 2)):
+        W = np.asarray(model.dense(i), dtype=np.float32)
+        if mode == 'float16':
+            params[i] = W.astype(np.float16)
+        else:
+            scale = np.max(np.abs(W), axis=0) / 127.
+            scale[scale == 0] = 1.
+            params[i] = np.round(W / scale).astype(np.int8)
+            scales[i] = scale.astype(np.float32)
+    quantized = CAModel(params, heads=model.heads, mask=model.mask, eps=model.eps, dtype=model.dtype, scales=scales)
+    quantized.hyperparameters = dict(model.hyperparameters)
+    quantized.hyperparameters['quantized'] = mode
+    return quantized
+
+
+def load(filename, preset='dsd', **kwargs):
+    """
+    Loads the parameters of a model of the family \"preset\" (see PRESETS) as a CAModel.
+        The hyperparameters saved with util.saveModel take precedence over the preset.
+    """
+    params, header = util.loadModel(filename)
+    hyperparameters = header.get('hyperparameters', {})
+    settings = PRESETS[hyperparameters.get('preset', preset)]
+    #the scales of the int8 weights are saved after the parameters
+    scales = dict([(int(i), params[j]) for i,j in hyperparameters.get('scales', {}).items()])
+    params = params[:len(params)-len(scales)]
+    model = CAModel(params, heads=kwargs.pop('heads', hyperparameters.get('heads', settings['heads'])),
+        mask=kwargs.pop('mask', hyperparameters.get('mask', settings['mask'])), scales=scales, **kwargs)
+    model.hyperparameters = hyperparameters
+    model.hash = header.get('hash')
+    return model
+
+
+def save(filename, model, preset='dsd', scale_factor=0.3, overlap=None):
+    """
+    Saves the CAModel \"model\" with util.saveModel and the hyperparameters needed to use it
+    """
+    settings = PRESETS[preset]
+    indices = sorted(model.scales.keys())
+    hyperparameters = {}
+    if len(indices) > 0 or 'quantized' in model.hyperparameters:
+        hyperparameters['quantized'] = model.hyperparameters.get('quantized', 'int8')
+        hyperparameters['scales'] = dict([(str(i), len(model.params)+k) for k,i in enumerate(indices)])
+    return util.saveModel(filename, model.stored() + [model.scales[i] for i in indices], preset=preset,
+        time_context=model.time_context, feat_size=model.input_size, nsources=model.nsources, scale_factor=scale_factor,
+        overlap=overlap if overlap is not None else settings['overlap'], heads=model.heads, mask=model.mask, **hyperparameters)
+
+
+def settings_of(model, preset, scale_factor, kwargs):
+    """
+    Returns the preset settings, the scale factor and the overlap of \"model\", the saved hyperparameters first
+    """
+    presets = PRESETS[model.hyperparameters.get('preset', preset)]
+    if scale_factor is None:
+        scale_factor = model.hyperparameters.get('scale_factor', 0.3)
+    overlap = kwargs.pop('overlap', model.hyperparameters.get('overlap', presets['overlap']))
+    return presets, scale_factor, overlap
+
+
+def separator(model, preset='dsd', batch_size=32, scale_factor=None, **kwargs):
+    """
+    Returns a separation.StreamingSeparator computing the CAModel \"model\" with the settings of \"preset\"
+    """
+    import separation
+    settings, scale_factor, overlap = settings_of(model, preset, scale_factor, kwargs)
+    return separation.StreamingSeparator(model, model.nsources, time_context=model.time_context,
+        overlap=overlap, batch_size=batch_size, input_size=model.input_size,
+        scale_factor=scale_factor, frameSize=settings['frameSize'], hopSize=settings['hopSize'], window=settings['window'], **kwargs)
+
+
+def batch_separator(model, preset='dsd', batch_size=32, scale_factor=None, nshards=None, **kwargs):
+    """
+    Returns a separation.BatchSeparator computing the CAModel \"model\" with the settings of \"preset\",
+        or a separation.ShardedSeparator using \"nshards\" processes if given
+    """
+    import separation
+    settings, scale_factor, overlap = settings_of(model, preset, scale_factor, kwargs)
+    if nshards is not None:
+        kwargs['nshards'] = nshards
+        cls = separation.ShardedSeparator
+    else:
+        cls = separation.BatchSeparator
+    return cls(model, model.nsources, time_context=model.time_context,
+        overlap=overlap, batch_size=batch_size, input_size=model.input_size,
+        scale_factor=scale_factor, frameSize=settings['frameSize'], hopSize=settings['hopSize'], window=settings['window'],
+        mix=kwargs.pop('mix', settings['mix']), **kwargs)
+
+
+def outputs(filein, outdir, preset='dsd', subdir=False):
+    """
+    Returns the paths of the separated sources of \"filein\", named as in the separate_*.py scripts.
+        If \"subdir\" and the names do not contain the name of the track, they are written in outdir/<track name>/
+    """
+    settings = PRESETS[preset]
+    name = os.path.splitext(os.path.basename(filein))[0]
+    if subdir and '{name}' not in settings['names']:
+        outdir = os.path.join(outdir, name)
+        if not os.path.exists(outdir):
+            os.makedirs(outdir)
+    return [os.path.join(outdir, settings['names'].format(name=name, source=source)) for source in settings['sources']]
+
+
+def report(model, filein, mode='int8', preset='dsd', repeat=3):
+    """
+    Separates the reference track \"filein\" with the full model and with the model quantized to \"mode\",
+        prints and returns the size of the saved parameters, the memory resident for the computation, the time
+        of the network and the SNR in dB of the sources of the quantized model with respect to the ones of the full model.
+        The benefit of the quantization is storage-only: the quantized weights are converted to the precision of
+        the computation when the model is built (see CAModel), the resident memory and the time are the ones of the full model
+    """
+    quantized = quantize(model, mode)
+    separators = [batch_separator(m, preset) for m in [model, quantized]]
+    audio, sampleRate, bitrate = util.readAudioScipy(filein)
+    audio = separators[0].downmix(audio)
+    mag, phase = separators[0].spectrogram(audio)
+    results = []
+    for m,sep in zip([model, quantized], separators):
+        elapsed = []
+        for r in range(repeat):
+            track = {'mag': mag}
+            start = time.time()
+            sep.separation(track)
+            elapsed.append(time.time() - start)
+        size, resident = m.nbytes()
+        results.append({'size': size, 'resident': resident, 'time': min(elapsed), 'audio': sep.inverse(track['mag'], phase, len(audio))})
+    snr = []
+    for ref,est in zip(results[0]['audio'], results[1]['audio']):
+        snr.append(float(10 * np.log10(np.sum(ref**2) / np.maximum(np.sum((ref - est)**2), 1e-20))))
+    stats = {'mode': mode, 'size': results[0]['size'], 'quantized_size': results[1]['size'],
+        'resident': results[0]['resident'], 'quantized_resident': results[1]['resident'], 'time': results[0]['time'],
+        'quantized_time': results[1]['time'], 'speedup': results[0]['time'] / results[1]['time'], 'snr': snr}
+    print('saved parameters: %.1f MB -> %.1f MB (%s)' % (stats['size'] / 1e6, stats['quantized_size'] / 1e6, mode))
+    print('resident memory: %.1f MB -> %.1f MB' % (stats['resident'] / 1e6, stats['quantized_resident'] / 1e6))
+    print('network time: %.3f s -> %.3f s, speedup %.2f' % (stats['time'], stats['quantized_time'], stats['speedup']))
+    print('SNR of the quantized sources (dB): ' + ', '.join(['%s %.1f' % (name, value)
+        for name,value in zip(PRESETS[model.hyperparameters.get('preset', preset)]['sources'], snr)]))
+    return stats
+
+
+def list_files(inputs, listfile=None):
+    """
+    Returns the wav files given as files or directories in \"inputs\" and in the text file \"listfile\", one path per line
+    """
+    paths = list(inputs)
+    if listfile is not None:
+        with open(listfile) as f:
+            paths.extend([line.strip() for line in f if len(line.strip()) > 0])
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted([os.path.join(path, f) for f in os.listdir(path) if f.lower().endswith('.wav')]))
+        else:
+            files.append(path)
+    return files
+
+
+def main(argv):
+    usage = 'python runtime.py -i <inputfile_or_dir> [-i ...] [-l <list.txt>] -o <outputdir> -m <path_to_model.pkl> [-p dsd|hhds|bach10] [-k <shards>]'
+    usage = usage + '\n       python runtime.py -c <model.pkl> -o <model.npz> [-p dsd|hhds|bach10] [-q float16|int8]'
+    usage = usage + '\n       python runtime.py -r <reference.wav> -m <path_to_model.pkl> [-p dsd|hhds|bach10] [-q float16|int8]'
+    try:
+        opts, args = getopt.getopt(argv,"hi:l:o:m:p:k:c:q:r:",["ifile=","list=","odir=","mfile=","preset=","shards=","convert=",
+            "quantize=","report="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    preset = 'dsd'
+    inputs = []
+    listfile = None
+    nshards = None
+    convert = None
+    quantized = None
+    reference = None
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-i", "--ifile"):
+            inputs.append(arg)
+        elif opt in ("-l", "--list"):
+            listfile = arg
+        elif opt in ("-o", "--odir"):
+            outdir = arg
+        elif opt in ("-m", "--mfile"):
+            model = arg
+        elif opt in ("-p", "--preset"):
+            preset = arg
+        elif opt in ("-k", "--shards"):
+            nshards = int(arg)
+        elif opt in ("-c", "--convert"):
+            convert = arg
+        elif opt in ("-q", "--quantize"):
+            quantized = arg
+        elif opt in ("-r", "--report"):
+            reference = arg
+    if preset not in PRESETS:
+        print(usage)
+        sys.exit(2)
+    if convert is not None:
+        #pickled parameters to a memory-mappable model with its hyperparameters
+        model = load(convert, preset)
+        if quantized is not None:
+            model = quantize(model, quantized)
+        print(save(outdir, model, preset))
+        return
+    if reference is not None:
+        #accuracy and speed of the quantized model on a reference track
+        report(load(model, preset), reference, quantized if quantized is not None else 'int8', preset)
+        return
+    model = load(model, preset)
+    if nshards is not None:
+        #one file at a time, each split in shards separated in parallel
+        sharded = batch_separator(model, preset, nshards=nshards)
+        files = list_files(inputs, listfile)
+        for f in files:
+            sharded.separate_file(f, outputs(f, outdir, preset, subdir=len(files) > 1))
+    elif len(inputs) == 1 and listfile is None and not os.path.isdir(inputs[0]):
+        #one file, separated in bounded memory
+        separator(model, preset).separate(inputs[0], outputs(inputs[0], outdir, preset), mix=PRESETS[preset]['mix'])
+    else:
+        #the model is loaded once for all the files, reading, separation and writing run in parallel
+        files = list_files(inputs, listfile)
+        stats = batch_separator(model, preset).separate(files, [outputs(f, outdir, preset, subdir=True) for f in files])
+        print('%d tracks (%d failed), %.2f tracks per minute, real-time factor %.3f' %
+            (stats['tracks'], stats['failed'], stats['tracks_per_minute'], stats['rtf']))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
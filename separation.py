@@ -0,0 +1,854 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import time
+import queue
+import threading
+import collections
+import multiprocessing
+import numpy as np
+import util
+import transform
+from transform import StreamingSTFT, StreamingISTFT
+import climate
+logging = climate.get_logger('separation')
+
+
+"""
+Routines to separate audio files with a trained network in bounded memory.
+The network is given as a \"predict\" callable, e.g. the theano function compiled in the separate_*.py examples:
+    vocals, bass, drums, others = predict(batch)
+where batch has the shape (batch_size,1,time_context,input_size) and each output has the same shape.
+"""
+class OverlapWindows(object):
+    """
+    Cuts a stream of spectrogram frames into segments of \"time_context\" frames, with \"overlap\" frames in common,
+        the incremental version of util.generate_overlapadd
+
+    Parameters
+    ----------
+    time_context : int, optional
+        The time context modeled by the network
+    overlap : int, optional
+        The number of overlapping frames between adjacent segments
+    input_size : int, optional
+        The feature size of the frames
+    padding : 1D numpy array, optional
+        The frame used to pad the last segments, zeros if ommited
+    """
+    def __init__(self, time_context=30, overlap=25, input_size=513, dtype=np.float32, padding=None):
+        self.time_context = time_context
+        self.overlap = overlap
+        self.step = time_context - overlap
+        self.input_size = input_size
+        self.dtype = dtype
+        if padding is None:
+            padding = np.zeros(input_size)
+        self.padding = padding.astype(dtype)
+        self.reset()
+
+    def reset(self):
+        self.buffer = np.zeros((0,self.input_size), dtype=self.dtype)
+
+    def process(self, frames):
+        """
+        Appends the frames, shape (frames,input_size), and returns the complete segments, shape (segments,time_context,input_size)
+        """
+        self.buffer = np.concatenate((self.buffer, frames.astype(self.dtype)))
+        if len(self.buffer) < self.time_context:
+            return np.zeros((0,self.time_context,self.input_size), dtype=self.dtype)
+        nwindows = int((len(self.buffer) - self.time_context) / self.step) + 1
+        windows = np.lib.stride_tricks.sliding_window_view(self.buffer, self.time_context, axis=0)[::self.step][:nwindows]
+        windows = np.ascontiguousarray(windows.transpose(0,2,1))
+        self.buffer = self.buffer[nwindows*self.step:]
+        return windows
+
+    def flush(self):
+        """
+        Returns the last segments padded to \"time_context\", like util.generate_overlapadd does
+        """
+        nwindows = 0
+        while (nwindows*self.step + self.overlap) < len(self.buffer):
+            nwindows = nwindows + 1
+        windows = np.empty((nwindows,self.time_context,self.input_size), dtype=self.dtype)
+        windows[:] = self.padding
+        for i in range(nwindows):
+            segment = self.buffer[i*self.step:i*self.step+self.time_context]
+            windows[i,:len(segment)] = segment
+        self.reset()
+        return windows
+
+
+class OverlapAdd(object):
+    """
+    Crossfades the separated segments with a linear window over the \"overlap\" frames,
+        the incremental version of util.overlapadd_multi
+
+    Parameters
+    ----------
+    nsources : int
+        The number of separated sources
+    time_context : int, optional
+        The time context modeled by the network
+    overlap : int, optional
+        The number of overlapping frames between adjacent segments
+    input_size : int, optional
+        The feature size of the frames
+    """
+    def __init__(self, nsources, time_context=30, overlap=25, input_size=513):
+        self.nsources = nsources
+        self.time_context = time_context
+        self.overlap = overlap
+        self.input_size = input_size
+        window = np.linspace(0., 1.0, num=overlap)
+        self.fade_in = window.reshape(-1,1)
+        self.fade_out = window[::-1].reshape(-1,1)
+        self.reset()
+
+    def reset(self):
+        self.pending = None
+
+    def process(self, windows):
+        """
+        Adds the segments, shape (nsources,segments,time_context,input_size), and returns the frames
+            which are not overlapped by future segments, shape (nsources,frames,input_size)
+        """
+        step = self.time_context - self.overlap
+        frames = np.zeros((self.nsources, windows.shape[1]*step, self.input_size), dtype=windows.dtype)
+        for i in range(windows.shape[1]):
+            segment = windows[:,i]
+            if self.pending is None:
+                current = segment.copy()
+            else:
+                current = segment.copy()
+                current[:,:self.overlap] = self.fade_out*self.pending + self.fade_in*segment[:,:self.overlap]
+            frames[:,i*step:(i+1)*step] = current[:,:step]
+            self.pending = current[:,step:]
+        return frames
+
+    def flush(self):
+        """
+        Returns the frames of the last segment
+        """
+        if self.pending is None:
+            frames = np.zeros((self.nsources,0,self.input_size))
+        else:
+            frames = self.pending
+        self.reset()
+        return frames
+
+
+class StreamingSeparator(object):
+    """
+    Separates audio block by block in bounded memory: incremental STFT, segments of \"time_context\" frames
+        predicted in batches, incremental crossfade of the segments and incremental inverse STFT for each source.
+        The memory used does not depend on the length of the audio.
+
+    Parameters
+    ----------
+    predict : callable
+        Returns the separated magnitudes for a batch of segments, shape (batch_size,1,time_context,input_size)
+    nsources : int
+        The number of sources returned by \"predict\"
+    time_context : int, optional
+        The time context modeled by the network
+    overlap : int, optional
+        The number of overlapping frames between adjacent segments
+    batch_size : int, optional
+        The number of segments in a batch, the last batch is zero-padded
+    input_size : int, optional
+        The feature size modeled by the network (frameSize/2+1)
+    scale_factor : float, optional
+        Scale the magnitude of the audio with this factor before the prediction
+    frameSize : int, optional
+        The frame size for the STFT in samples
+    hopSize : int, optional
+        The hop size for the STFT in samples
+    window : function, optional
+        The window function for the STFT
+    sampleRate : int, optional
+        The sample rate the network was trained with
+    frame_layer : callable, optional
+        Computes the first layer of the network frame by frame, e.g. network.FrameLayer. If given, it is computed
+        once for each frame and \"predict\" is called with the first layer output of the segments before the segments,
+        predict(features, batch), see network.get_framewise_output
+
+    Examples
+    --------
+    separator = StreamingSeparator(predict_function2, nsources=4, time_context=30, overlap=25)
+    separator.separate('mixture.wav', ['vocals.wav','bass.wav','drums.wav','other.wav'])
+    """
+    def __init__(self, predict, nsources, time_context=30, overlap=25, batch_size=32, input_size=513,
+        scale_factor=0.3, frameSize=1024, hopSize=512, window=np.hanning, sampleRate=44100, frame_layer=None):
+        self.predict = predict
+        self.nsources = nsources
+        self.time_context = time_context
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.input_size = input_size
+        self.scale_factor = scale_factor
+        self.frameSize = frameSize
+        self.hopSize = hopSize
+        self.sampleRate = sampleRate
+        self.window = window(frameSize)
+        assert self.input_size == int(frameSize/2+1), "Feature size must be frameSize/2+1"
+        self.stft = StreamingSTFT(self.window, hopsize=hopSize, nfft=frameSize)
+        self.istft = [StreamingISTFT(self.window, analysisWindow=self.window, hopsize=hopSize, nfft=frameSize) for s in range(nsources)]
+        self.windows = OverlapWindows(time_context=time_context, overlap=overlap, input_size=input_size)
+        self.overlapadd = OverlapAdd(nsources, time_context=time_context, overlap=overlap, input_size=input_size)
+        self.frame_layer = frame_layer
+        if frame_layer is not None:
+            #the padding frames are silent, their first layer output is not zero
+            self.features = OverlapWindows(time_context=time_context, overlap=overlap, input_size=frame_layer.size,
+                padding=frame_layer(np.zeros((1,input_size)))[0])
+        self.reset()
+
+    def reset(self):
+        self.stft.reset()
+        for istft in self.istft:
+            istft.reset()
+        self.windows.reset()
+        self.overlapadd.reset()
+        self.queue = np.zeros((0,self.time_context,self.input_size), dtype=np.float32)
+        if self.frame_layer is not None:
+            self.features.reset()
+            self.fqueue = np.zeros((0,self.time_context,self.frame_layer.size), dtype=np.float32)
+        self.phase = np.zeros((0,self.input_size))
+        self.nsamples = 0
+        self.nwritten = 0
+        self.nframes = 0
+        self.nsynth = 0
+
+    def predict_batch(self, windows, features=None):
+        """
+        Runs the network on a batch of segments and returns the separated segments, shape (nsources,segments,time_context,input_size)
+        """
+        batch = np.zeros((self.batch_size,1,self.time_context,self.input_size), dtype=np.float32)
+        batch[:len(windows),0] = windows
+        if features is None:
+            output = self.predict(batch)
+        else:
+            fbatch = np.zeros((self.batch_size,)+self.frame_layer.batch(features[:1]).shape[1:], dtype=np.float32)
+            fbatch[:len(features)] = self.frame_layer.batch(features)
+            output = self.predict(fbatch, batch)
+        return np.stack([np.asarray(output[s])[:len(windows),0] for s in range(self.nsources)])
+
+    def analysis(self, X):
+        """
+        Queues the phase for the synthesis and the scaled magnitude for the network
+        """
+        self.nframes = self.nframes + len(X)
+        self.phase = np.concatenate((self.phase, np.angle(X)))
+        return self.scale_factor * np.abs(X) / np.sqrt(self.frameSize)
+
+    def synthesis(self, frames):
+        """
+        Inverts the separated frames with the queued phase and returns the finished audio for each source
+        """
+        nframes = np.minimum(frames.shape[1], self.nframes - self.nsynth)
+        phase = self.phase[:nframes]
+        self.phase = self.phase[nframes:]
+        self.nsynth = self.nsynth + nframes
+        audio = []
+        for s in range(self.nsources):
+            mag = frames[s,:nframes] / self.scale_factor * np.sqrt(self.frameSize)
+            audio.append(self.istft[s].process(mag * np.exp(1j*phase)))
+        return audio
+
+    def segments(self, mag, flush=False):
+        """
+        Returns the segments of the magnitude frames and of their first layer output
+        """
+        windows = self.windows.process(mag)
+        if flush:
+            windows = np.concatenate((windows, self.windows.flush()))
+        if self.frame_layer is None:
+            return windows, None
+        features = self.features.process(self.frame_layer(mag))
+        if flush:
+            features = np.concatenate((features, self.features.flush()))
+        return windows, features
+
+    def separate_windows(self, windows, features=None, flush=False):
+        self.queue = np.concatenate((self.queue, windows))
+        if features is not None:
+            self.fqueue = np.concatenate((self.fqueue, features))
+        audio = [[] for s in range(self.nsources)]
+        while len(self.queue) >= self.batch_size or (flush and len(self.queue) > 0):
+            windows = self.queue[:self.batch_size]
+            self.queue = self.queue[self.batch_size:]
+            if features is not None:
+                features = self.fqueue[:self.batch_size]
+                self.fqueue = self.fqueue[self.batch_size:]
+            frames = self.overlapadd.process(self.predict_batch(windows, features))
+            for s,a in enumerate(self.synthesis(frames)):
+                audio[s].append(a)
+        return audio
+
+    def output(self, audio):
+        """
+        Joins the audio blocks and cuts them to the length of the input audio
+        """
+        audio = [np.concatenate(a) if len(a)>0 else np.zeros(0) for a in audio]
+        n = np.minimum(len(audio[0]), self.nsamples - self.nwritten)
+        self.nwritten = self.nwritten + n
+        return [a[:n] for a in audio]
+
+    def process(self, audio):
+        """
+        Separates a mono audio block and returns the finished audio blocks for each source
+        """
+        self.nsamples = self.nsamples + len(audio)
+        mag = self.analysis(self.stft.process(audio))
+        windows, features = self.segments(mag)
+        return self.output(self.separate_windows(windows, features))
+
+    def flush(self):
+        """
+        Separates the rest of the audio and returns the last audio blocks for each source
+        """
+        mag = self.analysis(self.stft.flush())
+        windows, features = self.segments(mag, flush=True)
+        audio = self.separate_windows(windows, features, flush=True)
+        frames = self.overlapadd.flush()
+        if frames.shape[1] < self.nframes - self.nsynth:
+            #too short for a segment, the missing frames are silent
+            frames = np.concatenate((frames, np.zeros((self.nsources,self.nframes-self.nsynth-frames.shape[1],self.input_size))), axis=1)
+        for s,a in enumerate(self.synthesis(frames)):
+            audio[s].append(a)
+            audio[s].append(self.istft[s].flush())
+        audio = self.output(audio)
+        self.reset()
+        return audio
+
+    def separate(self, filein, fileouts, blocksize=65536, bitrate='int16', mix='mean'):
+        """
+        Separates the wav file \"filein\" and writes each source in the files \"fileouts\", reading and writing in blocks
+
+        Parameters
+        ----------
+        filein : string
+            The path of the wav file to separate
+        fileouts : list of strings
+            The paths where to write each of the separated sources
+        blocksize : int, optional
+            The number of samples to read at once
+        bitrate : string, optional
+            The bitrate of the written files, see util.WavWriter
+        mix : string, optional
+            How multichannel audio is downmixed to mono: 'mean' or 'sum' of the channels
+        Returns
+        -------
+        nsamples : int
+            The number of samples separated
+        """
+        return separate_file(self, filein, fileouts, blocksize=blocksize, bitrate=bitrate, mix=mix)
+
+
+def separate_file(separator, filein, fileouts, blocksize=65536, bitrate='int16', mix='mean'):
+    """
+    Reads the wav file \"filein\" in blocks, separates them with \"separator\" (StreamingSeparator or RealtimeSeparator)
+        and writes each source in the files \"fileouts\"
+    """
+    assert len(fileouts) == separator.nsources, "There must be an output file for each source"
+    blocks, sampleRate, inbitrate, nsamples = util.readAudioBlocks(filein, blocksize=blocksize)
+    assert sampleRate == separator.sampleRate, "Sample rate needs to be "+str(separator.sampleRate)
+    writers = [util.WavWriter(f, sampleRate, nchannels=1, bitrate=bitrate, blocksize=blocksize) for f in fileouts]
+    separator.reset()
+    try:
+        for block in blocks:
+            if block.ndim > 1:
+                if mix == 'sum':
+                    block = np.sum(block, axis=1)
+                else:
+                    block = np.mean(block, axis=1)
+            for writer,audio in zip(writers,separator.process(block)):
+                writer.write(audio)
+        for writer,audio in zip(writers,separator.flush()):
+            writer.write(audio)
+    finally:
+        for writer in writers:
+            writer.close()
+    return nsamples
+
+
+class RealtimeSeparator(object):
+    """
+    Separates live audio with a bounded delay: the magnitude frames are kept in a ring buffer of the last
+        \"time_context\" frames and the network is called every \"hop_frames\" new frames on this context.
+        The newest \"hop_frames\" separated frames are synthesized right away with a stateful inverse STFT.
+        The computation time, the real-time factor and the latency are recorded for each block.
+
+    Parameters
+    ----------
+    predict : callable
+        Returns the separated magnitudes for a batch of segments, shape (batch_size,1,time_context,input_size).
+        Only the first segment of the batch is used, so compile it with build_ca(batch_size=1) when possible.
+    nsources : int
+        The number of sources returned by \"predict\"
+    time_context : int, optional
+        The time context modeled by the network
+    hop_frames : int, optional
+        The number of new frames between two calls of \"predict\", between 1 and time_context
+    batch_size : int, optional
+        The batch size \"predict\" was compiled with
+    input_size : int, optional
+        The feature size modeled by the network (frameSize/2+1)
+    scale_factor : float, optional
+        Scale the magnitude of the audio with this factor before the prediction
+    frameSize : int, optional
+        The frame size for the STFT in samples
+    hopSize : int, optional
+        The hop size for the STFT in samples
+    window : function, optional
+        The window function for the STFT
+    sampleRate : int, optional
+        The sample rate the network was trained with
+    nstats : int, optional
+        The number of blocks for which the statistics are kept
+    frame_layer : callable, optional
+        Computes the first layer of the network frame by frame, see StreamingSeparator. The output is
+        kept in a second ring buffer, so each frame goes through the first layer only once.
+
+    Examples
+    --------
+    separator = RealtimeSeparator(predict_function2, nsources=2, time_context=30, hop_frames=4, batch_size=1)
+    for block in input_blocks:
+        voice, music = separator.process(block)
+    print separator.latency(), separator.stats[-1]
+    """
+    def __init__(self, predict, nsources, time_context=30, hop_frames=1, batch_size=1, input_size=513,
+        scale_factor=0.3, frameSize=1024, hopSize=512, window=np.hanning, sampleRate=44100, nstats=1000, frame_layer=None):
+        assert hop_frames >= 1 and hop_frames <= time_context, "hop_frames must be between 1 and time_context"
+        assert input_size == int(frameSize/2+1), "Feature size must be frameSize/2+1"
+        self.predict = predict
+        self.nsources = nsources
+        self.time_context = time_context
+        self.hop_frames = hop_frames
+        self.batch_size = batch_size
+        self.input_size = input_size
+        self.scale_factor = scale_factor
+        self.frameSize = frameSize
+        self.hopSize = hopSize
+        self.sampleRate = sampleRate
+        self.window = window(frameSize)
+        self.stft = StreamingSTFT(self.window, hopsize=hopSize, nfft=frameSize)
+        self.istft = [StreamingISTFT(self.window, analysisWindow=self.window, hopsize=hopSize, nfft=frameSize) for s in range(nsources)]
+        self.batch = np.zeros((batch_size,1,time_context,input_size), dtype=np.float32)
+        self.frame_layer = frame_layer
+        if frame_layer is not None:
+            self.fbatch = np.zeros((batch_size,)+frame_layer.batch(np.zeros((1,time_context,frame_layer.size))).shape[1:], dtype=np.float32)
+        self.stats = collections.deque(maxlen=nstats)
+        self.reset()
+
+    def reset(self):
+        self.stft.reset()
+        for istft in self.istft:
+            istft.reset()
+        #the context before the first frame is silence
+        self.ring = np.zeros((self.time_context,self.input_size), dtype=np.float32)
+        if self.frame_layer is not None:
+            self.fring = np.repeat(self.frame_layer(np.zeros((1,self.input_size))), self.time_context, axis=0)
+        self.position = 0
+        self.phase = np.zeros((self.hop_frames,self.input_size))
+        self.npending = 0
+        self.nsamples = 0
+        self.nwritten = 0
+
+    def latency(self):
+        """
+        Returns the algorithmic latency in seconds: the inverse STFT waits for a full frame and the network
+            waits for \"hop_frames\" new frames. The size of the input blocks adds to it.
+        """
+        return (self.frameSize - self.hopSize + (self.hop_frames - 1) * self.hopSize) / float(self.sampleRate)
+
+    def context(self, ring):
+        """
+        Returns the ring buffer in time order, the oldest frame first
+        """
+        return np.concatenate((ring[self.position:], ring[:self.position]))
+
+    def separate_context(self):
+        """
+        Runs the network on the current context and synthesizes the newest separated frames
+        """
+        self.batch[0,0] = self.context(self.ring)
+        if self.frame_layer is None:
+            output = self.predict(self.batch)
+        else:
+            self.fbatch[0] = self.frame_layer.batch(self.context(self.fring)[None])[0]
+            output = self.predict(self.fbatch, self.batch)
+        phase = np.exp(1j*self.phase[:self.npending])
+        audio = []
+        for s in range(self.nsources):
+            mag = np.asarray(output[s])[0,0,self.time_context-self.npending:] / self.scale_factor * np.sqrt(self.frameSize)
+            audio.append(self.istft[s].process(mag * phase))
+        self.npending = 0
+        return audio
+
+    def push(self, X):
+        """
+        Writes the frames X in the ring buffer and returns the audio of each source
+            synthesized every \"hop_frames\" frames
+        """
+        mag = self.scale_factor * np.abs(X) / np.sqrt(self.frameSize)
+        if self.frame_layer is not None:
+            features = self.frame_layer(mag)
+        audio = [[] for s in range(self.nsources)]
+        for n in range(len(X)):
+            self.ring[self.position] = mag[n]
+            if self.frame_layer is not None:
+                self.fring[self.position] = features[n]
+            self.position = (self.position + 1) % self.time_context
+            self.phase[self.npending] = np.angle(X[n])
+            self.npending = self.npending + 1
+            if self.npending == self.hop_frames:
+                for s,a in enumerate(self.separate_context()):
+                    audio[s].append(a)
+        return audio
+
+    def output(self, audio):
+        audio = [np.concatenate(a) if len(a)>0 else np.zeros(0) for a in audio]
+        n = np.minimum(len(audio[0]), self.nsamples - self.nwritten)
+        self.nwritten = self.nwritten + n
+        return [a[:n] for a in audio]
+
+    def process(self, audio):
+        """
+        Separates a mono audio block and returns the audio available for each source,
+            the statistics of the block are appended to \"stats\"
+        """
+        start = time.time()
+        duration = np.maximum(len(audio), 1) / float(self.sampleRate)
+        self.nsamples = self.nsamples + len(audio)
+        audio = self.output(self.push(self.stft.process(audio)))
+        elapsed = time.time() - start
+        #latency: the input samples which are not yet returned
+        self.stats.append({'compute': elapsed, 'rtf': elapsed / duration,
+            'latency': (self.nsamples - self.nwritten) / float(self.sampleRate)})
+        return audio
+
+    def flush(self):
+        """
+        Separates the last frames and returns the rest of the audio for each source
+        """
+        audio = self.push(self.stft.flush())
+        if self.npending > 0:
+            for s,a in enumerate(self.separate_context()):
+                audio[s].append(a)
+        for s in range(self.nsources):
+            audio[s].append(self.istft[s].flush())
+        audio = self.output(audio)
+        self.reset()
+        return audio
+
+    def report(self):
+        """
+        Logs and returns the mean and worst computation time, real-time factor and latency of the recorded blocks
+        """
+        report = {}
+        for key in ['compute','rtf','latency']:
+            values = np.array([s[key] for s in self.stats])
+            report[key] = (float(np.mean(values)), float(np.max(values))) if len(values) > 0 else (0., 0.)
+        logging.info('algorithmic latency %.1f ms, block latency mean %.1f ms max %.1f ms, real-time factor mean %.3f max %.3f',
+            1000.*self.latency(), 1000.*report['latency'][0], 1000.*report['latency'][1], report['rtf'][0], report['rtf'][1])
+        return report
+
+    def separate(self, filein, fileouts, blocksize=None, bitrate='int16', mix='mean'):
+        """
+        Simulates a live input with the wav file \"filein\", fed in blocks of \"blocksize\" samples
+            (by default the samples between two predictions), writes each source in the files \"fileouts\"
+            and logs the latency and real-time factor
+        """
+        if blocksize is None:
+            blocksize = self.hop_frames * self.hopSize
+        self.stats.clear()
+        nsamples = separate_file(self, filein, fileouts, blocksize=blocksize, bitrate=bitrate, mix=mix)
+        self.report()
+        return nsamples
+
+
+class BatchSeparator(object):
+    """
+    Separates many files with the same network in a pipeline of three threads: the next track is read
+        and analysed while the network runs on the current one and the previous one is synthesized and written.
+        The tracks are processed whole, with util.generate_overlapadd and util.overlapadd_multi.
+
+    Parameters
+    ----------
+    predict : callable
+        Returns the separated magnitudes for a batch of segments, shape (batch_size,1,time_context,input_size)
+    nsources : int
+        The number of sources returned by \"predict\"
+    time_context : int, optional
+        The time context modeled by the network
+    overlap : int, optional
+        The number of overlapping frames between adjacent segments
+    batch_size : int, optional
+        The number of segments in a batch
+    input_size : int, optional
+        The feature size modeled by the network (frameSize/2+1)
+    scale_factor : float, optional
+        Scale the magnitude of the audio with this factor before the prediction
+    frameSize : int, optional
+        The frame size for the STFT in samples
+    hopSize : int, optional
+        The hop size for the STFT in samples
+    window : function, optional
+        The window function for the STFT
+    sampleRate : int, optional
+        The sample rate the network was trained with
+    mix : string, optional
+        How multichannel audio is downmixed to mono: 'mean' or 'sum' of the channels
+    bitrate : string, optional
+        The bitrate of the written files, see util.WavWriter
+
+    Examples
+    --------
+    batch = BatchSeparator(predict_function2, nsources=4)
+    batch.separate(['a.wav','b.wav'], [['a_vocals.wav',...],['b_vocals.wav',...]])
+    """
+    def __init__(self, predict, nsources, time_context=30, overlap=25, batch_size=32, input_size=513, scale_factor=0.3,
+        frameSize=1024, hopSize=512, window=np.hanning, sampleRate=44100, mix='mean', bitrate='int16'):
+        assert input_size == int(frameSize/2+1), "Feature size must be frameSize/2+1"
+        self.predict = predict
+        self.nsources = nsources
+        self.time_context = time_context
+        self.overlap = overlap
+        self.batch_size = batch_size
+        self.input_size = input_size
+        self.scale_factor = scale_factor
+        self.frameSize = frameSize
+        self.hopSize = hopSize
+        self.window = window(frameSize)
+        self.sampleRate = sampleRate
+        self.mix = mix
+        self.bitrate = bitrate
+
+    def downmix(self, audio):
+        if audio.ndim > 1:
+            if self.mix == 'sum':
+                audio = np.sum(audio, axis=1)
+            else:
+                audio = np.mean(audio, axis=1)
+        return audio
+
+    def spectrogram(self, audio):
+        """
+        Returns the scaled magnitude and the phase of the mono \"audio\"
+        """
+        X = transform.stft_norm(audio, window=self.window, hopsize=float(self.hopSize), nfft=float(self.frameSize), fs=float(self.sampleRate))
+        return self.scale_factor * np.abs(X) / np.sqrt(self.frameSize), np.angle(X)
+
+    def segments(self, mag):
+        """
+        Returns the segments of the magnitude, shape (segments,1,time_context,input_size)
+        """
+        batches, nchunks = util.generate_overlapadd(mag, input_size=self.input_size, time_context=self.time_context,
+            overlap=self.overlap, batch_size=self.batch_size, sampleRate=self.sampleRate, dtype=np.float32)
+        return batches.reshape((-1,) + batches.shape[2:])[:nchunks]
+
+    def overlapadd(self, sources, nframes):
+        """
+        Crossfades the separated segments, shape (nsources,segments,1,time_context,input_size), to \"nframes\" frames
+        """
+        if sources.shape[1] == 0:
+            return np.zeros((self.nsources, nframes, self.input_size))
+        return util.overlapadd_multi(sources.transpose(1,0,2,3,4)[:,:,None], None, sources.shape[1], overlap=self.overlap)[:,:nframes]
+
+    def inverse(self, mag, phase, nsamples):
+        """
+        Returns the audio of each source from its separated magnitude and the phase of the mixture
+        """
+        audio = []
+        for s in range(self.nsources):
+            #too short for a segment, the missing frames are silent
+            sep = np.zeros(phase.shape)
+            sep[:mag.shape[1]] = mag[s,:len(phase)] / self.scale_factor * np.sqrt(self.frameSize)
+            audio.append(transform.istft_norm(sep * np.exp(1j*phase), window=self.window, analysisWindow=self.window,
+                hopsize=float(self.hopSize), nfft=float(self.frameSize))[:nsamples])
+        return audio
+
+    def analysis(self, track):
+        audio, sampleRate, bitrate = util.readAudioScipy(track['filein'])
+        assert sampleRate == self.sampleRate, "Sample rate needs to be "+str(self.sampleRate)
+        audio = self.downmix(audio)
+        track['nsamples'] = len(audio)
+        track['mag'], track['phase'] = self.spectrogram(audio)
+
+    def separation(self, track):
+        mag = track.pop('mag')
+        windows = self.segments(mag)
+        sources = np.zeros((self.nsources,) + windows.shape)
+        for b in range(0, len(windows), self.batch_size):
+            batch = np.zeros((self.batch_size,) + windows.shape[1:], dtype=np.float32)
+            batch[:len(windows[b:b+self.batch_size])] = windows[b:b+self.batch_size]
+            output = self.predict(batch)
+            for s in range(self.nsources):
+                sources[s,b:b+self.batch_size] = output[s][:len(windows[b:b+self.batch_size])]
+        track['mag'] = self.overlapadd(sources, len(mag))
+
+    def synthesis(self, track):
+        for s,audio in enumerate(self.inverse(track.pop('mag'), track.pop('phase'), track['nsamples'])):
+            with util.WavWriter(track['fileouts'][s], self.sampleRate, nchannels=1, bitrate=self.bitrate) as writer:
+                writer.write(audio)
+
+    def feed(self, files, fileouts, outqueue):
+        for filein,outs in zip(files, fileouts):
+            outqueue.put({'filein': filein, 'fileouts': outs})
+        outqueue.put(None)
+
+    def stage(self, function, inqueue, outqueue):
+        """
+        Applies \"function\" to the tracks from \"inqueue\" and passes them to \"outqueue\", a failed track is passed with its error
+        """
+        while True:
+            track = inqueue.get()
+            if track is not None and 'error' not in track:
+                try:
+                    function(track)
+                except Exception as e:
+                    logging.error('%s: %s', track['filein'], e)
+                    track['error'] = e
+            outqueue.put(track)
+            if track is None:
+                return
+
+    def separate(self, files, fileouts):
+        """
+        Separates the wav files \"files\" and writes the sources of each one in the files of \"fileouts\"
+
+        Parameters
+        ----------
+        files : list of strings
+            The paths of the wav files to separate
+        fileouts : list of lists of strings
+            For each file, the paths where to write each of the separated sources
+        Returns
+        -------
+        stats : dictionary
+            The number of tracks separated and failed, the duration of the audio and the elapsed time in seconds,
+            the tracks per minute and the real-time factor (elapsed time divided by the duration)
+        """
+        assert len(files) == len(fileouts), "There must be a list of output files for each input file"
+        queues = [queue.Queue(maxsize=1) for i in range(4)]
+        threads = [threading.Thread(target=self.feed, args=(files, fileouts, queues[0]))]
+        threads.extend([threading.Thread(target=self.stage, args=(function, queues[i], queues[i+1]))
+            for i,function in enumerate([self.analysis, self.separation, self.synthesis])])
+        start = time.time()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        done = 0
+        failed = 0
+        duration = 0.
+        while True:
+            track = queues[-1].get()
+            if track is None:
+                break
+            if 'error' in track:
+                failed = failed + 1
+            else:
+                done = done + 1
+                duration = duration + track['nsamples'] / float(self.sampleRate)
+                logging.info('separated %s', track['filein'])
+        elapsed = time.time() - start
+        stats = {'tracks': done, 'failed': failed, 'duration': duration, 'elapsed': elapsed,
+            'tracks_per_minute': 60. * done / np.maximum(elapsed, 1e-9), 'rtf': elapsed / np.maximum(duration, 1e-9)}
+        logging.info('%d tracks in %.1f s, %.2f tracks per minute, real-time factor %.3f',
+            done, elapsed, stats['tracks_per_minute'], stats['rtf'])
+        return stats
+
+
+class ShardedSeparator(BatchSeparator):
+    """
+    Separates one long track on several cores: the track is cut in \"nshards\" shards with time_context frames
+        of context on each side, each shard is separated in its own process and the separated shards are joined
+        with a linear crossfade of time_context frames centered on the boundaries. The shards start on the grid of
+        the segments of the whole track, so away from the boundaries the result is the one of BatchSeparator.
+        Takes the parameters of BatchSeparator and:
+
+    Parameters
+    ----------
+    nshards : int, optional
+        The number of shards, by default the number of CPUs. Fewer shards are used for short tracks.
+    """
+    def __init__(self, predict, nsources, nshards=None, **kwargs):
+        BatchSeparator.__init__(self, predict, nsources, **kwargs)
+        if nshards is None:
+            nshards = multiprocessing.cpu_count()
+        self.nshards = nshards
+        #time_context frames of context on each side of a shard boundary
+        self.padding = self.time_context * self.hopSize
+
+    def boundaries(self, nsamples):
+        """
+        Returns the start and the end of each shard, without the padding
+        """
+        nshards = int(np.clip(nsamples / (4 * self.padding), 1, self.nshards))
+        return np.linspace(0, nsamples, nshards + 1).astype(int)
+
+    def separate_shard(self, audio):
+        mag, phase = self.spectrogram(audio)
+        track = {'mag': mag}
+        self.separation(track)
+        return self.inverse(track['mag'], phase, len(audio))
+
+    def separate_audio(self, audio):
+        """
+        Separates the mono \"audio\" and returns the audio of each source
+        """
+        bounds = self.boundaries(len(audio))
+        #align the shards on the segments
+        step = (self.time_context - self.overlap) * self.hopSize
+        starts = np.maximum((bounds[:-1] - self.padding) // step * step, 0)
+        ends = np.minimum(bounds[1:] + self.padding, len(audio))
+        shards = [audio[start:end] for start,end in zip(starts, ends)]
+        if len(shards) == 1:
+            results = [self.separate_shard(shards[0])]
+        else:
+            import dataset
+            results = dataset.parmap(self.separate_shard, shards, nprocs=len(shards))
+        #linear crossfade centered on the boundaries, the weights add up to one
+        half = int(self.padding / 2)
+        sources = np.zeros((self.nsources, len(audio)))
+        for k,(start,end) in enumerate(zip(starts, ends)):
+            fadein = [bounds[k] - half, bounds[k] + half] if k > 0 else [start - 2, start - 1]
+            fadeout = [bounds[k+1] - half, bounds[k+1] + half] if k < len(shards) - 1 else [end + 1, end + 2]
+            weight = np.interp(np.arange(start, end), fadein + fadeout, [0.,1.,1.,0.])
+            for s in range(self.nsources):
+                sources[s,start:end] += weight * results[k][s]
+        return sources
+
+    def separate_file(self, filein, fileouts):
+        """
+        Separates the wav file \"filein\" and writes each source in the files \"fileouts\"
+        """
+        assert len(fileouts) == self.nsources, "There must be an output file for each source"
+        start = time.time()
+        audio, sampleRate, bitrate = util.readAudioScipy(filein)
+        assert sampleRate == self.sampleRate, "Sample rate needs to be "+str(self.sampleRate)
+        sources = self.separate_audio(self.downmix(audio))
+        for s in range(self.nsources):
+            with util.WavWriter(fileouts[s], self.sampleRate, nchannels=1, bitrate=self.bitrate) as writer:
+                writer.write(sources[s])
+        elapsed = time.time() - start
+        logging.info('%s separated in %.1f s with %d shards, real-time factor %.3f', filein, elapsed,
+            len(self.boundaries(sources.shape[1])) - 1, elapsed * self.sampleRate / np.maximum(sources.shape[1], 1))
+        return sources.shape[1]
@@ -0,0 +1,281 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import io
+import sys
+import time
+import json
+import getopt
+import threading
+import collections
+import numpy as np
+import scipy.io.wavfile
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import climate
+logging = climate.get_logger('service')
+
+
+"""
+A local separation service over HTTP. The segments of all the requests being served are gathered in full batches
+for the network, a batch is run when it is full or when its oldest segment waited \"max_wait\" seconds.
+    POST /separate  body: a wav file, answer: a wav file with one channel per source (float32)
+    GET /stats      answer: json with the queue depth, the batch fill and the latency percentiles
+"""
+class DynamicBatcher(object):
+    """
+    Runs \"predict\" on batches gathered from the segments of concurrent requests
+
+    Parameters
+    ----------
+    predict : callable
+        Returns the separated magnitudes for a batch of segments, shape (batch_size,1,time_context,input_size)
+    nsources : int
+        The number of sources returned by \"predict\"
+    batch_size : int, optional
+        The number of segments in a batch
+    max_wait : float, optional
+        The maximum time in seconds a segment waits for the batch to fill
+    nstats : int, optional
+        The number of requests and batches for which the statistics are kept
+    """
+    def __init__(self, predict, nsources, batch_size=32, max_wait=0.01, nstats=1000):
+        self.predict = predict
+        self.nsources = nsources
+        self.batch_size = batch_size
+        self.max_wait = max_wait
+        self.condition = threading.Condition()
+        #pending requests with the index of their next segment to predict
+        self.pending = collections.deque()
+        self.depth = 0
+        self.latency = collections.deque(maxlen=nstats)
+        self.fill = collections.deque(maxlen=nstats)
+        self.nrequests = 0
+        self.nbatches = 0
+        self.nfailed = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, windows):
+        """
+        Separates the segments \"windows\", shape (segments,1,time_context,input_size),
+            waits for all of them and returns the sources, shape (nsources,segments,1,time_context,input_size).
+            Raises a RuntimeError if a batch with segments of the request failed
+        """
+        request = {'windows': windows, 'next': 0, 'done': 0, 'start': time.time(), 'event': threading.Event(),
+            'sources': np.zeros((self.nsources,) + windows.shape, dtype=np.float32)}
+        if len(windows) > 0:
+            with self.condition:
+                self.pending.append(request)
+                self.depth = self.depth + len(windows)
+                self.condition.notify()
+            request['event'].wait()
+        with self.condition:
+            self.latency.append(time.time() - request['start'])
+            self.nrequests = self.nrequests + 1
+            if 'error' in request:
+                self.nfailed = self.nfailed + 1
+        if 'error' in request:
+            raise RuntimeError('Prediction failed: %s' % request['error'])
+        return request['sources']
+
+    def gather(self):
+        """
+        Waits for a full batch or for the deadline of the oldest segment and returns the slices of the requests in the batch
+        """
+        with self.condition:
+            while len(self.pending) == 0:
+                self.condition.wait()
+            deadline = self.pending[0]['start'] + self.max_wait
+            while self.depth < self.batch_size and time.time() < deadline:
+                self.condition.wait(deadline - time.time())
+            slices = []
+            size = 0
+            while size < self.batch_size and len(self.pending) > 0:
+                request = self.pending[0]
+                n = np.minimum(self.batch_size - size, len(request['windows']) - request['next'])
+                slices.append((request, request['next'], n))
+                request['next'] = request['next'] + n
+                size = size + n
+                if request['next'] == len(request['windows']):
+                    self.pending.popleft()
+            self.depth = self.depth - size
+        return slices, size
+
+    def run(self):
+        while True:
+            slices = []
+            try:
+                slices, size = self.gather()
+                self.process(slices, size)
+            except Exception as e:
+                #the worker keeps running, only the requests in the batch fail
+                logging.error('batch failed: %s', e)
+                self.fail([request for request,start,n in slices], e)
+
+    def process(self, slices, size):
+        """
+        Predicts the batch made of \"slices\" and routes the outputs back to the requests
+        """
+        batch = np.zeros((self.batch_size,) + slices[0][0]['windows'].shape[1:], dtype=np.float32)
+        position = 0
+        for request,start,n in slices:
+            batch[position:position+n] = request['windows'][start:start+n]
+            position = position + n
+        output = self.predict(batch)
+        self.nbatches = self.nbatches + 1
+        self.fill.append(size / float(self.batch_size))
+        #route the outputs back to the requests
+        position = 0
+        for request,start,n in slices:
+            for s in range(self.nsources):
+                request['sources'][s,start:start+n] = output[s][position:position+n]
+            position = position + n
+            request['done'] = request['done'] + n
+            if request['done'] == len(request['windows']):
+                request['event'].set()
+
+    def fail(self, requests, error):
+        """
+        Marks \"requests\" as failed with \"error\", drops their segments still waiting and wakes up their handlers
+        """
+        with self.condition:
+            for request in requests:
+                if 'error' in request:
+                    continue
+                request['error'] = error
+                if any(r is request for r in self.pending):
+                    self.pending = collections.deque(r for r in self.pending if r is not request)
+                    self.depth = self.depth - (len(request['windows']) - request['next'])
+                request['event'].set()
+
+    def stats(self):
+        """
+        Returns the number of segments waiting, the number of requests, failed requests and batches, the mean batch fill
+            and the 50th, 90th and 99th percentiles of the request latency in seconds
+        """
+        latency = np.array(self.latency)
+        percentiles = np.percentile(latency, [50,90,99]) if len(latency) > 0 else np.zeros(3)
+        return {'queue_depth': int(self.depth), 'requests': self.nrequests, 'failed': self.nfailed, 'batches': self.nbatches,
+            'fill': float(np.mean(self.fill)) if len(self.fill) > 0 else 0.,
+            'latency': {'p50': float(percentiles[0]), 'p90': float(percentiles[1]), 'p99': float(percentiles[2])}}
+
+
+class SeparationService(ThreadingMixIn, HTTPServer):
+    """
+    Serves the separation of wav files on \"address\", each request is handled in its own thread
+
+    Parameters
+    ----------
+    address : tuple
+        The host and the port, e.g. ('127.0.0.1', 8765)
+    separator : separation.BatchSeparator
+        Gives the settings of the analysis and the synthesis
+    max_wait : float, optional
+        The maximum time in seconds a segment waits for the batch to fill
+    """
+    daemon_threads = True
+
+    def __init__(self, address, separator, max_wait=0.01):
+        HTTPServer.__init__(self, address, ServiceHandler)
+        self.separator = separator
+        self.batcher = DynamicBatcher(separator.predict, separator.nsources, batch_size=separator.batch_size, max_wait=max_wait)
+
+    def separate(self, data):
+        """
+        Separates the wav file in the bytes \"data\" and returns the wav file of the sources
+        """
+        sampleRate, audio = scipy.io.wavfile.read(io.BytesIO(data))
+        assert sampleRate == self.separator.sampleRate, "Sample rate needs to be "+str(self.separator.sampleRate)
+        try:
+            maxv = np.finfo(audio.dtype).max
+        except:
+            maxv = np.iinfo(audio.dtype).max
+        audio = self.separator.downmix(audio.astype('float') / maxv)
+        mag, phase = self.separator.spectrogram(audio)
+        sources = self.batcher.submit(self.separator.segments(mag).astype(np.float32))
+        audio = self.separator.inverse(self.separator.overlapadd(sources, len(mag)), phase, len(audio))
+        output = io.BytesIO()
+        scipy.io.wavfile.write(output, sampleRate, np.stack(audio, axis=1).astype(np.float32))
+        return output.getvalue()
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    def reply(self, code, body, content_type):
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.reply(200, json.dumps(self.server.batcher.stats()).encode(), 'application/json')
+        else:
+            self.reply(404, b'not found', 'text/plain')
+
+    def do_POST(self):
+        if self.path != '/separate':
+            self.reply(404, b'not found', 'text/plain')
+            return
+        data = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            self.reply(200, self.server.separate(data), 'audio/wav')
+        except (ValueError, AssertionError) as e:
+            #the request is not a valid wav file for the model
+            self.reply(400, str(e).encode(), 'text/plain')
+        except Exception as e:
+            self.reply(500, str(e).encode(), 'text/plain')
+
+    def log_message(self, format, *args):
+        logging.debug(format, *args)
+
+
+def main(argv):
+    import runtime
+    usage = 'python service.py -m <path_to_model.pkl> [-p dsd|hhds|bach10] [--port 8765] [--max-wait 0.01]'
+    try:
+        opts, args = getopt.getopt(argv,"hm:p:",["mfile=","preset=","port=","max-wait="])
+    except getopt.GetoptError:
+        print(usage)
+        sys.exit(2)
+    preset = 'dsd'
+    port = 8765
+    max_wait = 0.01
+    for opt, arg in opts:
+        if opt == '-h':
+            print(usage)
+            sys.exit()
+        elif opt in ("-m", "--mfile"):
+            model = arg
+        elif opt in ("-p", "--preset"):
+            preset = arg
+        elif opt == "--port":
+            port = int(arg)
+        elif opt == "--max-wait":
+            max_wait = float(arg)
+    #only local connections
+    server = SeparationService(('127.0.0.1', port), runtime.batch_separator(runtime.load(model, preset), preset), max_wait=max_wait)
+    logging.info('serving on 127.0.0.1:%d', port)
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,28 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import sys
+
+#the modules are imported from the root of the repository, as in the examples and benchmarks
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in [ROOT, os.path.join(ROOT, 'benchmarks'), os.path.join(ROOT, 'evaluation')]:
+    if path not in sys.path:
+        sys.path.insert(0, path)
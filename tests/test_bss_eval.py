@@ -0,0 +1,82 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import numpy as np
+import pytest
+import bss_eval
+
+
+"""
+The numpy BSS Eval against the reference implementation, with the estimates in an order which is not the one
+of the references: a 3-cycle, which is not its own inverse
+"""
+CYCLE = [1, 2, 0]
+
+
+def signals(nchan=None, nsampl=8000, seed=0):
+    """
+    Returns references and estimates where the estimate CYCLE[j] is the reference j with noise and leakage
+    """
+    rng = np.random.RandomState(seed)
+    shape = (3, nsampl) if nchan is None else (3, nsampl, nchan)
+    references = rng.randn(*shape)
+    estimates = np.zeros(shape)
+    for j,k in enumerate(CYCLE):
+        estimates[k] = references[j] + (0.05 + 0.1 * j) * rng.randn(*shape[1:]) + 0.05 * (j + 1) * references[(j + 1) % 3]
+    return references, estimates
+
+
+def test_images_permutation():
+    references, estimates = signals(nchan=2)
+    SDR, ISR, SIR, SAR, perm = bss_eval.bss_eval_images(estimates, references)
+    #the estimate perm[j] is assigned to the reference j, and the criteria are in the order of the references
+    assert list(perm) == CYCLE
+    ordered = bss_eval.bss_eval_images(estimates[perm], references, compute_permutation=False)
+    for c,o in zip([SDR, ISR, SIR, SAR], ordered[:4]):
+        assert np.allclose(c, o)
+
+
+def test_sources_permutation():
+    references, estimates = signals()
+    SDR, SIR, SAR, perm = bss_eval.bss_eval_sources(estimates, references)
+    assert list(perm) == CYCLE
+    ordered = bss_eval.bss_eval_sources(estimates[perm], references, compute_permutation=False)
+    for c,o in zip([SDR, SIR, SAR], ordered[:3]):
+        assert np.allclose(c, o)
+
+
+def test_images_mir_eval():
+    mir_eval = pytest.importorskip('mir_eval')
+    references, estimates = signals(nchan=2)
+    expected = mir_eval.separation.bss_eval_images(references, estimates, compute_permutation=True)
+    result = bss_eval.bss_eval_images(estimates, references)
+    assert list(result[4]) == list(expected[4])
+    for c,e in zip(result[:4], expected[:4]):
+        assert np.allclose(c, e, atol=1e-3)
+
+
+def test_sources_mir_eval():
+    mir_eval = pytest.importorskip('mir_eval')
+    references, estimates = signals()
+    expected = mir_eval.separation.bss_eval_sources(references, estimates, compute_permutation=True)
+    result = bss_eval.bss_eval_sources(estimates, references)
+    assert list(result[3]) == list(expected[3])
+    for c,e in zip(result[:3], expected[:3]):
+        assert np.allclose(c, e, atol=1e-3)
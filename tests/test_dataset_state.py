@@ -0,0 +1,71 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import pickle
+import numpy as np
+import pytest
+import corpus
+import dataset
+
+
+"""
+Resuming LargeDataset with get_state/set_state returns the same batches as the uninterrupted iteration
+"""
+@pytest.fixture(scope='module')
+def short_files(tmp_path_factory):
+    #files shorter than the batches in memory, such that the batches span several files
+    path = str(tmp_path_factory.mktemp('corpus'))
+    corpus.generate(path, nfiles=7, duration=3., seed=1)
+    return path
+
+
+def make(path, batch_memory, nprocs=1):
+    np.random.seed(5)
+    return dataset.LargeDataset(path_transform_in=path, batch_size=8, batch_memory=batch_memory, time_context=30, overlap=20, nprocs=nprocs)
+
+
+@pytest.mark.parametrize('batch_memory,nprocs', [(3,1), (4,1), (5,2), (100,1)])
+def test_resume_every_batch(short_files, batch_memory, nprocs):
+    reference = make(short_files, batch_memory, nprocs)
+    nbatches = 2 * reference.iteration_size
+    states = []
+    batches = []
+    for k in range(nbatches + 2 * reference.batch_memory):
+        states.append(pickle.dumps(reference.get_state()))
+        batches.append([np.copy(x) for x in reference()])
+    for k in range(nbatches):
+        resumed = make(short_files, batch_memory, nprocs)
+        resumed.set_state(pickle.loads(states[k]))
+        for j in range(k, k + 2 * reference.batch_memory):
+            for x,y in zip(resumed(), batches[j]):
+                assert np.array_equal(x, y), "batch %d differs when resuming after %d batches" % (j, k)
+
+
+def test_skip_partial_at_epoch_end(short_files):
+    reference = make(short_files, 3)
+    for k in range(reference.iteration_size):
+        reference()
+    state = pickle.dumps(reference.get_state())
+    first = make(short_files, 3)
+    resumed = make(short_files, 3)
+    resumed.set_state(pickle.loads(state), skip_partial=True)
+    #a new epoch from the first batches
+    assert resumed.findex == 0 and resumed._index == 0
+    assert resumed()[0].shape == first()[0].shape
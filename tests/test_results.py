@@ -0,0 +1,94 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import os
+import fcntl
+import numpy as np
+import pytest
+import results
+
+
+"""
+The compaction of the ResultsStore never counts the rows twice, when it is interrupted or runs in several processes
+"""
+
+
+def append(store, method, ntracks=2):
+    rng = np.random.RandomState(len(store.files()))
+    store.append([{'method': method, 'name': 'track%d' % t, 'sdr': rng.randn(2, 3)} for t in range(ntracks)], ['vocals','drums'])
+
+
+def rows(store):
+    return len(results.ResultsStore(store.path).table()['value'])
+
+
+def test_compact(tmp_path):
+    store = results.ResultsStore(str(tmp_path))
+    for method in ['a','b','c']:
+        append(store, method)
+    store.compact()
+    assert len(store.files()) == 1 and rows(store) == 36
+    assert store.pairs() == set([(m, 'track%d' % t) for m in 'abc' for t in range(2)])
+
+
+def test_compact_interrupted(tmp_path, monkeypatch):
+    store = results.ResultsStore(str(tmp_path))
+    for method in ['a','b','c']:
+        append(store, method)
+    remove = os.remove
+    def crash(path):
+        if len(results.ResultsStore(store.path).files()) < 4:
+            raise KeyboardInterrupt
+        remove(path)
+    #interrupted after the merged shard is written and one shard is removed
+    monkeypatch.setattr(os, 'remove', crash)
+    with pytest.raises(KeyboardInterrupt):
+        store.compact()
+    monkeypatch.setattr(os, 'remove', remove)
+    assert len(store.files()) == 3 and rows(store) == 36
+    append(store, 'd')
+    store.compact()
+    assert len(store.files()) == 1 and rows(store) == 48
+
+
+def test_compact_concurrent(tmp_path):
+    store = results.ResultsStore(str(tmp_path))
+    for method in ['a','b']:
+        append(store, method)
+    with open(os.path.join(store.path, 'compact.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        store.compact()
+        assert len(store.files()) == 2
+    store.compact()
+    assert len(store.files()) == 1 and rows(store) == 24
+
+
+def test_compact_append(tmp_path, monkeypatch):
+    store = results.ResultsStore(str(tmp_path))
+    for method in ['a','b']:
+        append(store, method)
+    write = store.write
+    def appended(columns, replaces=None):
+        #a shard appended by another process while the table is merged
+        append(results.ResultsStore(store.path), 'c')
+        return write(columns, replaces)
+    monkeypatch.setattr(store, 'write', appended)
+    store.compact()
+    assert len(store.files()) == 2 and rows(store) == 36
@@ -0,0 +1,64 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+
+import numpy as np
+import pytest
+import runtime
+import util
+import suite
+
+
+"""
+The quantized models keep in memory only the weights of the computation, and save the same quantized arrays
+"""
+
+
+@pytest.mark.parametrize('mode', ['float16', 'int8'])
+def test_quantized_memory(mode):
+    model = suite.random_model(hidden=32)
+    quantized = runtime.quantize(model, mode)
+    #the quantized copies are dropped after the conversion
+    for i in quantized.quantized:
+        assert quantized.params[i] is None
+    assert quantized.nbytes()[1] == model.nbytes()[1]
+    assert quantized.nbytes()[0] < model.nbytes()[0]
+
+
+@pytest.mark.parametrize('mode', ['float16', 'int8'])
+def test_quantized_save(mode, tmp_path):
+    model = suite.random_model(hidden=32)
+    W = np.asarray(model.dense(8), dtype=np.float32)
+    quantized = runtime.quantize(model, mode)
+    filename = str(tmp_path / 'model.npz')
+    runtime.save(filename, quantized)
+    params, header = util.loadModel(filename)
+    #the saved arrays are the ones computed by quantize
+    if mode == 'float16':
+        expected = W.astype(np.float16)
+    else:
+        scale = np.max(np.abs(W), axis=0) / 127.
+        expected = np.round(W / scale).astype(np.int8)
+    assert params[8].dtype == expected.dtype and np.array_equal(params[8], expected)
+    #the loaded quantized weights stay memory-mapped
+    loaded = runtime.load(filename)
+    assert len(loaded.quantized) == 0 and runtime.mapped(loaded.params[8])
+    batch = np.random.RandomState(1).rand(2, 1, model.time_context, model.input_size)
+    for a,b in zip(loaded(batch), quantized(batch)):
+        assert np.allclose(a, b)
@@ -0,0 +1,337 @@
+"""
+    This file is part of DeepConvSep.
+
+    Copyright (c) 2014-2017 Marius Miron  <miron.marius at gmail.com>
+
+    DeepConvSep is free software: you can redistribute it and/or modify
+    it under the terms of the Affero GPL License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    DeepConvSep is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the Affero GPL License
+    along with DeepConvSep.  If not, see <http://www.gnu.org/licenses/>.
+ """
+
+import os
+import json
+import time
+import queue
+import pickle
+import shutil
+import threading
+import collections
+import numpy as np
+import util
+import climate
+logging = climate.get_logger('training')
+
+
+"""
+Helpers for the training loops of the examples (train_auto in trainCNN.py), which are independent of theano and lasagne.
+"""
+class Telemetry(object):
+    """
+    Records for each training step the time spent waiting for the data (the call to the dataset) and the time spent
+    computing (everything else until the end of the step, e.g. train_fn), the samples per second and the loss.
+    A step is delimited by \"begin\", \"data_ready\" and \"end\":
+        telemetry.begin()
+        inputs, target = train()
+        telemetry.data_ready()
+        loss = train_fn(inputs, target)
+        telemetry.end(loss, len(inputs))
+    Each step is written as a json line to \"path\", and a line with the throughput and the share of data waiting
+    over the last \"window\" steps is logged every \"log_every\" steps.
+
+    Parameters
+    ----------
+    path : string, optional
+        The .jsonl file where the steps and the epochs are appended, if None nothing is written
+    window : int, optional
+        The number of steps over which the rolling summary is computed
+    log_every : int, optional
+        Log the rolling summary every \"log_every\" steps, 0 to disable
+    """
+    def __init__(self, path=None, window=100, log_every=100):
+        self.path = path
+        self.log_every = log_every
+        self.recent = collections.deque(maxlen=window)
+        self.file = None
+        if path is not None:
+            if os.path.dirname(path) and not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            self.file = open(path, 'a')
+        self.epoch = 0
+        self.step = 0
+        self.start_epoch()
+
+    def start_epoch(self, epoch=None):
+        """
+        Resets the totals of the epoch, \"epoch\" is the number written with the steps (by default the next one)
+        """
+        if epoch is not None:
+            self.epoch = epoch
+        self.totals = {'steps': 0, 'data': 0., 'compute': 0., 'samples': 0, 'loss': 0.}
+        self.epoch_start = time.time()
+        self.t_begin = None
+        self.t_data = None
+
+    def begin(self):
+        self.t_begin = time.time()
+
+    def data_ready(self):
+        self.t_data = time.time()
+
+    def end(self, loss=None, samples=0):
+        """
+        Ends the step with the loss of the batch and the number of examples in the batch
+        """
+        t_end = time.time()
+        if self.t_begin is None:
+            self.t_begin = t_end
+        if self.t_data is None:
+            self.t_data = self.t_begin
+        data = self.t_data - self.t_begin
+        compute = t_end - self.t_data
+        record = {'epoch': self.epoch, 'step': self.step, 'time': t_end, 'data': data, 'compute': compute,
+            'samples': int(samples), 'samples_per_sec': samples / np.maximum(data + compute, 1e-9)}
+        if loss is not None:
+            record['loss'] = float(loss)
+            self.totals['loss'] = self.totals['loss'] + float(loss)
+        self.write(record)
+        self.recent.append((data, compute, samples))
+        self.totals['steps'] = self.totals['steps'] + 1
+        self.totals['data'] = self.totals['data'] + data
+        self.totals['compute'] = self.totals['compute'] + compute
+        self.totals['samples'] = self.totals['samples'] + int(samples)
+        self.step = self.step + 1
+        self.t_begin = None
+        self.t_data = None
+        if self.log_every > 0 and self.step % self.log_every == 0:
+            self.log()
+        return record
+
+    def summary(self):
+        """
+        Returns the mean data and compute time per step, the share of the data waiting and the samples per second
+            over the last \"window\" steps
+        """
+        if len(self.recent) == 0:
+            return {'steps': 0, 'data': 0., 'compute': 0., 'data_share': 0., 'samples_per_sec': 0.}
+        recent = np.array(self.recent, dtype=float)
+        total = np.maximum(np.sum(recent[:,0]) + np.sum(recent[:,1]), 1e-9)
+        return {'steps': len(recent), 'data': float(np.mean(recent[:,0])), 'compute': float(np.mean(recent[:,1])),
+            'data_share': float(np.sum(recent[:,0]) / total), 'samples_per_sec': float(np.sum(recent[:,2]) / total)}
+
+    def log(self):
+        s = self.summary()
+        logging.info('step %d: %.1f samples/s, data %.1f ms, compute %.1f ms per step, %.0f%% waiting for data',
+            self.step, s['samples_per_sec'], 1000 * s['data'], 1000 * s['compute'], 100 * s['data_share'])
+
+    def end_epoch(self, dataset=None):
+        """
+        Writes and returns the totals of the epoch, with the stats of \"dataset\" if it keeps them (see LargeDataset.get_stats),
+            and starts the next epoch
+        """
+        t = self.totals
+        busy = np.maximum(t['data'] + t['compute'], 1e-9)
+        record = {'epoch': self.epoch, 'type': 'epoch', 'time': time.time(), 'elapsed': time.time() - self.epoch_start,
+            'steps': t['steps'], 'data': t['data'], 'compute': t['compute'], 'data_share': t['data'] / busy,
+            'samples_per_sec': t['samples'] / busy, 'loss': t['loss'] / np.maximum(t['steps'], 1)}
+        if dataset is not None and hasattr(dataset, 'stats') and dataset.stats.enabled:
+            record['dataset'] = dataset.get_stats()
+        self.write(record)
+        if self.file is not None:
+            self.file.flush()
+        logging.info('epoch %d: %d steps, %.1f samples/s, %.0f%% of the time waiting for data',
+            self.epoch, t['steps'], record['samples_per_sec'], 100 * record['data_share'])
+        self.start_epoch(self.epoch + 1)
+        return record
+
+    def write(self, record):
+        if self.file is not None:
+            self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def read_telemetry(path):
+    """
+    Reads the .jsonl file written by Telemetry and returns the list of steps and the list of epochs
+    """
+    steps = []
+    epochs = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if len(line) == 0:
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'epoch':
+                epochs.append(record)
+            else:
+                steps.append(record)
+    return steps, epochs
+
+
+class CheckpointWriter(object):
+    """
+    Writes the parameters of a model in a background thread, such that saving a checkpoint costs the training loop
+    only the copy of the parameters. The copy goes to one of two reusable sets of buffers, and the thread pickles it
+    (the format of save_model in the examples: a list of arrays) to a temporary file, fsyncs it and renames it to \"path\",
+    such that \"path\" is always a complete checkpoint even if the job is killed while writing.
+    The previous \"keep\" checkpoints are kept as \"path\".1 (the most recent), \"path\".2, ...
+    The state saved with a checkpoint is written before it, with the hash of the parameters: if the job is killed
+    between the two, \"find_state\" returns the previous state, the one of the parameters in \"path\".
+
+    Parameters
+    ----------
+    path : string
+        The path of the checkpoint, e.g. the .pkl file read by load_model
+    keep : int, optional
+        The number of previous checkpoints to keep
+    """
+    def __init__(self, path, keep=2):
+        self.path = path
+        self.keep = keep
+        self.buffers = [None, None]
+        self.free = queue.Queue()
+        for b in range(len(self.buffers)):
+            self.free.put(b)
+        self.jobs = queue.Queue()
+        self.error = None
+        self.nsaved = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def snapshot(self, b, params):
+        """
+        Copies the parameters in the set of buffers \"b\", the parameters can be arrays or Theano shared variables
+        """
+        values = [p.get_value(borrow=True) if hasattr(p, 'get_value') else np.asarray(p) for p in params]
+        buffers = self.buffers[b]
+        if buffers is None or len(buffers) != len(values) or any(x.shape != v.shape or x.dtype != v.dtype for x,v in zip(buffers, values)):
+            buffers = [np.empty_like(v) for v in values]
+            self.buffers[b] = buffers
+        for x,v in zip(buffers, values):
+            np.copyto(x, v)
+        return buffers
+
+    def save(self, params, state=None):
+        """
+        Copies \"params\" and returns, the checkpoint is written in the background.
+            Waits only if the two previous checkpoints are still being written.
+
+        Parameters
+        ----------
+        params : list of numpy arrays or Theano shared variables
+            The parameters, e.g. lasagne.layers.get_all_params(network)
+        state : object, optional
+            Pickled to \"path\".state with the checkpoint, e.g. the epoch and LargeDataset.get_state(), see \"find_state\"
+        """
+        self.check()
+        b = self.free.get()
+        try:
+            buffers = self.snapshot(b, params)
+        except:
+            self.free.put(b)
+            raise
+        self.jobs.put((b, buffers, state))
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                self.jobs.task_done()
+                break
+            b, buffers, state = job
+            try:
+                #the state first, it is used only with the parameters having its hash
+                if state is not None:
+                    self.write({'hash': util.modelHash(buffers, {}), 'state': state}, self.path + '.state')
+                self.write(buffers, self.path)
+                self.nsaved = self.nsaved + 1
+            except Exception as e:
+                logging.error('could not write the checkpoint %s: %s', self.path, e)
+                self.error = e
+            finally:
+                self.free.put(b)
+                self.jobs.task_done()
+
+    def write(self, obj, path):
+        """
+        Writes \"obj\" to a temporary file, keeps the previous versions of \"path\" and renames the file to \"path\"
+        """
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(obj, f, protocol=2)
+            f.flush()
+            os.fsync(f.fileno())
+        if self.keep > 0 and os.path.exists(path):
+            for k in range(self.keep - 1, 0, -1):
+                if os.path.exists(path + '.' + str(k)):
+                    os.replace(path + '.' + str(k), path + '.' + str(k + 1))
+            #a link keeps \"path\" in place until it is replaced
+            try:
+                os.link(path, path + '.1')
+            except OSError:
+                shutil.copy2(path, path + '.1')
+        os.replace(tmp, path)
+        directory = os.path.dirname(os.path.abspath(path))
+        try:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+    def check(self):
+        if self.error is not None:
+            error = self.error
+            self.error = None
+            raise error
+
+    def wait(self):
+        """
+        Waits until all the checkpoints are written
+        """
+        self.jobs.join()
+        self.check()
+
+    def close(self):
+        self.wait()
+        self.jobs.put(None)
+        self.thread.join()
+
+
+def find_state(path, params):
+    """
+    Returns the state saved by CheckpointWriter with the parameters \"params\" loaded from the checkpoint \"path\",
+        looking in \"path\".state and in the previous versions, or None if there is none
+
+    Examples
+    --------
+    params = load_model(model)
+    state = find_state(model, params)
+    """
+    digest = util.modelHash([np.asarray(p) for p in params], {})
+    names = [path + '.state']
+    while os.path.exists(path + '.state.' + str(len(names))):
+        names.append(path + '.state.' + str(len(names)))
+    for name in names:
+        if os.path.exists(name):
+            with open(name, 'rb') as f:
+                saved = pickle.load(f)
+            if saved.get('hash') == digest:
+                return saved['state']
+    return None
@@ -396,4 +396,140 @@ def istft_norm(X, window=sinebell(2048),
     return data
 
 
+class StreamingSTFT(object):
+    """
+    Incremental version of stft_norm: audio is pushed in blocks of any size and the frames are returned
+        as soon as they are complete. The frames are the same as the ones of stft_norm on the whole signal.
+
+    Parameters
+    ----------
+    window : 1D numpy array
+        The analysis window
+    hopsize : int
+        The hop size of the analysis in samples
+    nfft : int
+        The number of points for the Fourier computation
+
+    Examples
+    --------
+    stft = StreamingSTFT(np.hanning(1024), hopsize=512, nfft=1024)
+    for block in blocks:
+        X = stft.process(block)
+    X = stft.flush()
+    """
+    def __init__(self, window=sinebell(2048), hopsize=256, nfft=2048):
+        self.window = window
+        self.lengthWindow = window.size
+        self.hopsize = int(hopsize)
+        self.nfft = int(nfft)
+        self.reset()
+
+    def reset(self):
+        #the first frame is centered on the first sample, like in stft_norm
+        self.buffer = np.zeros(int(self.lengthWindow/2.0))
+        self.lengthData = 0
+        self.numberFrames = 0
+
+    def frames(self, nframes):
+        segments = np.lib.stride_tricks.sliding_window_view(self.buffer, self.lengthWindow)[::self.hopsize][:nframes]
+        X = np.fft.rfft(segments * self.window, self.nfft, axis=1)
+        self.buffer = self.buffer[nframes*self.hopsize:]
+        self.numberFrames = self.numberFrames + nframes
+        return X
+
+    def process(self, data):
+        """
+        Appends the audio block \"data\" and returns the complete frames, shape (frames, nfft/2+1)
+        """
+        self.lengthData = self.lengthData + len(data)
+        self.buffer = np.concatenate((self.buffer, data))
+        if len(self.buffer) < self.lengthWindow:
+            return np.zeros((0, int(self.nfft/2+1)), dtype=complex)
+        return self.frames(int((len(self.buffer) - self.lengthWindow) / self.hopsize) + 1)
+
+    def flush(self):
+        """
+        Zero-pads the end of the signal as stft_norm does and returns the remaining frames
+        """
+        numberFrames = int(np.ceil(self.lengthData / np.double(self.hopsize)) + 2)
+        nframes = numberFrames - self.numberFrames
+        newLength = (nframes - 1) * self.hopsize + self.lengthWindow
+        self.buffer = np.concatenate((self.buffer, np.zeros(np.maximum(0, newLength - len(self.buffer)))))
+        X = self.frames(nframes)
+        self.reset()
+        return X
+
+
+class StreamingISTFT(object):
+    """
+    Incremental version of istft_norm: frames are pushed in blocks and the samples which are not
+        overlapped by future frames are returned. The audio is the same as the one of istft_norm,
+        including the removal of the first half-window.
+
+    Parameters
+    ----------
+    window : 1D numpy array
+        The synthesis window
+    analysisWindow : 1D numpy array, optional
+        The analysis window, if ommited is the same as the synthesis window
+    hopsize : int
+        The hop size of the analysis in samples
+    nfft : int
+        The number of points for the Fourier computation
+    """
+    def __init__(self, window=sinebell(2048), analysisWindow=None, hopsize=256, nfft=2048):
+        if analysisWindow is None:
+            analysisWindow = window
+        self.window = window
+        self.lengthWindow = window.size
+        self.normalisation = window * analysisWindow
+        self.hopsize = int(hopsize)
+        self.nfft = int(nfft)
+        self.reset()
+
+    def reset(self):
+        self.data = np.zeros(0)
+        self.normalisationSeq = np.zeros(0)
+        self.skip = int(self.lengthWindow/2.0)
+
+    def process(self, X):
+        """
+        Overlap-adds the frames X, shape (frames, nfft/2+1), and returns the finished samples
+        """
+        nframes = len(X)
+        if nframes == 0:
+            return np.zeros(0)
+        frames = np.fft.irfft(X, self.nfft, axis=1)[:, :self.lengthWindow] * self.window
+        #the pending samples are extended to hold the new frames
+        length = (nframes - 1) * self.hopsize + self.lengthWindow
+        data = np.zeros(np.maximum(length, len(self.data)))
+        data[:len(self.data)] = self.data
+        normalisationSeq = np.zeros(len(data))
+        normalisationSeq[:len(self.normalisationSeq)] = self.normalisationSeq
+        for n in range(nframes):
+            beginFrame = n * self.hopsize
+            data[beginFrame:beginFrame+self.lengthWindow] += frames[n]
+            normalisationSeq[beginFrame:beginFrame+self.lengthWindow] += self.normalisation
+        done = nframes * self.hopsize
+        self.data = data[done:]
+        self.normalisationSeq = normalisationSeq[done:]
+        return self.output(data[:done], normalisationSeq[:done])
+
+    def output(self, data, normalisationSeq):
+        skip = np.minimum(self.skip, len(data))
+        self.skip = self.skip - skip
+        data = data[skip:]
+        normalisationSeq = normalisationSeq[skip:].copy()
+        normalisationSeq[normalisationSeq==0] = 1.
+        return data / normalisationSeq
+
+    def flush(self):
+        """
+        Returns the samples of the last frame
+        """
+        data = self.output(self.data, self.normalisationSeq)
+        self.reset()
+        return data
+
+
 
@@ -34,6 +34,10 @@ import scipy.io.wavfile
 import queue
 import time
 import threading
+import struct
+import json
+import hashlib
+import zipfile
 
 
 #routines to read and write audio
@@ -53,11 +57,129 @@ def readAudioScipy(filein):
         maxv = np.iinfo(bitrate).max
     return audioObj.astype('float')/maxv, sampleRate, bitrate
 
+def readAudioBlocks(filein,blocksize=65536):
+    """
+    Memory-maps a wav file and returns a generator over float blocks of \"blocksize\" samples,
+        scaled as in readAudioScipy, together with the sample rate, the bitrate and the number of samples
+    """
+    sampleRate, audioObj = scipy.io.wavfile.read(filein, mmap=True)
+    bitrate = audioObj.dtype
+    try:
+        maxv = np.finfo(bitrate).max
+    except:
+        maxv = np.iinfo(bitrate).max
+    def blocks():
+        for start in range(0, len(audioObj), blocksize):
+            yield audioObj[start:start+blocksize].astype('float')/maxv
+    return blocks(), sampleRate, bitrate, len(audioObj)
+
 def writeAudioScipy(fileout,audio_out,sampleRate,bitrate="int16"):
     maxn = np.iinfo(bitrate).max
     scipy.io.wavfile.write(filename=fileout, rate=sampleRate, data=(audio_out*maxn).astype(bitrate))
 
 
+class WavWriter(object):
+    """
+    Writes a wav file block by block, e.g. as the overlap-add of a separation produces the audio.
+        The header is written with empty sizes when the file is opened and patched when the file is closed,
+        so the whole signal never has to be in memory.
+
+    Parameters
+    ----------
+    fileout : string
+        The path of the wav file to write
+    sampleRate : int
+        The sample rate of the audio
+    nchannels : int, optional
+        The number of channels, blocks are (t,) for one channel or (t,nchannels)
+    bitrate : string or numpy dtype, optional
+        'int16' or 'int32' to quantize to PCM, 'float32' to write IEEE float samples without quantization
+    blocksize : int, optional
+        The initial size in samples of the conversion buffers, they grow if larger blocks are written
+
+    Examples
+    --------
+    with WavWriter(path, 44100) as writer:
+        for block in blocks:
+            writer.write(block)
+    """
+    def __init__(self, fileout, sampleRate, nchannels=1, bitrate="int16", blocksize=4096):
+        self.dtype = np.dtype(bitrate).newbyteorder('<')
+        if self.dtype.kind == 'f':
+            if self.dtype.itemsize != 4:
+                raise ValueError('Only float32 is supported for floating point wav files')
+            self.format_tag = 3
+            self.maxn = None
+        elif self.dtype.kind == 'i' and self.dtype.itemsize in (2,4):
+            self.format_tag = 1
+            self.maxn = np.iinfo(self.dtype).max
+        else:
+            raise ValueError('Unsupported bitrate for wav files: %s' % str(bitrate))
+        self.fileout = fileout
+        self.sampleRate = int(sampleRate)
+        self.nchannels = int(nchannels)
+        self.nsamples = 0
+        self.buffer = np.empty((blocksize,self.nchannels), dtype=self.dtype)
+        self.scratch = np.empty((blocksize,self.nchannels)) if self.maxn is not None else None
+        self.fid = open(fileout, 'wb')
+        self.write_header()
+
+    def write_header(self):
+        """
+        Writes the RIFF header with the current number of samples
+        """
+        block_align = self.nchannels * self.dtype.itemsize
+        data_size = self.nsamples * block_align
+        self.fid.write(b'RIFF' + struct.pack('<I', 36 + data_size) + b'WAVE')
+        self.fid.write(b'fmt ' + struct.pack('<IHHIIHH', 16, self.format_tag, self.nchannels, self.sampleRate,
+            self.sampleRate * block_align, block_align, 8 * self.dtype.itemsize))
+        self.fid.write(b'data' + struct.pack('<I', data_size))
+
+    def write(self, block):
+        """
+        Clips a float block to [-1,1], converts it to the output bitrate and appends it to the file.
+            The block is left unchanged, the conversion goes through buffers reused across calls
+        """
+        if self.fid is None:
+            raise IOError('The wav file was already closed: '+self.fileout)
+        block = np.asarray(block)
+        if block.ndim == 1:
+            block = block.reshape(-1,1)
+        assert block.shape[1] == self.nchannels, "Number of channels does not match the wav file"
+        n = block.shape[0]
+        if n == 0:
+            return
+        if n > self.buffer.shape[0]:
+            self.buffer = np.empty((n,self.nchannels), dtype=self.dtype)
+            if self.scratch is not None:
+                self.scratch = np.empty((n,self.nchannels))
+        buf = self.buffer[:n]
+        if self.maxn is None:
+            np.clip(block, -1., 1., out=buf, casting='unsafe')
+        else:
+            tmp = self.scratch[:n]
+            np.clip(block, -1., 1., out=tmp, casting='unsafe')
+            np.multiply(tmp, self.maxn, out=buf, casting='unsafe')
+        self.fid.write(buf.tobytes())
+        self.nsamples = self.nsamples + n
+
+    def close(self):
+        """
+        Patches the header with the final sizes and closes the file
+        """
+        if self.fid is not None:
+            self.fid.seek(0)
+            self.write_header()
+            self.fid.close()
+            self.fid = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 #circular shift audio with 'cs'
 def circular_shift(audio,min_size,cs=0.1,sampleRate=44100):
     if cs == 0:
@@ -114,6 +236,80 @@ def loadObj(filename):
         obj= pickle.load(input)
     return obj
 
+def modelHash(params, hyperparameters):
+    """
+    Returns the sha256 of the parameters (type, shape and values) and of the hyperparameters of a model
+    """
+    h = hashlib.sha256()
+    h.update(json.dumps(hyperparameters, sort_keys=True).encode())
+    for p in params:
+        p = np.ascontiguousarray(p)
+        h.update(str((p.dtype.str, p.shape)).encode())
+        h.update(memoryview(p).cast('B'))
+    return h.hexdigest()
+
+def saveModel(filename, params, **hyperparameters):
+    """
+    Saves the list of parameters of a model and its hyperparameters (e.g. time_context, feat_size, nsources,
+        scale_factor, overlap) as an uncompressed .npz which can be memory-mapped by loadModel.
+        The header.json member holds the hyperparameters, the number of parameters and the content hash.
+    """
+    params = [np.asarray(p) for p in params]
+    header = {'format': 'deepconvsep-model', 'version': 1, 'nparams': len(params),
+        'hyperparameters': hyperparameters, 'hash': modelHash(params, hyperparameters)}
+    with zipfile.ZipFile(filename, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        zf.writestr('header.json', json.dumps(header, sort_keys=True, indent=1))
+        for i,p in enumerate(params):
+            with zf.open('param_%03d.npy' % i, 'w', force_zip64=True) as f:
+                np.lib.format.write_array(f, np.ascontiguousarray(p))
+    return header['hash']
+
+def loadModel(filename, mmap=True, verify=False):
+    """
+    Loads a model saved with saveModel and returns the list of parameters and the header.
+        With \"mmap\" the parameters are read-only memory maps of the file, shared between the processes
+        which load the same model. The pickled lists of save_model are also read, with an empty header.
+    """
+    if not zipfile.is_zipfile(filename):
+        with open(filename, 'rb') as f:
+            try:
+                params = pickle.load(f)
+            except UnicodeDecodeError:
+                f.seek(0)
+                params = pickle.load(f, encoding='latin1')
+        return [np.asarray(p) for p in params], {}
+    params = []
+    with zipfile.ZipFile(filename, 'r') as zf:
+        header = json.loads(zf.read('header.json').decode())
+        if header.get('format') != 'deepconvsep-model':
+            raise IOError(filename+" is not a model saved with saveModel")
+        with open(filename, 'rb') as f:
+            for i in range(header['nparams']):
+                info = zf.getinfo('param_%03d.npy' % i)
+                if not mmap or info.compress_type != zipfile.ZIP_STORED:
+                    params.append(np.lib.format.read_array(zf.open(info)))
+                    continue
+                #the local file header is 30 bytes, the name and the extra field follow
+                f.seek(info.header_offset + 26)
+                namelength, extralength = struct.unpack('<HH', f.read(4))
+                f.seek(info.header_offset + 30 + namelength + extralength)
+                version = np.lib.format.read_magic(f)
+                if version == (1,0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+                elif version == (2,0):
+                    shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+                else:
+                    params.append(np.lib.format.read_array(zf.open(info)))
+                    continue
+                if np.prod(shape) == 0:
+                    params.append(np.zeros(shape, dtype=dtype))
+                else:
+                    params.append(np.memmap(filename, dtype=dtype, mode='r', shape=shape,
+                        order='F' if fortran_order else 'C', offset=f.tell()))
+    if verify and modelHash(params, header['hyperparameters']) != header['hash']:
+        raise IOError("The content of "+filename+" does not match its hash")
+    return params, header
+
 def emptyDir(dirPath):
     fileList = os.listdir(dirPath)
     for fileName in fileList:
@@ -217,35 +413,59 @@ def getPitches(pitch,shape_time,interp='zero'):
 
 
 
-def generate_overlapadd(allmix,input_size=513,time_context=30, overlap=10,batch_size=32,sampleRate=44100):
-
+def generate_overlapadd(allmix,input_size=513,time_context=30, overlap=10,batch_size=32,sampleRate=44100,dtype=float,out=None,return_valid=False):
+    """
+    Cuts the spectrogram \"allmix\", shape (frames,input_size) or (channels,frames,input_size), in segments of
+        \"time_context\" frames with \"overlap\" frames in common, grouped in batches of \"batch_size\" segments.
+        The last segments are zero-padded to \"time_context\" and the last batch with empty segments.
+
+    Parameters
+    ----------
+    dtype : numpy dtype, optional
+        The type of the batches, e.g. np.float32 to give them directly to the network
+    out : numpy array, optional
+        A buffer for the batches, shape (batches,batch_size,channels,time_context,input_size), reused if large enough
+    return_valid : bool, optional
+        Also return the number of real segments in the last batch, the following ones can be skipped by the predictor
+    Yields
+    ------
+    fbatch : numpy array
+        The batches, shape (batches,batch_size,channels,time_context,input_size)
+    nchunks : int
+        The number of segments
+    nvalid : int
+        The number of real segments in the last batch, if \"return_valid\"
+    """
+    assert input_size == allmix.shape[-1], "Feature size must be the same as the last dimension of the spectrogram"
     if len(allmix.shape)>2:
-        nchannels=allmix.shape[0]
+        mix = allmix
     else:
-        nchannels=1
-
-    assert input_size == allmix.shape[-1], "Feature size must be the same as the last dimension of the spectrogram"
-    i=0
-    start=0
-    while (start + overlap) < allmix.shape[-2]:
-        i = i + 1
-        start = start - overlap + time_context
-    fbatch = np.zeros([int(np.ceil(float(i)/batch_size)),batch_size,nchannels,time_context,input_size])
+        mix = allmix[np.newaxis]
+    nchannels, nframes = mix.shape[0], mix.shape[1]
+    step = time_context - overlap
+    nchunks = int(np.maximum(0, np.ceil((nframes - overlap) / float(step))))
+    nbatches = int(np.ceil(float(nchunks)/batch_size))
+    shape = (nbatches,batch_size,nchannels,time_context,input_size)
+    if out is not None and out.shape[1:] == shape[1:] and len(out) >= nbatches:
+        fbatch = out[:nbatches]
+    else:
+        fbatch = np.empty(shape, dtype=dtype)
+    chunks = fbatch.reshape((nbatches*batch_size,nchannels,time_context,input_size))
 
-    i=0
-    start=0
-    while (start + overlap) < allmix.shape[-2]:
-        fbatchend = np.minimum(time_context,allmix.shape[-2]-start)
-        end = np.minimum(start+time_context,allmix.shape[-2])
-        if len(allmix.shape)>2:
-            fbatch[int(i/batch_size),int(i%batch_size),:,:fbatchend,:]=allmix[:,start:end,:]
-        else:
-            fbatch[int(i/batch_size),int(i%batch_size),:,:fbatchend,:]=allmix[start:end,:]
-        #data_in[i] = allm[0]
-        i = i + 1 #index for each block
-        start = start - overlap + time_context #starting point for each block
+    #the segments inside the spectrogram are strided views, only the last ones are padded
+    nfull = int(np.clip((nframes - time_context) // step + 1, 0, nchunks))
+    if nfull > 0:
+        windows = np.lib.stride_tricks.sliding_window_view(mix, time_context, axis=1)[:,::step][:,:nfull]
+        chunks[:nfull] = windows.transpose(1,0,3,2)
+    for i in range(nfull, nchunks):
+        end = nframes - i*step
+        chunks[i,:,:end] = mix[:,i*step:]
+        chunks[i,:,end:] = 0
+    chunks[nchunks:] = 0
 
-    return fbatch,i
+    if return_valid:
+        return fbatch, nchunks, nchunks - (nbatches-1)*batch_size if nbatches > 0 else 0
+    return fbatch, nchunks
 
 
 def overlapadd(fbatch,obatch,nchunks,overlap=10):
@@ -294,36 +514,67 @@ def overlapadd(fbatch,obatch,nchunks,overlap=10):
     return sep1,sep2
 
 
-def overlapadd_multi(fbatch,obatch,nchunks,overlap=10):
-
+def overlapadd_weights(nchunks,time_context=30,overlap=10):
+    """
+    Returns the weight of each frame of each segment in the crossfade of overlapadd_multi, shape (nchunks,time_context).
+        A segment overwrites the previous ones after its first \"overlap\" frames and fades linearly into them before.
+    """
+    step = time_context - overlap
+    window = np.linspace(0., 1.0, num=overlap)
+    fadein = np.ones(time_context)
+    fadein[:overlap] = window
+    #fadeout[p] is the factor applied to frame p of a segment by a later segment, 0 if it is overwritten
+    fadeout = np.zeros(time_context)
+    fadeout[:overlap] = window[::-1]
+    weights = np.ones((nchunks,time_context))
+    weights[1:] = fadein
+    chunk = np.arange(nchunks)
+    for k in range(1, int(np.ceil(time_context / float(step)))):
+        p = np.arange(time_context) - k*step
+        factor = np.where(p < 0, 1., fadeout[np.maximum(p,0)])
+        later = (chunk + k) < nchunks
+        weights[later] = weights[later] * factor
+    return weights
+
+
+def overlapadd_multi(fbatch,obatch,nchunks,overlap=10,dtype=float,out=None):
+    """
+    Joins the separated segments with a linear crossfade over the \"overlap\" frames
+
+    Parameters
+    ----------
+    fbatch : numpy array
+        The separated segments, shape (batches,nsources,batch_size,channels,time_context,input_size), only the first channel is used
+    obatch : numpy array
+        Not used, kept for compatibility
+    nchunks : int
+        The number of real segments, as returned by generate_overlapadd
+    overlap : int, optional
+        The number of overlapping frames between adjacent segments
+    dtype : numpy dtype, optional
+        The type of the output
+    out : numpy array, optional
+        A buffer for the output, shape (nsources,nchunks*(time_context-overlap)+time_context,input_size)
+    Yields
+    ------
+    sep : numpy array
+        The separated sources, shape (nsources,nchunks*(time_context-overlap)+time_context,input_size)
+    """
     input_size=fbatch.shape[-1]
     time_context=fbatch.shape[-2]
-    batch_size=fbatch.shape[2]
     nsources = fbatch.shape[1]
-    #print time_context
-    #print batch_size
-
-    #window = np.sin((np.pi*(np.arange(2*overlap+1)))/(2.0*overlap))
-    window = np.linspace(0., 1.0, num=overlap)
-    window = np.concatenate((window,window[::-1]))
-    #time_context = net.network.find('hid2', 'hh').size
-    # input_size = net.layers[0].size  #input_size is the number of spectral bins in the fft
-    window = np.repeat(np.expand_dims(window, axis=1),input_size,axis=1)
-    sep = np.zeros((nsources, nchunks*(time_context-overlap)+time_context, input_size)) #allocate for output of prediction
-    for s in range(nsources):
-        i=0
-        start=0
-        while i < nchunks:
-            # import pdb;pdb.set_trace()
-            fbatch1=fbatch[:,s,:,:,:]
-            source= fbatch1[int(i/batch_size),int(i%batch_size),0,:,:]
-            if start==0:
-                sep[s,0:time_context] = source
-            else:
-                sep[s,start+overlap:start+time_context] = source[overlap:time_context]
-                sep[s,start:start+overlap] = window[overlap:]*sep[s,start:start+overlap] + window[:overlap]*source[:overlap]
-            i = i + 1 #index for each block
-            start = start - overlap + time_context #starting point for each block
+    step = time_context - overlap
+    batch_size = fbatch.shape[2]
+    shape = (nsources, nchunks*step+time_context, input_size)
+    if out is not None and out.shape == shape:
+        sep = out
+        sep[:] = 0
+    else:
+        sep = np.zeros(shape, dtype=dtype)
+    weights = overlapadd_weights(nchunks, time_context=time_context, overlap=overlap)[:,:,np.newaxis]
+    #the crossfade is a weighted sum, all the sources are added at once segment by segment
+    for i in range(nchunks):
+        sep[:,i*step:i*step+time_context] += weights[i] * fbatch[int(i/batch_size),:,int(i%batch_size),0]
     return sep
 
 
@@ -630,118 +881,81 @@ def detect_silence(audio,threshold=1e-5,hopSize=512,frameSize=4096):
             return (n-5)*hopSize
     return 0
 
-def mwf(spec,mixture,niter=10):
+def inv2(C):
+    """
+    Closed form inverse of a batch of 2x2 matrices \"C\", shape (...,2,2)
+    """
+    det = C[...,0,0] * C[...,1,1] - C[...,0,1] * C[...,1,0]
+    inv = np.empty_like(C)
+    inv[...,0,0] = C[...,1,1]
+    inv[...,1,1] = C[...,0,0]
+    inv[...,0,1] = -C[...,0,1]
+    inv[...,1,0] = -C[...,1,0]
+    return inv / det[...,None,None]
+
+
+def mwf(spec,mixture,niter=10,block=64,eps=1e-10):
+    """
+    Multichannel Wiener filter: the power spectral densities of the sources (initialized from the magnitudes \"spec\")
+        and their spatial covariance matrices (initialized to identity) are refined by \"niter\" EM iterations,
+        then the sources are the spatial images filtered from the complex \"mixture\".
+        Frequencies are processed in blocks of \"block\" bins to bound the memory.
+
+    Parameters
+    ----------
+    spec : 4D numpy array
+        The estimated magnitudes of the sources, shape (nchannels,nsources,time,freq)
+    mixture : 3D numpy array
+        The complex spectrogram of the mixture, shape (nchannels,time,freq)
+    niter : int, optional
+        The number of EM iterations, 0 is the plain multichannel Wiener filter
+    block : int, optional
+        The number of frequency bins processed at once
+    eps : float, optional
+        Regularization of the mixture covariance and of the power spectral densities
+
+    Returns
+    -------
+    spec_out : 4D numpy array
+        The complex spectrograms of the spatial images of the sources, shape (nchannels,nsources,time,freq)
+    """
     nchannels = spec.shape[0]
     nsources = spec.shape[1]
-    time = spec.shape[2]
+    nframes = spec.shape[2]
     freq = spec.shape[3]
-
-    #initialize output
-    spec_out = np.zeros_like(spec,dtype=complex)
-
-    #initialize R
-    Rtemp = np.identity(nchannels,dtype=complex)
-    Rj=np.tile(Rtemp.reshape(1,1,nchannels,nchannels), (nsources,freq,1,1))
-    Rtemp = None
-
-# % ----- Apply Wiener filtering
-#     Se=zeros(I,F,N,J);
-#     for f=1:F
-#         for t=1:N
-#             if any(v(f,t,:)),
-#                 Rx=zeros(I,I); for j=1:J,  Rx=Rx+v(f,t,j)*R(:,:,f,t,j); end
-#                 for j=1:J,  Se(:,f,t,j)=v(f,t,j)*R(:,:,f,t,j)/Rx*reshape(X(f,t,:),I,1);  end
-#             end
-#         end
-#     end
-
-  # % ----- MAP by EM
-  #   for iter=1:ITER
-  #       for f=1:F
-  #           for t=1:N
-  #               if all(v(f,t,:)) && v(f,min(t+1,N),1) && v(min(f+1,F),t,2),
-  #                   Rx=zeros(I,I);  for j=1:J, Rx=Rx+v(f,t,j)*R(:,:,f,t,j);  end
-  #                   for j=1:J
-  #                       W=v(f,t,j)*R(:,:,f,t,j)/Rx;
-  #                       R_hat=W*Cx(:,:,f,t)*W'+v(f,t,j)*R(:,:,f,t,j)-W*v(f,t,j)*R(:,:,f,t,j);
-
-  #                       % update Rj M-step for all sources
-  #                       A=R_hat/v(f,t,j)+gamma1*sigma*R(:,:,f,max(t-1,1),j);
-  #                       c=gamma1*I+1;
-  #                       if ((t==N)||(gamma1==0)),
-  #                           %R(:,:,f,t,j)=A/(gamma1*(m+I)+1);
-  #                           R(:,:,f,t,j)=A/c;
-  #                       else
-  #                           if (t==1),
-  #                               A=R_hat/v(f,t,j); %c=gamma1+1-gamma1*m;
-  #                           end
-  #                           B=gamma1*sigma*inv(R(:,:,f,t+1,j));
-  #                           tempB=sqrtm(B);
-  #                           delta=(c^2)*eye(I)+4*tempB*A*tempB;
-  #                           R(:,:,f,t,j)=0.5*tempB\(-c*eye(I)+sqrtm(delta))/tempB;
-  #                       end
-
-    # for f in range(freq):
-    #     Rsum = np.zeros((freq,nchannels,nchannels),dtype=complex)
-    #     for i in range(nsources):
-    #         Rsum = Rsum + np.einsum('ik,kij->kij',np.mean(spec[:,i,:,:],axis=1),Rj[i,:,:,:])
-    #         #Rsum = Rsum + np.einsum('ik,kij->ij',np.mean(spec[:,i,:,f],axis=1),Rj[i,f,:,:])
-    #     for f in range(freq):
-    #         Rsum[f] = np.linalg.inv(Rsum[f])
-    #     for i in range(nsources):
-    #         mmul1 = np.einsum('ijl,lik->kjl',spec[:,i,:,:],Rj[i,:,:,:])
-    #         mmul2 = np.einsum('ijf,fik->kjf',mmul1,Rsum)
-    #         spec_out[:,i,:,:]=mmul2 * mixture
-    #         mul1 = np.einsum('ij,ik->kj',spec[:,i,:,f],Rj[i,f,:,:])
-    #         mul2 = np.einsum('ij,ik->kj',mul1,Rsum[f])
-    #         spec_out[:,i,:,f]=mul2 * mixture[:,:,f]
-    #         import pdb;pdb.set_trace()
-
-
-
-
-
-
-    for l in range(niter):
-        #compute the sum of the dot product of PSD and Rj for all sources in this channel
-        Rsum = np.zeros((freq,nchannels,nchannels),dtype=complex)
-        for i in range(nsources):
-            Rsum = Rsum + np.einsum('ik,kij->kij',np.mean(spec[:,i,:,:],axis=1),Rj[i,:,:,:]) #sum for all the sources
-        for f in range(freq):
-            Rsum[f] = np.linalg.inv(Rsum[f]) #invert sum
-        for i in range(nsources):
-            mmul1 = np.einsum('ijl,lik->kjl',spec[:,i,:,:],Rj[i,:,:,:])
-            Wf = np.einsum('ijf,fik->kjf',mmul1,Rsum) #compute filter by multiplying with the inverted sum
-            spec_out[:,i,:,:]=Wf * mixture #update spatial images
-            Rhat = np.einsum('iab,jab->abij',spec[:,i,:,:],spec[:,i,:,:].conj())
-
-            import pdb;pdb.set_trace()
-            Rj = np.sum(Rhat,axis=0)/np.sum(spec_out[:,i,:,:],axis=1)
-
-
-    # Rhat = np.zeros((nchannels,nsources,freq),dtype=complex)
-
-    # for j in range(nchannels):
-    #     for i in range(nsources):
-    #         Rdot = np.dot(spec[j,i],spec[j,i].conj().T)
-    #         Rtemp = np.sum(Rdot)
-    #         v=np.power(np.abs(spec[j,i]),2)/2.
-    #         vsum=np.sum(v,axis=0)
-    #         Rhat[j,i] = Rtemp/vsum
-    # Rdot=None
-    # Rtemp=None
-    # v=None
-    # vsum = None
-
-    # for j in range(nchannels):
-    #     for i in range(nsources):
-    #         v=np.power(np.abs(spec[j,i]),2)/2.
-    #         Rtemp = np.dot(v,Rhat[j,i])
-    #         import pdb;pdb.set_trace()
-    #     for i in range(nsources):
-
-    #         v=np.power(np.abs(spec[j,i]),2)/2.
-    #         S = v * Rhat[j,i]
+    inverse = inv2 if nchannels == 2 else np.linalg.inv
+    identity = np.identity(nchannels,dtype=complex)
+
+    spec_out = np.zeros(spec.shape,dtype=complex)
+    for f0 in range(0, freq, block):
+        f1 = np.minimum(f0 + block, freq)
+        #x (time,freq,channels), v (sources,time,freq), R (sources,freq,channels,channels)
+        x = np.transpose(mixture[:,:,f0:f1], (1,2,0)).astype(complex)
+        v = np.mean(np.power(np.abs(spec[:,:,:,f0:f1]),2), axis=0) + eps
+        R = np.tile(identity, (nsources,f1-f0,1,1))
+        for l in range(niter + 1):
+            #mixture covariance for all (time,freq) bins, its inverse and z = Cx^-1 x
+            Cx = np.einsum('jtf,jfab->tfab', v, R) + eps * identity
+            iCx = inverse(Cx)
+            z = np.einsum('tfab,tfb->tfa', iCx, x)
+            if l == niter:
+                #the filtered spatial images v_j R_j Cx^-1 x
+                y = v[:,:,:,None] * np.einsum('jfab,tfb->jtfa', R, z)
+                spec_out[:,:,:,f0:f1] = np.transpose(y, (3,0,1,2))
+                break
+            #the posterior covariance of the spatial image j is v_j R_j + v_j^2 R_j A R_j with A = z z^H - Cx^-1
+            A = np.einsum('tfa,tfb->tfab', z, z.conj()) - iCx
+            for j in range(nsources):
+                Rj = R[j].copy()
+                #R_j <- mean over time of the posterior covariance / v_j
+                R[j] = Rj + np.einsum('fab,fbc,fcd->fad', Rj, np.einsum('tf,tfab->fab', v[j], A) / nframes, Rj)
+                #v_j <- trace(R_j^-1 posterior covariance) / nchannels
+                iR = inverse(R[j] + eps * identity)
+                P = np.einsum('fab,fbc,fcd->fad', Rj, iR, Rj)
+                trace = np.real(np.einsum('fba,tfab->tf', P, A)) * np.power(v[j],2) + \
+                    np.real(np.einsum('fab,fba->f', iR, Rj))[None,:] * v[j]
+                v[j] = np.maximum(trace / nchannels, eps)
+    return spec_out
 
 
 # def detect_silence(audio,threshold=1e-5,hopsize=512,lengthWindow=4096):